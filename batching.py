@@ -0,0 +1,108 @@
+"""
+同時に到着したリクエストをまとめて処理するバッチ処理の共通部品
+チャットサービスと翻訳サービスのバッチ処理で共有する
+"""
+
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+import abc
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class BatcherClosedError(RuntimeError):
+    """close() 後のバッチ処理に要求を登録しようとした"""
+
+
+def run_batches(work_queue: "queue.Queue", max_batch: int, max_wait: float, process: Callable[[List], None]) -> None:
+    """
+    キューから最大 max_batch 件（max_wait 秒以内に到着した分）ずつ取り出して process に渡す
+
+    終了要求（None）を受け取ったら、それまでに取り出した分を処理して戻る
+    process が例外を送出してもログに記録して処理を続ける（スレッドが終了すると以降の要求が処理されなくなるため）
+    """
+    while True:
+        item = work_queue.get()
+        if item is None:
+            return
+        items = [item]
+        deadline = time.monotonic() + max_wait
+        while len(items) < max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = work_queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                _process_safely(process, items)
+                return
+            items.append(item)
+        _process_safely(process, items)
+
+
+def _process_safely(process: Callable[[List], None], items: List) -> None:
+    try:
+        process(items)
+    except Exception:
+        logger.exception("Batch processing failed")
+
+
+class QueueBatcher(abc.ABC):
+    """
+    バックグラウンドスレッドでキューから要求をまとめて取り出し、_process で一括処理するバッチ処理の基底クラス
+
+    サブクラスは _process（(要求, Future) のリストを受け取り、各Futureに結果を設定する）を実装する
+    """
+
+    name = "batcher"
+
+    def __init__(self, max_batch: int, max_wait_ms: float):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[Optional[Tuple[Any, Future]]]" = queue.Queue()
+        self._closed = False
+        self._submit_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def _enqueue(self, request: Any) -> Future:
+        """要求を登録し、結果を受け取るFutureを返す"""
+        future: Future = Future()
+        with self._submit_lock:
+            if self._closed:
+                raise BatcherClosedError(f"{self.name} is closed")
+            self._queue.put((request, future))
+        return future
+
+    def close(self) -> None:
+        """登録済みの要求を処理した後にバックグラウンドスレッドを終了"""
+        with self._submit_lock:
+            self._closed = True
+            self._queue.put(None)
+
+    def _run(self) -> None:
+        run_batches(self._queue, self.max_batch, self.max_wait, self._dispatch)
+
+    def _dispatch(self, items: List[Tuple[Any, Future]]) -> None:
+        # キャンセル済みの要求は処理しない（実行中にした Future はキャンセルされず、結果の設定が失敗しない）
+        items = [(request, future) for request, future in items if future.set_running_or_notify_cancel()]
+        if not items:
+            return
+        try:
+            self._process(items)
+        except Exception as e:
+            # 結果を受け取れないまま待ち続ける呼び出し側が残らないよう、未完了の要求を失敗させる
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+
+    @abc.abstractmethod
+    def _process(self, items: List[Tuple[Any, Future]]) -> None:
+        """(要求, Future) のリストを一括処理し、各Futureに結果または例外を設定する"""
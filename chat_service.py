@@ -3,15 +3,35 @@ OpenVINOを使ったチャットサービス
 軽量LLMを使用してチャット機能を実現
 """
 
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from pathlib import Path
-from typing import Optional, Dict, List
-from datetime import datetime, timedelta
+from typing import Callable, Deque, Generator, Iterator, Optional, Dict, List, Mapping, NamedTuple, Sequence, Tuple, Union
+from datetime import datetime
+import asyncio
+import functools
+import gc
+import itertools
 import logging
+import re
+import time
+import types
 import uuid
 import threading
-
-from optimum.intel import OVModelForCausalLM
-from transformers import AutoTokenizer
+import weakref
+
+import torch
+from filelock import FileLock
+from optimum.intel import OVModelForCausalLM, OVWeightQuantizationConfig
+from transformers import (
+    AutoTokenizer,
+    LogitsProcessor,
+    LogitsProcessorList,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+)
+from batching import BatcherClosedError, QueueBatcher
 from prompt_improvement_engine import process_prompt_improvement_request, process_prompt_generation_request
 
 logging.basicConfig(level=logging.INFO)
@@ -19,8 +39,9 @@ logger = logging.getLogger(__name__)
 
 
 # タスク固有のシステムプロンプトテンプレート
-TASK_PROMPTS = {
-    "image_prompt_improvement": """You are a professional image generation prompt editor.
+TASK_PROMPTS: Mapping[str, str] = types.MappingProxyType(
+    {
+        "image_prompt_improvement": """You are a professional image generation prompt editor.
 
 CRITICAL INSTRUCTIONS - MUST FOLLOW EXACTLY:
 1. The user will give you a prompt to improve
@@ -43,7 +64,7 @@ REQUIREMENTS:
 
 OUTPUT:
 The improved prompt text only. Just the text. 1-2 sentences. Nothing else. No explanations. No additional text.""",
-    "image_prompt_generation": """You are a professional image generation prompt writer.
+        "image_prompt_generation": """You are a professional image generation prompt writer.
 
 CRITICAL INSTRUCTIONS - MUST FOLLOW EXACTLY:
 1. The user will describe what image they want
@@ -66,11 +87,483 @@ REQUIREMENTS:
 
 OUTPUT:
 The image prompt text only. Japanese only. 1-2 sentences. Nothing else.""",
-    "general": """You are a helpful and professional assistant.
+        "general": """You are a helpful and professional assistant.
 Answer user questions accurately and clearly.
 If you're unsure about something, say so.
 Use the user's language for responses.""",
-}
+    }
+)
+
+# 重みのみ量子化の設定（quantization -> OVWeightQuantizationConfig の引数）
+# fp16 は量子化なし（エクスポート時のデフォルト精度）
+QUANTIZATION_PRESETS: Mapping[str, Optional[Mapping]] = types.MappingProxyType(
+    {
+        "fp16": None,
+        "int8": types.MappingProxyType({"bits": 8, "sym": True}),
+        "int4": types.MappingProxyType({"bits": 4, "sym": True, "group_size": 128, "ratio": 0.8}),
+    }
+)
+
+# 生成テキストから削除する特殊トークンやフォーマット記号（1回の走査でまとめて削除）
+_SPECIAL_TOKENS_RE = re.compile(
+    "|".join(
+        re.escape(token)
+        for token in (
+            "</s>",
+            "<|im_start|>",
+            "<|im_end|>",
+            "<|assistant|>",
+            "<|user|>",
+            "質問:",
+            "回答:",
+            "指示:",
+            "【システムプロンプト】",
+            "【会話履歴】",
+            "【応答】",
+            "ユーザー:",
+            "アシスタント:",
+        )
+    )
+)
+
+# 次のターンの開始を示す区切り（最初に現れた位置以降を切り捨てる）
+_TURN_DELIMITERS = ("\n<|im_start|>", "\n質問:", "\n回答:", "\n指示:", "\nユーザー:", "\nアシスタント:")
+_TURN_DELIMITER_RE = re.compile("|".join(map(re.escape, _TURN_DELIMITERS)))
+_TURN_DELIMITER_MAX_LENGTH = max(map(len, _TURN_DELIMITERS))
+
+# 画像プロンプト生成の依頼を示すキーワード
+GENERATION_KEYWORDS: Tuple[str, ...] = (
+    "プロンプト作成",
+    "プロンプト生成",
+    "プロンプトを作",
+    "プロンプトを生",
+    "プロンプト欲しい",
+    "プロンプトください",
+)
+
+# 小文字化したメッセージに対して1回の走査で判定
+_GENERATION_KEYWORDS_RE = re.compile("|".join(map(re.escape, GENERATION_KEYWORDS)))
+
+# 画像プロンプトの後処理で削除する説明的な文のマーカー
+EXPLANATION_MARKERS: Tuple[str, ...] = (
+    "しかし",
+    "ただし",
+    "ただ",
+    "ところで",
+    "つまり",
+    "注意",
+    "注：",
+    "注意：",
+    "備考",
+    "※",
+    "⚠",
+    "ご了承",
+    "可能性",
+    "可能",
+    "おそらく",
+    "と思われ",
+    "と考えられ",
+    "かもしれません",
+    "この改善",
+    "改善内容",
+    "改善点",
+    "理由",
+    "映像解像",
+    "光源",
+    "技術的",
+    "撮影",
+    "一部で",
+)
+
+_EXPLANATION_MARKERS_RE = re.compile("|".join(map(re.escape, EXPLANATION_MARKERS)))
+
+# 画像プロンプトに混在した英語・ローマ字表記 -> 日本語
+ROMAJI_REPLACEMENTS: Mapping[str, str] = types.MappingProxyType(
+    {
+        "STUDIO": "スタジオ",
+        "studio": "スタジオ",
+        "studioo": "スタジオ",
+        "スタUDIO": "スタジオ",
+        " MIRROR": "鏡",
+        "MIRROR": "鏡",
+        "mirror": "鏡",
+        " FLOOR": "床",
+        "FLOOR": "床",
+        "floor": "床",
+        "フLOOR": "床",
+        " LIGHTING": "照明",
+        "LIGHTING": "照明",
+        "lighting": "照明",
+        "LIGHINING": "照明",
+        " BARRE": "バー",
+        "BARRE": "バー",
+        "barre": "バー",
+        "BAR": "バー",
+        "bar": "バー",
+        "PROFESSIONAL": "プロフェッショナル",
+        "professional": "プロフェッショナル",
+        "WIDE AREA": "広々とした空間",
+        "DANCE CLASS": "ダンスクラス",
+    }
+)
+
+# 長い表記を優先して一致させ（"BARRE" を "BAR" より先に）、1回の走査で置換する
+_ROMAJI_REPLACE_RE = re.compile("|".join(sorted(map(re.escape, ROMAJI_REPLACEMENTS), key=len, reverse=True)))
+
+
+class _PromptTemplate(NamedTuple):
+    """モデル形式ごとのチャットプロンプトテンプレート"""
+
+    separator: str  # 各パートの区切り文字
+    system: Tuple[str, str]  # システムプロンプトの前後に付ける文字列
+    turns: Mapping[str, Tuple[str, str]]  # ロール -> 会話ターンの前後に付ける文字列
+    trigger: str  # 応答開始トリガー
+    window: Optional[int] = None  # 直近何件の履歴を使うか（None は全件、追記形式のキャッシュが可能）
+
+
+# モデル形式 -> プロンプトテンプレート
+PROMPT_TEMPLATES: Mapping[str, _PromptTemplate] = types.MappingProxyType(
+    {
+        "qwen": _PromptTemplate(
+            separator="\n",
+            system=("<|im_start|>system\n", "<|im_end|>"),
+            turns={"user": ("<|im_start|>user\n", "<|im_end|>"), "assistant": ("<|im_start|>assistant\n", "<|im_end|>")},
+            trigger="<|im_start|>assistant\n",
+        ),
+        "phi": _PromptTemplate(
+            separator="",
+            system=("<|system|>\n", "<|end|>\n"),
+            turns={"user": ("<|user|>\n", "<|end|>\n"), "assistant": ("<|assistant|>\n", "<|end|>\n")},
+            trigger="<|assistant|>\n",
+        ),
+        "tinyllama": _PromptTemplate(
+            separator="\n",
+            system=("<|system|>\n", "</s>"),
+            turns={"user": ("<|user|>\n", "</s>"), "assistant": ("<|assistant|>\n", "</s>")},
+            trigger="<|assistant|>",
+        ),
+        # 日本語モデル用の詳細な形式（最後の6メッセージまで）
+        "simple": _PromptTemplate(
+            separator="\n",
+            system=("システム: ", "\n"),
+            turns={"user": ("ユーザー: ", ""), "assistant": ("アシスタント: ", "")},
+            trigger="\nアシスタント:",
+            window=6,
+        ),
+    }
+)
+
+# 生成パラメータのデフォルト
+_DEFAULT_GENERATION_PARAMS: Mapping[str, float] = types.MappingProxyType(
+    {
+        "do_sample": True,
+        "max_new_tokens": 100,
+        "temperature": 0.5,
+        "top_p": 0.85,
+        "top_k": 40,
+        "repetition_penalty": 1.5,
+        "no_repeat_ngram_size": 5,
+    }
+)
+
+# モデル形式 -> 生成パラメータ（未定義の形式はデフォルトを使う）
+GENERATION_PARAMS: Mapping[str, Mapping[str, float]] = types.MappingProxyType(
+    {
+        # Phiはより保守的なパラメータが良い
+        "phi": types.MappingProxyType({**_DEFAULT_GENERATION_PARAMS, "temperature": 0.3, "top_p": 0.8, "max_new_tokens": 80}),
+        # Qwen向け
+        "qwen": types.MappingProxyType(
+            {**_DEFAULT_GENERATION_PARAMS, "temperature": 0.7, "top_p": 0.85, "max_new_tokens": 150}
+        ),
+    }
+)
+
+
+# 出力が一意に決まるべきタスク（サンプリングせず貪欲法で生成する）
+_GREEDY_TASK_TYPES = frozenset({"image_prompt_improvement", "image_prompt_generation"})
+
+# 貪欲法での生成パラメータ（temperature / top_p / top_k は使わない）
+_GREEDY_GENERATION_PARAMS: Mapping[str, float] = types.MappingProxyType(
+    {
+        "do_sample": False,
+        "num_beams": 1,
+        "max_new_tokens": 100,
+        "repetition_penalty": 1.2,
+        "no_repeat_ngram_size": 5,
+    }
+)
+
+
+@functools.lru_cache(maxsize=32)
+def _format_family(model_name: str) -> str:
+    """モデル名からプロンプト形式を判定（モデル名ごとに一度だけ判定してキャッシュ）"""
+    if "Qwen" in model_name:
+        return "qwen"
+    elif "Phi" in model_name or "phi" in model_name:
+        return "phi"
+    elif "TinyLlama" in model_name:
+        return "tinyllama"
+    return "simple"
+
+
+# モック応答のキーワードと応答（上にあるものほど優先）
+_MOCK_REPLIES = (
+    (("こんにちは", "hello"), "こんにちは！どのようにお手伝いできますか？"),
+    (("ありがとう", "thank"), "どういたしまして！他に何かお手伝いできることはありますか？"),
+    (("さようなら", "bye"), "さようなら！また何かあればお気軽にどうぞ。"),
+    (("天気", "weather"), "申し訳ありませんが、私は天気情報にアクセスできません。お近くの気象情報をご確認ください。"),
+    (("名前", "name"), "私はOpenVINO AI Toolkitのアシスタントです。"),
+    (
+        ("?", "？"),
+        "「{message}」についてのご質問ですね。申し訳ありませんが、現在はモックモードで動作しているため、詳細な回答は提供できません。",
+    ),
+)
+_MOCK_DEFAULT_REPLY = "ご質問ありがとうございます。現在はモックモードで動作しているため、限定的な応答のみ提供しています。実際のLLMモデルを使用する場合は、適切な日本語対応モデル（rinna/japanese-gpt-neox-small等）の設定をご検討ください。"
+
+# 応答ごとに名前付きグループを持つ1つのパターン（先頭からの先読みを優先度順に並べ、
+# 1回の match で最も優先度の高い応答のグループが一致する）
+_MOCK_REPLY_RE = re.compile(
+    "|".join(
+        f"(?=.*?(?P<r{i}>{'|'.join(re.escape(keyword) for keyword in keywords)}))"
+        for i, (keywords, _) in enumerate(_MOCK_REPLIES)
+    ),
+    re.DOTALL,
+)
+# グループ名 -> 応答
+_MOCK_REPLY_BY_GROUP = types.MappingProxyType({f"r{i}": reply for i, (_, reply) in enumerate(_MOCK_REPLIES)})
+
+
+class _TokenizeBatcher(QueueBatcher):
+    """
+    同時に到着したトークナイズ要求をまとめて1回のバッチ呼び出しで処理
+
+    バックグラウンドスレッドがキューから最大 max_batch 件（max_wait_ms 以内に到着した分）を取り出し、
+    高速トークナイザーにリストで渡した後、パディングを除いた行ごとの結果を各Futureに返す
+    """
+
+    name = "tokenize-batcher"
+
+    def __init__(self, tokenizer, max_batch: int = 32, max_wait_ms: float = 5.0, max_length: int = 2048):
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        super().__init__(max_batch, max_wait_ms)
+
+    def submit(self, prompt: str) -> Future:
+        """トークナイズ要求を登録し、結果を受け取るFutureを返す"""
+        return self._enqueue(prompt)
+
+    def _process(self, items: List[Tuple[str, Future]]) -> None:
+        try:
+            batch = self.tokenizer(
+                [prompt for prompt, _ in items],
+                return_tensors="pt",
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+            )
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+            return
+
+        for i, (_, future) in enumerate(items):
+            # パディング位置を除外して単独でトークナイズした場合と同じ形にする
+            mask = batch["attention_mask"][i].bool()
+            future.set_result(
+                {
+                    "input_ids": batch["input_ids"][i][mask].unsqueeze(0),
+                    "attention_mask": batch["attention_mask"][i][mask].unsqueeze(0),
+                }
+            )
+
+
+class _GenerationBatcher(QueueBatcher):
+    """
+    同時に到着した生成要求をまとめて1回の model.generate で処理
+
+    バックグラウンドスレッドがキューから最大 max_batch 件（max_wait_ms 以内に到着した分）を取り出し、
+    デコーダーモデル向けに左パディングしてバッチ生成した後、行ごとの生成トークン列を各Futureに返す
+    """
+
+    name = "generation-batcher"
+
+    def __init__(
+        self,
+        generate: Callable[[Dict], "torch.Tensor"],
+        pad_token_id: int,
+        max_batch: int = 8,
+        max_wait_ms: float = 20.0,
+    ):
+        self.generate = generate
+        self.pad_token_id = pad_token_id
+        super().__init__(max_batch, max_wait_ms)
+
+    def submit(self, input_ids: "torch.Tensor") -> Future:
+        """生成要求（パディングなしの1行分の入力トークン列）を登録し、生成トークン列を受け取るFutureを返す"""
+        return self._enqueue(input_ids)
+
+    def _process(self, items: List[Tuple["torch.Tensor", Future]]) -> None:
+        # 生成は入力の末尾から続くため、すべての行の末尾が揃うように左側をパディングする
+        max_length = max(input_ids.shape[-1] for input_ids, _ in items)
+        input_ids = torch.full((len(items), max_length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(items), max_length), dtype=torch.long)
+        for i, (row, _) in enumerate(items):
+            input_ids[i, max_length - row.shape[-1] :] = row
+            attention_mask[i, max_length - row.shape[-1] :] = 1
+
+        try:
+            outputs = self.generate({"input_ids": input_ids, "attention_mask": attention_mask})
+        except Exception as e:
+            for _, future in items:
+                future.set_exception(e)
+            return
+
+        for i, (_, future) in enumerate(items):
+            future.set_result(outputs[i][max_length:])
+
+
+class _IncrementalNoRepeatNGramLogitsProcessor(LogitsProcessor):
+    """
+    同じN-gramの繰り返しを禁止するロジットプロセッサ
+
+    transformers標準の実装は毎ステップ全トークン列からN-gram表を作り直すが、
+    こちらは前ステップ以降に追加されたトークン分だけ表を更新する。
+    生成1回ごとに新しいインスタンスを使うこと。
+    """
+
+    def __init__(self, ngram_size: int):
+        if ngram_size < 1:
+            raise ValueError(f"ngram_size must be a positive integer, got {ngram_size}")
+        self.ngram_size = ngram_size
+        self._tokens: List[List[int]] = []  # 行ごとのトークン列
+        self._ngrams: List[Dict[Tuple[int, ...], set]] = []  # 行ごとの (N-1)-gram -> 後続トークン集合
+        self._seen_length = 0
+
+    def __call__(self, input_ids, scores):
+        n = self.ngram_size
+        if not self._tokens:
+            self._tokens = [[] for _ in range(input_ids.shape[0])]
+            self._ngrams = [{} for _ in range(input_ids.shape[0])]
+
+        # 前ステップ以降に追加されたトークンのみN-gram表に登録
+        new_tokens = input_ids[:, self._seen_length :].tolist()
+        self._seen_length = input_ids.shape[1]
+        for tokens, ngrams, added in zip(self._tokens, self._ngrams, new_tokens):
+            for token in added:
+                tokens.append(token)
+                if len(tokens) >= n:
+                    ngrams.setdefault(tuple(tokens[len(tokens) - n : -1]), set()).add(token)
+
+        for row, (tokens, ngrams) in enumerate(zip(self._tokens, self._ngrams)):
+            if len(tokens) + 1 < n:
+                continue
+            banned = ngrams.get(tuple(tokens[len(tokens) - n + 1 :]))
+            if banned:
+                scores[row, list(banned)] = -float("inf")
+        return scores
+
+
+class _LoadedModel:
+    """ロード済みのモデルとトークナイザーの組（プロセス内で共有する）"""
+
+    __slots__ = ("model", "tokenizer", "__weakref__")
+
+    def __init__(self, model, tokenizer):
+        self.model = model
+        self.tokenizer = tokenizer
+
+
+# (モデルパス, OpenVINO設定) -> ロード済みモデル
+# 同じモデルを使う ChatService インスタンス間で共有し、どのインスタンスからも参照されなくなれば解放される
+_MODEL_CACHE: "weakref.WeakValueDictionary[Tuple, _LoadedModel]" = weakref.WeakValueDictionary()
+_MODEL_CACHE_LOCK = threading.Lock()
+
+# 同じトークナイザーを使うモデルファミリー（モデル名の接頭辞, 接尾辞, 共有キー）
+_TOKENIZER_FAMILIES = (("Qwen/Qwen2.5-", "-Instruct", "qwen2.5-instruct"),)
+
+
+@functools.lru_cache(maxsize=32)
+def _tokenizer_key(model_name: str) -> str:
+    """トークナイザーの共有キーを取得（ファミリーに属さないモデルはモデル名そのもの）"""
+    for prefix, suffix, key in _TOKENIZER_FAMILIES:
+        if model_name.startswith(prefix) and model_name.endswith(suffix):
+            return key
+    return model_name
+
+
+class _Session:
+    """チャットセッションの状態（属性を固定してセッションごとの辞書を持たない）"""
+
+    __slots__ = (
+        "messages",
+        "system_prompt",
+        "model_name",
+        "template",
+        "task_type",
+        "created_at_ts",
+        "last_access_mono",
+        "kv",
+        "kv_input_ids",
+        "prompt_cache",
+        "prompt_cache_key",
+        "prefix_tokens",
+    )
+
+    def __init__(
+        self,
+        messages: Deque[Dict],
+        system_prompt: str,
+        model_name: str = "",
+        template: Optional[_PromptTemplate] = None,
+        task_type: str = "general",
+        created_at_ts: Optional[float] = None,
+        last_access_mono: Optional[float] = None,
+    ):
+        self.messages = messages
+        self.system_prompt = system_prompt
+        self.model_name = model_name
+        self.template = template
+        self.task_type = task_type
+        self.created_at_ts = time.time() if created_at_ts is None else created_at_ts  # エポック秒（表示用）
+        self.last_access_mono = time.monotonic() if last_access_mono is None else last_access_mono
+        self.kv = None  # 前ターンのKVキャッシュ（reuse_kv_cache有効時）
+        self.kv_input_ids = None  # KVキャッシュに対応する入力トークン列
+        self.prompt_cache: Optional[str] = None  # 前ターンまでのフォーマット済みプロンプト
+        self.prompt_cache_key: Optional[Tuple] = None
+        # (モデル名, prompt_cache, そのトークンID列)。組で差し替えてスレッド間で不整合にならないようにする
+        self.prefix_tokens: Optional[Tuple[str, str, List[int]]] = None
+
+
+class _StopOnEvent(StoppingCriteria):
+    """イベントが設定されたら生成を止める停止条件（区切りの検出やクライアントの切断で以降の生成を打ち切る）"""
+
+    def __init__(self, stop: threading.Event):
+        self.stop = stop
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.stop.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+def _generate_to_streamer(model, streamer: TextIteratorStreamer, **kwargs):
+    """ストリーマーに出力しながら生成（失敗時も受信側が待ち続けないよう終了を通知する）"""
+    try:
+        return model.generate(streamer=streamer, **kwargs)
+    except Exception:
+        streamer.on_finalized_text("", stream_end=True)
+        raise
+
+
+def _run_session_cleanup(service_ref: "weakref.ref", stop: threading.Event, interval: float) -> None:
+    """一定間隔で期限切れセッションを削除（サービスが破棄されるか close() されたら終了）"""
+    while not stop.wait(interval):
+        service = service_ref()
+        if service is None:
+            return
+        try:
+            service._cleanup_old_sessions()
+        except Exception as e:
+            logger.error("Session cleanup error: %s", e)
+        del service
 
 
 class ChatService:
@@ -84,6 +577,18 @@ class ChatService:
         session_timeout_minutes: int = 60,
         max_sessions: int = 100,
         use_mock: bool = False,  # モックモードを追加
+        quantization: str = "int8",
+        reuse_kv_cache: bool = False,
+        batch_tokenization: bool = False,
+        performance_hint: str = "THROUGHPUT",
+        num_streams: Optional[str] = None,
+        inference_precision_hint: Optional[str] = None,
+        kv_cache_precision: Optional[str] = "u8",
+        dynamic_quantization_group_size: Optional[str] = "32",
+        batch_generation: bool = False,
+        warmup: bool = False,
+        model_capacity: int = 2,
+        batch_timeout: float = 300.0,
     ):
         """
         チャットサービスの初期化
@@ -95,24 +600,79 @@ class ChatService:
             session_timeout_minutes: セッションタイムアウト（分）
             max_sessions: 最大セッション数
             use_mock: モックモードを使用（開発・デモ用）
+            quantization: 重みの量子化形式（"fp16", "int8", "int4"）
+            reuse_kv_cache: セッションごとにKVキャッシュを保持して会話ターン間で再利用する
+            batch_tokenization: 同時リクエストのトークナイズをまとめてバッチ処理する
+            performance_hint: OpenVINOの性能ヒント（"THROUGHPUT" または "LATENCY"）
+            num_streams: 推論ストリーム数（例: "AUTO", "1"。未指定時は性能ヒントに従う）
+            inference_precision_hint: 推論精度ヒント（例: "bf16"。未指定時はデバイスのデフォルト）
+            kv_cache_precision: KVキャッシュの精度（"u8" でメモリ帯域を削減。None でデバイスのデフォルト）
+            dynamic_quantization_group_size: 活性値の動的量子化グループサイズ（None でデバイスのデフォルト）
+            batch_generation: 同時リクエストの生成を1回の model.generate にまとめる（reuse_kv_cache 有効時は無効）
+            warmup: モデルのロード直後に短い生成を1回行い、初回リクエストの初期化コストを先に払う
+            model_capacity: 同時に保持するモデル数の上限（超えると最も長く使われていないモデルを解放）
+            batch_timeout: バッチ処理（トークナイズ・生成）の結果を待つ最大秒数
         """
+        if quantization not in QUANTIZATION_PRESETS:
+            raise ValueError(f"Unknown quantization: {quantization}. Available: {list(QUANTIZATION_PRESETS.keys())}")
+        if model_capacity < 1:
+            raise ValueError(f"model_capacity must be at least 1: {model_capacity}")
+
         self.model_name = model_name
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
         self.max_history_messages = max_history_messages
-        self.session_timeout = timedelta(minutes=session_timeout_minutes)
+        self.session_timeout_s = session_timeout_minutes * 60.0
         self.max_sessions = max_sessions
         self.use_mock = use_mock
+        self.quantization = quantization
+        # KVキャッシュをセッションに保持するため、KVを入出力として持つ非ステートフル形式でエクスポートする
+        self.reuse_kv_cache = reuse_kv_cache
+        self.batch_tokenization = batch_tokenization
+        self.performance_hint = performance_hint
+        self.num_streams = num_streams
+        self.inference_precision_hint = inference_precision_hint
+        self.kv_cache_precision = kv_cache_precision
+        self.dynamic_quantization_group_size = dynamic_quantization_group_size
+        # セッションごとのKVキャッシュはバッチにまとめられないため、KV再利用時は個別に生成する
+        self.batch_generation = batch_generation and not reuse_kv_cache
+        self.warmup = warmup
+        self.model_capacity = model_capacity
+        self.batch_timeout = batch_timeout
 
         # モデルとトークナイザー（複数モデルをキャッシュ）
-        self.models: Dict[str, any] = {}  # model_name -> model
+        # 最終使用順（古い順）に保持し、model_capacity を超えたらLRUで解放する
+        self.models: "OrderedDict[str, any]" = OrderedDict()  # model_name -> model
         self.tokenizers: Dict[str, any] = {}  # model_name -> tokenizer
-        self.models_lock = threading.Lock()
+        # トークナイザーの共有キー -> トークナイザー（同じ tokenizer.json を使うモデル間で共有し、
+        # どのモデルからも使われなくなれば解放される。_load_lock を保持して更新する）
+        self._tokenizer_cache: "weakref.WeakValueDictionary[str, any]" = weakref.WeakValueDictionary()
+        self.tokenize_batchers: Dict[str, _TokenizeBatcher] = {}  # model_name -> batcher
+        self.generation_batchers: Dict[str, _GenerationBatcher] = {}  # model_name -> batcher
+        self._loaded_models: Dict[str, _LoadedModel] = {}  # model_name -> 共有キャッシュのエントリ（参照を保持）
+        self.models_lock = threading.Lock()  # models などへの書き込みと使用順の更新用
+        self._load_lock = threading.Lock()  # 同じモデルの重複ロードを防ぐ
 
         # セッション管理（メモリ内）
-        # session_id -> {"messages": [...], "system_prompt": str, "model_name": str, "created_at": datetime, "last_access": datetime}
-        self.sessions: Dict[str, Dict] = {}
+        # session_id -> _Session
+        # 最終アクセス順（古い順）に保持し、LRUで追い出す
+        self.sessions: "OrderedDict[str, _Session]" = OrderedDict()
         self.sessions_lock = threading.Lock()
+        self.cleanup_interval_seconds = 30
+
+        # 期限切れセッションの走査はリクエスト処理とは別にバックグラウンドで一定間隔ごとに行う
+        # （スレッドがインスタンスを参照し続けないよう弱参照を渡す）
+        self._cleanup_stop = threading.Event()
+        self._cleanup_thread = threading.Thread(
+            target=_run_session_cleanup,
+            args=(weakref.ref(self), self._cleanup_stop, self.cleanup_interval_seconds),
+            name="chat-session-cleanup",
+            daemon=True,
+        )
+        self._cleanup_thread.start()
+
+        # 生成専用のスレッドプール（推論ストリーム数に合わせる）
+        self._gen_executor = ThreadPoolExecutor(max_workers=self._get_generation_workers(), thread_name_prefix="chat-generate")
 
         # デフォルトモデルをロード（モックモードでない場合のみ）
         if not self.use_mock:
@@ -120,46 +680,231 @@ class ChatService:
         else:
             logger.info("Chat service initialized in MOCK mode")
 
-    def _load_model(self, model_name: str = None):
-        """LLMモデルをロード"""
+    def _load_model(self, model_name: str = None) -> _LoadedModel:
+        """
+        LLMモデルをロード
+
+        Returns:
+            登録したモデル（既にロード済みの場合は登録済みのモデル）
+        """
         if model_name is None:
             model_name = self.model_name
 
-        # 既にロード済みの場合はスキップ
+        # 既にロード済みの場合はスキップ（ロード待ちのロックを取らずに確認する）
+        loaded = self._get_registered_model(model_name)
+        if loaded is not None:
+            logger.info("Model already loaded: %s", model_name)
+            return loaded
+
+        with self._load_lock:
+            # ロック待ちの間に他のスレッドがロードした場合は再ロードしない
+            loaded = self._get_registered_model(model_name)
+            if loaded is not None:
+                return loaded
+            return self._load_model_unlocked(model_name)
+
+    def _get_registered_model(self, model_name: str) -> Optional[_LoadedModel]:
+        """このインスタンスに登録済みのモデルを取得（未登録なら None）"""
         with self.models_lock:
-            if model_name in self.models:
-                logger.info(f"Model already loaded: {model_name}")
-                return
+            return self._loaded_models.get(model_name)
 
+    def _load_model_unlocked(self, model_name: str) -> _LoadedModel:
+        """LLMモデルをロード（_load_lock を保持した状態で呼び出すこと）"""
         try:
-            logger.info(f"Loading chat model: {model_name}")
-            model_path = self.cache_dir / model_name.replace("/", "_")
+            model_path = self._get_model_path(model_name)
+            cache_key = (str(model_path.resolve()), tuple(sorted(self._get_ov_config().items())))
+
+            # 他のインスタンスが同じモデルをロード済みであれば共有する
+            with _MODEL_CACHE_LOCK:
+                loaded = _MODEL_CACHE.get(cache_key)
+            if loaded is not None:
+                logger.info("Reusing chat model loaded in this process: %s", model_name)
+                self._register_model(model_name, loaded)
+                return loaded
+
+            logger.info("Loading chat model: %s (%s)", model_name, self.quantization)
 
             # モデルが既にエクスポートされているか確認
-            if not model_path.exists():
-                logger.info("Exporting chat model to OpenVINO format...")
-                model = OVModelForCausalLM.from_pretrained(model_name, export=True, compile=True)
-                model.save_pretrained(model_path)
-            else:
+            # （複数ワーカーが同時に起動しても1プロセスだけがエクスポートし、他は保存の完了を待つ）
+            with FileLock(str(model_path) + ".lock"):
+                exported = model_path.exists()
+                if not exported:
+                    logger.info("Exporting chat model to OpenVINO format...")
+                    # 量子化済みのモデルを保存し、次回以降の再量子化を省略する
+                    model = OVModelForCausalLM.from_pretrained(
+                        model_name,
+                        export=True,
+                        compile=True,
+                        stateful=not self.reuse_kv_cache,
+                        quantization_config=self._get_quantization_config(),
+                        ov_config=self._get_ov_config(),
+                    )
+                    model.save_pretrained(model_path)
+            if exported:
                 logger.info("Loading cached OpenVINO chat model...")
-                model = OVModelForCausalLM.from_pretrained(model_path, compile=True)
+                model = OVModelForCausalLM.from_pretrained(model_path, compile=True, ov_config=self._get_ov_config())
 
-            tokenizer = AutoTokenizer.from_pretrained(model_name)
+            tokenizer = self._get_shared_tokenizer(model_name, model_path)
 
-            # パディングトークンの設定
-            if tokenizer.pad_token is None:
-                tokenizer.pad_token = tokenizer.eos_token
+            if self.warmup:
+                self._warmup_model(model, tokenizer, model_name)
 
-            with self.models_lock:
-                self.models[model_name] = model
-                self.tokenizers[model_name] = tokenizer
+            with _MODEL_CACHE_LOCK:
+                # 同時にロードした別インスタンスがあればそちらを優先して重複を避ける
+                loaded = _MODEL_CACHE.setdefault(cache_key, _LoadedModel(model, tokenizer))
+            self._register_model(model_name, loaded)
 
-            logger.info(f"Chat model loaded successfully: {model_name}")
+            logger.info("Chat model loaded successfully: %s", model_name)
+            return loaded
 
         except Exception as e:
-            logger.error(f"Error loading chat model {model_name}: {e}")
+            logger.error("Error loading chat model %s: %s", model_name, e)
             raise
 
+    def _register_model(self, model_name: str, loaded: _LoadedModel) -> None:
+        """ロード済みモデルをこのインスタンスで使えるように登録"""
+        with self.models_lock:
+            self._loaded_models[model_name] = loaded
+            self.tokenizers[model_name] = loaded.tokenizer
+            if self.batch_tokenization:
+                self.tokenize_batchers[model_name] = _TokenizeBatcher(loaded.tokenizer)
+            if self.batch_generation:
+                self.generation_batchers[model_name] = _GenerationBatcher(
+                    functools.partial(self._generate_batch, loaded.model, loaded.tokenizer, model_name),
+                    pad_token_id=loaded.tokenizer.pad_token_id,
+                )
+            # ロックなしの読み取り側は models を見てロード済みと判断するため最後に登録する
+            self.models[model_name] = loaded.model
+            evicted = self._evict_models_locked()
+
+        if evicted:
+            # OpenVINOの推論リクエストが確保したメモリを速やかに解放する
+            del evicted
+            gc.collect()
+
+    def _evict_models_locked(self) -> List[_LoadedModel]:
+        """
+        上限を超えた分のモデルを使用順の古いものから登録解除（models_lock を保持した状態で呼び出すこと）
+
+        Returns:
+            登録解除したモデル（呼び出し側がロックの外で参照を手放す）
+        """
+        evicted = []
+        while len(self.models) > self.model_capacity:
+            model_name, _ = self.models.popitem(last=False)
+            self.tokenizers.pop(model_name, None)
+            for batchers in (self.tokenize_batchers, self.generation_batchers):
+                batcher = batchers.pop(model_name, None)
+                if batcher is not None:
+                    batcher.close()
+            evicted.append(self._loaded_models.pop(model_name))
+            logger.info("Unloaded least recently used chat model: %s", model_name)
+        return evicted
+
+    def _acquire_model(self, model_name: str) -> _LoadedModel:
+        """モデルを取得（未ロードならロード）し、最近使用したものとして記録"""
+        with self.models_lock:
+            loaded = self._loaded_models.get(model_name)
+            if loaded is not None:
+                self.models.move_to_end(model_name)
+                return loaded
+
+        # ロードしたモデルをそのまま使う（直後に他のスレッドのロードで登録解除されても参照は有効）
+        return self._load_model(model_name)
+
+    def _warmup_model(self, model, tokenizer, model_name: str) -> None:
+        """
+        短いプロンプトで1回生成し、推論リクエストの確保やカーネルの初期化を済ませる
+
+        失敗してもロード自体は続行する
+        """
+        try:
+            prompt = self._format_prompt([{"role": "user", "content": "こんにちは"}], "", model_name)
+            inputs = tokenizer(prompt, return_tensors="pt", return_attention_mask=False)
+            input_ids = inputs["input_ids"]
+            model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones(input_ids.shape, dtype=torch.long),
+                max_new_tokens=2,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+            logger.info("Chat model warmed up: %s", model_name)
+        except Exception as e:
+            logger.warning("Warmup failed for %s: %s", model_name, e)
+
+    def _get_shared_tokenizer(self, model_name: str, model_path: Path):
+        """同じファミリーのモデルでロード済みのトークナイザーがあれば共有し、無ければロード"""
+        key = _tokenizer_key(model_name)
+        tokenizer = self._tokenizer_cache.get(key)
+        if tokenizer is not None:
+            logger.info("Reusing tokenizer %s for %s", key, model_name)
+            return tokenizer
+
+        tokenizer = self._load_tokenizer(model_name, model_path)
+
+        # パディングトークンの設定
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+
+        self._tokenizer_cache[key] = tokenizer
+        return tokenizer
+
+    def _load_tokenizer(self, model_name: str, model_path: Path):
+        """
+        トークナイザーをロード
+
+        エクスポート済みモデルと同じディレクトリに保存したものを優先して使用し、
+        無い場合のみHugging Faceから取得して保存する（次回以降はHubへのアクセス不要）
+        """
+        if (model_path / "tokenizer_config.json").exists():
+            tokenizer = AutoTokenizer.from_pretrained(model_path, use_fast=True)
+        else:
+            tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+            tokenizer.save_pretrained(model_path)
+
+        if not tokenizer.is_fast:
+            logger.warning("Fast tokenizer is not available for %s; falling back to the slow tokenizer", model_name)
+        return tokenizer
+
+    def _get_model_path(self, model_name: str) -> Path:
+        """エクスポート済みモデルの保存先を取得（量子化形式ごとに分ける）"""
+        suffix = "" if self.quantization == "fp16" else f"_{self.quantization}"
+        if self.reuse_kv_cache:
+            suffix += "_kv"
+        return self.cache_dir / (model_name.replace("/", "_") + suffix)
+
+    def _get_quantization_config(self) -> Optional[OVWeightQuantizationConfig]:
+        """エクスポート時に使用する重み量子化設定を取得"""
+        preset = QUANTIZATION_PRESETS[self.quantization]
+        if preset is None:
+            return None
+        return OVWeightQuantizationConfig(**preset)
+
+    def _get_ov_config(self) -> Dict[str, str]:
+        """OpenVINOランタイムのコンパイル設定を取得"""
+        ov_config = {"PERFORMANCE_HINT": self.performance_hint}
+        if self.num_streams:
+            ov_config["NUM_STREAMS"] = self.num_streams
+        if self.inference_precision_hint:
+            ov_config["INFERENCE_PRECISION_HINT"] = self.inference_precision_hint
+        if self.kv_cache_precision:
+            ov_config["KV_CACHE_PRECISION"] = self.kv_cache_precision
+        if self.dynamic_quantization_group_size:
+            ov_config["DYNAMIC_QUANTIZATION_GROUP_SIZE"] = self.dynamic_quantization_group_size
+        return ov_config
+
+    def _get_generation_workers(self) -> int:
+        """同時に実行する生成処理の数（NUM_STREAMSが数値指定ならそれに合わせる）"""
+        if self.num_streams and str(self.num_streams).isdigit():
+            return max(1, int(self.num_streams))
+        return 1 if self.performance_hint == "LATENCY" else 4
+
+    def close(self) -> None:
+        """バックグラウンドのクリーンアップスレッドと生成用スレッドプールを停止"""
+        self._cleanup_stop.set()
+        self._gen_executor.shutdown(wait=False)
+
     def get_loaded_models(self) -> List[str]:
         """ロード済みのモデル一覧を取得"""
         with self.models_lock:
@@ -178,8 +923,7 @@ class ChatService:
         message_lower = message.lower()
 
         # 画像プロンプト生成の検出（「プロンプトを作成」「プロンプトを生成」など）
-        generation_keywords = ["プロンプト作成", "プロンプト生成", "プロンプトを作", "プロンプトを生", "プロンプト欲しい", "プロンプトください"]
-        if any(keyword in message_lower for keyword in generation_keywords):
+        if _GENERATION_KEYWORDS_RE.search(message_lower):
             return "image_prompt_generation"
         if "create" in message_lower and "prompt" in message_lower:
             return "image_prompt_generation"
@@ -225,37 +969,6 @@ class ChatService:
         if task_type in ["image_prompt_improvement", "image_prompt_generation"]:
             text = response.strip()
 
-            # 説明的な段落を検出・削除
-            explanation_markers = [
-                "しかし",
-                "ただし",
-                "ただ",
-                "ところで",
-                "つまり",
-                "注意",
-                "注：",
-                "注意：",
-                "備考",
-                "※",
-                "⚠",
-                "ご了承",
-                "可能性",
-                "可能",
-                "おそらく",
-                "と思われ",
-                "と考えられ",
-                "かもしれません",
-                "この改善",
-                "改善内容",
-                "改善点",
-                "理由",
-                "映像解像",
-                "光源",
-                "技術的",
-                "撮影",
-                "一部で",
-            ]
-
             # 説明的な段落を分割
             sentences = text.split("。")
             result_sentences = []
@@ -266,7 +979,7 @@ class ChatService:
                     continue
 
                 # 説明的なマーカーがあればスキップ
-                if any(marker in sentence for marker in explanation_markers):
+                if _EXPLANATION_MARKERS_RE.search(sentence):
                     continue
 
                 result_sentences.append(sentence)
@@ -280,116 +993,14 @@ class ChatService:
                     final_text += "。"
 
                 # 英語とローマ字の混在を日本語に統一
-                replacements = {
-                    "STUDIO": "スタジオ",
-                    "studio": "スタジオ",
-                    "studioo": "スタジオ",
-                    "スタUDIO": "スタジオ",
-                    " MIRROR": "鏡",
-                    "MIRROR": "鏡",
-                    "mirror": "鏡",
-                    " FLOOR": "床",
-                    "FLOOR": "床",
-                    "floor": "床",
-                    "フLOOR": "床",
-                    " LIGHTING": "照明",
-                    "LIGHTING": "照明",
-                    "lighting": "照明",
-                    "LIGHINING": "照明",
-                    " BARRE": "バー",
-                    "BARRE": "バー",
-                    "barre": "バー",
-                    "BAR": "バー",
-                    "bar": "バー",
-                    "PROFESSIONAL": "プロフェッショナル",
-                    "professional": "プロフェッショナル",
-                    "WIDE AREA": "広々とした空間",
-                    "DANCE CLASS": "ダンスクラス",
-                }
-                for eng, jp in replacements.items():
-                    final_text = final_text.replace(eng, jp)
+                final_text = _ROMAJI_REPLACE_RE.sub(lambda m: ROMAJI_REPLACEMENTS[m.group(0)], final_text)
 
                 return final_text.strip()
 
         return response.strip()
 
-    def _format_qwen_prompt(self, messages: List[Dict[str, str]], system_prompt: Optional[str] = None) -> str:
-        """Qwen2.5のチャット形式にフォーマット"""
-        formatted_parts = []
-        if system_prompt:
-            formatted_parts.append(f"<|im_start|>system\n{system_prompt}<|im_end|>")
-
-        for msg in messages:
-            role = msg["role"]
-            content = msg["content"]
-            if role == "user":
-                formatted_parts.append(f"<|im_start|>user\n{content}<|im_end|>")
-            elif role == "assistant":
-                formatted_parts.append(f"<|im_start|>assistant\n{content}<|im_end|>")
-
-        formatted_parts.append("<|im_start|>assistant\n")
-        return "\n".join(formatted_parts)
-
-    def _format_tinyllama_prompt(self, messages: List[Dict[str, str]], system_prompt: Optional[str] = None) -> str:
-        """TinyLlamaのチャット形式にフォーマット"""
-        formatted_parts = []
-        if system_prompt:
-            formatted_parts.append(f"<|system|>\n{system_prompt}</s>")
-
-        for msg in messages:
-            role = msg["role"]
-            content = msg["content"]
-            if role == "user":
-                formatted_parts.append(f"<|user|>\n{content}</s>")
-            elif role == "assistant":
-                formatted_parts.append(f"<|assistant|>\n{content}</s>")
-
-        formatted_parts.append("<|assistant|>")
-        return "\n".join(formatted_parts)
-
-    def _format_phi_prompt(self, messages: List[Dict[str, str]], system_prompt: Optional[str] = None) -> str:
-        """Phi用のシンプルなチャット形式"""
-        formatted_parts = []
-
-        if system_prompt:
-            formatted_parts.append(f"<|system|>\n{system_prompt}<|end|>\n")
-
-        for msg in messages:
-            role = msg["role"]
-            content = msg["content"]
-            if role == "user":
-                formatted_parts.append(f"<|user|>\n{content}<|end|>\n")
-            elif role == "assistant":
-                formatted_parts.append(f"<|assistant|>\n{content}<|end|>\n")
-
-        formatted_parts.append("<|assistant|>\n")
-        return "".join(formatted_parts)
-
-    def _format_simple_prompt(self, messages: List[Dict[str, str]], system_prompt: Optional[str] = None) -> str:
-        """日本語モデル用の詳細な形式にフォーマット"""
-        formatted_parts = []
-
-        # システムプロンプトを最初に追加
-        if system_prompt:
-            formatted_parts.append(f"システム: {system_prompt}\n")
-
-        # 会話履歴を追加（最後の6メッセージまで）
-        recent_messages = messages[-6:] if len(messages) > 6 else messages
-
-        if len(recent_messages) > 0:
-            for msg in recent_messages:
-                role = msg["role"]
-                content = msg["content"]
-                if role == "user":
-                    formatted_parts.append(f"ユーザー: {content}")
-                elif role == "assistant":
-                    formatted_parts.append(f"アシスタント: {content}")
-
-        formatted_parts.append("\nアシスタント:")
-        return "\n".join(formatted_parts)
-
     def _format_prompt(
-        self, messages: List[Dict[str, str]], system_prompt: Optional[str] = None, model_name: str = None
+        self, messages: Union[Sequence[Dict], Deque[Dict]], system_prompt: Optional[str] = None, model_name: str = None
     ) -> str:
         """
         チャット履歴をプロンプト形式にフォーマット
@@ -406,43 +1017,171 @@ class ChatService:
         if not model_name:
             model_name = self.model_name
 
-        # モデルに応じたフォーマットを選択
-        if "Qwen" in model_name:
-            return self._format_qwen_prompt(messages, system_prompt)
-        elif "Phi" in model_name or "phi" in model_name:
-            return self._format_phi_prompt(messages, system_prompt)
-        elif "TinyLlama" in model_name:
-            return self._format_tinyllama_prompt(messages, system_prompt)
-        else:
-            return self._format_simple_prompt(messages, system_prompt)
-
-    def _get_generation_params(self, model_name: str) -> Dict:
-        """モデルに応じた最適な生成パラメータを取得"""
-        # デフォルトパラメータ
-        params = {
-            "max_new_tokens": 100,
-            "temperature": 0.5,
-            "top_p": 0.85,
-            "top_k": 40,
-            "repetition_penalty": 1.5,
-            "no_repeat_ngram_size": 5,
-        }
+        template = self._get_prompt_template(model_name)
+        separator = template.separator
+        recent_messages = (
+            itertools.islice(messages, max(0, len(messages) - template.window), None) if template.window else messages
+        )
+
+        # 前後の定型文字列と本文を1つのリストに並べ、最後に1回だけ連結する
+        parts = [template.system[0], system_prompt, template.system[1], separator] if system_prompt else []
+        for msg in recent_messages:
+            turn = template.turns.get(msg["role"])
+            if turn is not None:
+                parts += (turn[0], msg["content"], turn[1], separator)
+        parts.append(template.trigger)
+        return "".join(parts)
+
+    def _get_format_family(self, model_name: str) -> str:
+        """モデル名からプロンプト形式を判定"""
+        return _format_family(model_name)
+
+    def _get_prompt_template(self, model_name: str) -> _PromptTemplate:
+        """モデルのプロンプトテンプレートを取得"""
+        return PROMPT_TEMPLATES[_format_family(model_name)]
+
+    def _build_prompt(self, session: "_Session", model_name: str) -> str:
+        """
+        セッションの会話履歴からプロンプトを構築（sessions_lock を保持した状態で呼び出すこと）
+
+        前ターンまでのフォーマット済みプロンプトがキャッシュされていれば、
+        新しいユーザーターンと応答開始トリガーのみを追記する
+        """
+        prompt = self._build_incremental_prompt(session, model_name)
+        if prompt is None:
+            prompt = self._format_prompt(session.messages, session.system_prompt, model_name=model_name)
+        return prompt
+
+    def _build_incremental_prompt(self, session: "_Session", model_name: str) -> Optional[str]:
+        """キャッシュ済みプロンプトに最新のユーザーターンを追記（キャッシュが使えない場合は None）"""
+        messages = session.messages
+        template = session.template
+        cache_key = (session.system_prompt, model_name, len(messages) - 1)
+
+        if template.window or session.prompt_cache is None or session.prompt_cache_key != cache_key:
+            return None
+
+        cached = session.prompt_cache
+        user_open, user_close = template.turns["user"]
+        return "".join(
+            (
+                cached,
+                template.separator if cached else "",
+                user_open,
+                messages[-1]["content"],
+                user_close,
+                template.separator,
+                template.trigger,
+            )
+        )
+
+    def _update_prompt_cache(
+        self, session: "_Session", prompt: str, response_text: str, model_name: str
+    ) -> Optional[Tuple[str, Optional[str], Optional[Tuple[str, str, List[int]]]]]:
+        """
+        今回のプロンプトと応答からフォーマット済みプロンプトのキャッシュを更新（sessions_lock を保持した状態で呼び出すこと）
+
+        Returns:
+            (更新後のキャッシュ, 更新前のキャッシュ, 更新前のトークン列)。トークン列の更新はロックの外で
+            _extend_prefix_tokens と _store_prefix_tokens で行う（キャッシュを使わない形式では None）
+        """
+        template = session.template
+        if template.window:
+            return None
+
+        previous_cache = session.prompt_cache
+        assistant_open, assistant_close = template.turns["assistant"]
+        session.prompt_cache = "".join((prompt[: -len(template.trigger)], assistant_open, response_text, assistant_close))
+        session.prompt_cache_key = (session.system_prompt, model_name, len(session.messages))
+        return session.prompt_cache, previous_cache, session.prefix_tokens
+
+    def _extend_prefix_tokens(
+        self,
+        model_name: str,
+        prompt_cache: str,
+        previous_cache: Optional[str],
+        cached: Optional[Tuple[str, str, List[int]]],
+    ) -> Optional[Tuple[str, str, List[int]]]:
+        """
+        更新後のプロンプトキャッシュに対応するトークンID列を作成（セッションを参照しないためロック不要）
+
+        前ターンのトークン列が有効であれば、追記された部分のみをトークナイズして連結する
+        """
+        tokenizer = self.tokenizers.get(model_name)
+        if tokenizer is None:
+            return None
+
+        if cached is not None and cached[0] == model_name and cached[1] == previous_cache:
+            appended = prompt_cache[len(previous_cache) :]
+            return model_name, prompt_cache, cached[2] + tokenizer(appended, add_special_tokens=False)["input_ids"]
+        return model_name, prompt_cache, tokenizer(prompt_cache)["input_ids"]
+
+    def _store_prefix_tokens(self, session: "_Session", prefix_tokens: Optional[Tuple[str, str, List[int]]]) -> None:
+        """トークナイズ中にプロンプトキャッシュが更新されていなければトークン列を保存"""
+        if prefix_tokens is None:
+            return
+        with self.sessions_lock:
+            if session.prompt_cache is prefix_tokens[1]:
+                session.prefix_tokens = prefix_tokens
+
+    def _tokenize_with_prefix(self, session: Optional["_Session"], prompt: str, model_name: str, tokenizer, max_length: int):
+        """
+        セッションにキャッシュしたトークン列を使い、新しく追記された部分のみトークナイズする
+
+        キャッシュが使えない場合や最大長を超える場合は None を返す
+        """
+        cached = session.prefix_tokens if session is not None else None
+        if cached is None or cached[0] != model_name or not prompt.startswith(cached[1]):
+            return None
+
+        input_ids = cached[2] + tokenizer(prompt[len(cached[1]) :], add_special_tokens=False)["input_ids"]
+        if len(input_ids) > max_length:
+            return None
+        input_ids = torch.tensor([input_ids], dtype=torch.long)
+        return {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+
+    def _get_generation_params(self, model_name: str, task_type: str = "general") -> Mapping[str, float]:
+        """モデルとタスクに応じた最適な生成パラメータを取得（読み取り専用）"""
+        if task_type in _GREEDY_TASK_TYPES:
+            return _GREEDY_GENERATION_PARAMS
+        return GENERATION_PARAMS.get(_format_family(model_name), _DEFAULT_GENERATION_PARAMS)
+
+    def _get_reusable_kv_cache(self, session: Optional["_Session"], input_ids):
+        """
+        セッションに保持したKVキャッシュが再利用可能であれば取得
+
+        キャッシュ済みのトークン列が今回の入力の先頭と一致する場合のみ再利用する
+        （履歴の切り詰めやシステムプロンプト変更で先頭が変わった場合は破棄）
+        """
+        if not self.reuse_kv_cache or session is None:
+            return None
 
-        # モデル固有の調整
-        if "Phi" in model_name or "phi" in model_name:
-            # Phiはより保守的なパラメータが良い
-            params["temperature"] = 0.3
-            params["top_p"] = 0.8
-            params["max_new_tokens"] = 80
-        elif "Qwen" in model_name:
-            # Qwen向け
-            params["temperature"] = 0.7
-            params["top_p"] = 0.85
-            params["max_new_tokens"] = 150
+        past_key_values = session.kv
+        cached_ids = session.kv_input_ids
+        if past_key_values is None or cached_ids is None:
+            return None
 
-        return params
+        current_ids = input_ids[0]
+        cached_length = cached_ids.shape[0]
+        if current_ids.shape[0] <= cached_length or not bool((current_ids[:cached_length] == cached_ids).all()):
+            self._reset_kv_cache(session)
+            return None
 
-    def _generate_response(self, prompt: str, model_name: str, max_new_tokens: int = 256, task_type: str = "general") -> str:
+        return past_key_values
+
+    def _reset_kv_cache(self, session: "_Session") -> None:
+        """セッションに保持したKVキャッシュを破棄"""
+        session.kv = None
+        session.kv_input_ids = None
+
+    def _generate_response(
+        self,
+        prompt: str,
+        model_name: str,
+        max_new_tokens: int = 256,
+        task_type: str = "general",
+        session: Optional["_Session"] = None,
+    ) -> str:
         """
         LLMを使用して応答を生成
 
@@ -451,93 +1190,158 @@ class ChatService:
             model_name: 使用するモデル名
             max_new_tokens: 生成する最大トークン数
             task_type: タスクタイプ（後処理用）
+            session: KVキャッシュを保持するセッション（reuse_kv_cache有効時）
 
         Returns:
             生成されたテキスト
         """
         # デバッグ用にプロンプトをログ出力
-        logger.info(f"=== Prompt for model {model_name} ===\n{prompt}\n=== End Prompt ===")
+        logger.info("=== Prompt for model %s ===\n%s\n=== End Prompt ===", model_name, prompt)
 
         # モックモードの場合
         if self.use_mock:
             return self._generate_mock_response(prompt)
 
-        # モデルがロードされていない場合はロード
-        if model_name not in self.models:
-            self._load_model(model_name)
+        # モデルがロードされていない場合はロード（生成中に解放されても参照は保持される）
+        loaded = self._acquire_model(model_name)
 
         try:
-            with self.models_lock:
-                model = self.models[model_name]
-                tokenizer = self.tokenizers[model_name]
-
-            # トークナイズ
-            inputs = tokenizer(prompt, return_tensors="pt", padding=True, truncation=True, max_length=2048)
-
-            # モデルに応じた生成パラメータを取得
-            gen_params = self._get_generation_params(model_name)
-
-            # 生成パラメータの調整
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=gen_params["max_new_tokens"],
-                do_sample=True,
-                temperature=gen_params["temperature"],
-                top_p=gen_params["top_p"],
-                top_k=gen_params["top_k"],
-                repetition_penalty=gen_params["repetition_penalty"],
-                no_repeat_ngram_size=gen_params["no_repeat_ngram_size"],
-                pad_token_id=tokenizer.pad_token_id,
-                eos_token_id=tokenizer.eos_token_id,
-            )
-
-            # デコード（入力部分を除外）
-            input_length = inputs["input_ids"].shape[1]
-            generated_tokens = outputs[0][input_length:]
+            model = loaded.model
+            tokenizer = loaded.tokenizer
+            inputs = self._tokenize_prompt(session, prompt, model_name, tokenizer)
+
+            # 同時リクエストとまとめてバッチ生成するか、単独で生成する
+            # （バッチはサンプリング設定を共有するため、貪欲法のタスクは単独で生成する）
+            batcher = self.generation_batchers.get(model_name) if task_type not in _GREEDY_TASK_TYPES else None
+            generated_tokens = self._run_batched(batcher, inputs["input_ids"][0]) if batcher is not None else None
+            if generated_tokens is None:
+                generated_tokens = self._generate_tokens(model, tokenizer, model_name, inputs, session, task_type)
+
+            # デコード
             generated_text = tokenizer.decode(generated_tokens, skip_special_tokens=True)
 
             # デバッグ: 生成された生テキストをログ出力
-            logger.info(f"=== Raw generated text ===\n{generated_text}\n=== End Raw ===")
-
-            # 特殊トークンやフォーマット記号を削除
-            generated_text = (
-                generated_text.replace("</s>", "")
-                .replace("<|im_start|>", "")
-                .replace("<|im_end|>", "")
-                .replace("<|assistant|>", "")
-                .replace("<|user|>", "")
-                .replace("質問:", "")
-                .replace("回答:", "")
-                .replace("指示:", "")
-                .replace("【システムプロンプト】", "")
-                .replace("【会話履歴】", "")
-                .replace("【応答】", "")
-                .replace("ユーザー:", "")
-                .replace("アシスタント:", "")
-                .strip()
-            )
-
-            # 余分な生成を防ぐ - 次のターンが始まったら切り取る
-            for delimiter in ["\n<|im_start|>", "\n質問:", "\n回答:", "\n指示:", "\nユーザー:", "\nアシスタント:"]:
-                if delimiter in generated_text:
-                    generated_text = generated_text.split(delimiter)[0].strip()
-                    break
+            logger.info("=== Raw generated text ===\n%s\n=== End Raw ===", generated_text)
 
-            # 空の応答の場合のフォールバック
-            if not generated_text:
-                generated_text = "申し訳ありませんが、応答を生成できませんでした。"
+            generated_text = self._clean_generated_text(generated_text)
 
             # タスク固有の後処理
             generated_text = self._post_process_response(generated_text, task_type)
 
-            logger.info(f"=== Final response ===\n{generated_text}\n=== End Final ===")
+            logger.info("=== Final response ===\n%s\n=== End Final ===", generated_text)
 
             return generated_text
 
         except Exception as e:
-            logger.error(f"Error generating response: {e}")
+            logger.error("Error generating response: %s", e)
             raise
 
+    def _get_generate_kwargs(self, model_name: str, tokenizer, task_type: str = "general") -> Dict:
+        """model.generate に渡す生成設定（ロジットプロセッサは呼び出しごとに新しく作る）"""
+        gen_params = self._get_generation_params(model_name, task_type)
+        kwargs = {
+            "max_new_tokens": gen_params["max_new_tokens"],
+            "use_cache": True,
+            "do_sample": gen_params["do_sample"],
+            "repetition_penalty": gen_params["repetition_penalty"],
+            "logits_processor": LogitsProcessorList(
+                [_IncrementalNoRepeatNGramLogitsProcessor(gen_params["no_repeat_ngram_size"])]
+            ),
+            "pad_token_id": tokenizer.pad_token_id,
+            "eos_token_id": tokenizer.eos_token_id,
+        }
+        if gen_params["do_sample"]:
+            kwargs["temperature"] = gen_params["temperature"]
+            kwargs["top_p"] = gen_params["top_p"]
+            kwargs["top_k"] = gen_params["top_k"]
+        else:
+            # サンプリングしない場合は argmax のみで、サンプリング用の処理を通さない
+            kwargs["num_beams"] = gen_params["num_beams"]
+        return kwargs
+
+    def _generate_tokens(
+        self, model, tokenizer, model_name: str, inputs: Dict, session: Optional["_Session"], task_type: str = "general"
+    ):
+        """1件のプロンプトから生成し、入力部分を除いた生成トークン列を返す"""
+        # 前ターンのKVキャッシュを再利用し、新しいトークンのみをプリフィルする
+        extra_params = {}
+        past_key_values = self._get_reusable_kv_cache(session, inputs["input_ids"])
+        if past_key_values is not None:
+            extra_params["past_key_values"] = past_key_values
+        if self.reuse_kv_cache and session is not None:
+            extra_params["return_dict_in_generate"] = True
+
+        outputs = model.generate(**inputs, **extra_params, **self._get_generate_kwargs(model_name, tokenizer, task_type))
+
+        if "return_dict_in_generate" in extra_params:
+            # 最後に生成したトークンはKVに含まれないため除外して保持
+            session.kv = outputs.past_key_values
+            session.kv_input_ids = outputs.sequences[0][:-1]
+            outputs = outputs.sequences
+
+        # 入力部分を除外
+        return outputs[0][inputs["input_ids"].shape[1] :]
+
+    def _generate_batch(self, model, tokenizer, model_name: str, inputs: Dict):
+        """左パディング済みのバッチ入力から生成（_GenerationBatcher から呼ばれる）"""
+        return model.generate(**inputs, **self._get_generate_kwargs(model_name, tokenizer))
+
+    def _run_batched(self, batcher: QueueBatcher, request):
+        """
+        バッチ処理に要求を渡し、batch_timeout 秒まで結果を待つ
+
+        Returns:
+            バッチ処理の結果。モデルの解放でバッチ処理が閉じられていた場合は None（呼び出し側で単独に処理する）
+        """
+        try:
+            future = batcher.submit(request)
+        except BatcherClosedError:
+            return None
+        try:
+            return future.result(timeout=self.batch_timeout)
+        except FutureTimeoutError:
+            # まだ処理が始まっていなければ取り消し、結果を待つ呼び出し側のいない推論を行わない
+            future.cancel()
+            raise TimeoutError(f"{batcher.name} did not respond within {self.batch_timeout} seconds") from None
+
+    def _tokenize_prompt(self, session: Optional["_Session"], prompt: str, model_name: str, tokenizer):
+        """
+        プロンプトをトークナイズ
+
+        前ターンまでのトークン列を再利用できればそれを使い、
+        できなければバッチ処理（有効時）または全体のトークナイズを行う
+        """
+        inputs = self._tokenize_with_prefix(session, prompt, model_name, tokenizer, max_length=2048)
+        if inputs is not None:
+            return inputs
+        batcher = self.tokenize_batchers.get(model_name)
+        if batcher is not None:
+            inputs = self._run_batched(batcher, prompt)
+            if inputs is not None:
+                return inputs
+        # 単一プロンプトなのでパディング不要。全要素1のマスクはトークナイザーを通さず直接作る
+        input_ids = tokenizer(
+            prompt, return_tensors="pt", padding=False, truncation=True, max_length=2048, return_attention_mask=False
+        )["input_ids"]
+        return {"input_ids": input_ids, "attention_mask": torch.ones(input_ids.shape, dtype=torch.long)}
+
+    def _clean_generated_text(self, generated_text: str) -> str:
+        """生成テキストから特殊トークンと次ターン以降の余分な生成を取り除く"""
+        # 特殊トークンやフォーマット記号を削除
+        generated_text = _SPECIAL_TOKENS_RE.sub("", generated_text).strip()
+
+        # 余分な生成を防ぐ - 最も手前で次のターンが始まった位置で切り取る
+        # （区切りはすべて改行で始まるため、改行がなければ走査しない）
+        if "\n" in generated_text:
+            delimiter = _TURN_DELIMITER_RE.search(generated_text)
+            if delimiter:
+                generated_text = generated_text[: delimiter.start()].strip()
+
+        # 空の応答の場合のフォールバック
+        if not generated_text:
+            generated_text = "申し訳ありませんが、応答を生成できませんでした。"
+        return generated_text
+
     def _generate_mock_response(self, prompt: str) -> str:
         """
         モック応答を生成（開発・デモ用）
@@ -556,47 +1360,32 @@ class ChatService:
                 last_user = parts[-1].split("</s>")[0].strip()
                 user_message = last_user.lower()
 
-        # シンプルなルールベースの応答
-        if "こんにちは" in user_message or "hello" in user_message:
-            return "こんにちは！どのようにお手伝いできますか？"
-        elif "ありがとう" in user_message or "thank" in user_message:
-            return "どういたしまして！他に何かお手伝いできることはありますか？"
-        elif "さようなら" in user_message or "bye" in user_message:
-            return "さようなら！また何かあればお気軽にどうぞ。"
-        elif "天気" in user_message or "weather" in user_message:
-            return "申し訳ありませんが、私は天気情報にアクセスできません。お近くの気象情報をご確認ください。"
-        elif "名前" in user_message or "name" in user_message:
-            return "私はOpenVINO AI Toolkitのアシスタントです。"
-        elif "?" in user_message or "？" in user_message:
-            return f"「{user_message[:50]}」についてのご質問ですね。申し訳ありませんが、現在はモックモードで動作しているため、詳細な回答は提供できません。"
-        else:
-            return "ご質問ありがとうございます。現在はモックモードで動作しているため、限定的な応答のみ提供しています。実際のLLMモデルを使用する場合は、適切な日本語対応モデル（rinna/japanese-gpt-neox-small等）の設定をご検討ください。"
+        # シンプルなルールベースの応答（一致したキーワードのうち最も優先度の高い応答を返す）
+        matched = _MOCK_REPLY_RE.match(user_message)
+        if matched is None:
+            return _MOCK_DEFAULT_REPLY
+        return _MOCK_REPLY_BY_GROUP[matched.lastgroup].format(message=user_message[:50])
 
     def _cleanup_old_sessions(self):
         """古いセッションをクリーンアップ"""
         with self.sessions_lock:
-            current_time = datetime.now()
-            expired_sessions = []
-
-            for session_id, session in self.sessions.items():
-                last_access = session.get("last_access", session["created_at"])
-                if current_time - last_access > self.session_timeout:
-                    expired_sessions.append(session_id)
+            current_time = time.monotonic()
 
-            for session_id in expired_sessions:
+            # セッションはアクセス順に並んでいるため、期限内のセッションが見つかった時点で終了
+            while self.sessions:
+                session_id, session = next(iter(self.sessions.items()))
+                if current_time - session.last_access_mono <= self.session_timeout_s:
+                    break
                 del self.sessions[session_id]
-                logger.info(f"Cleaned up expired session: {session_id}")
-
-            # セッション数が最大値を超えている場合、最も古いセッションを削除
-            if len(self.sessions) > self.max_sessions:
-                # 最終アクセス時刻でソート
-                sorted_sessions = sorted(self.sessions.items(), key=lambda x: x[1].get("last_access", x[1]["created_at"]))
-                # 古いセッションを削除
-                num_to_remove = len(self.sessions) - self.max_sessions
-                for i in range(num_to_remove):
-                    session_id = sorted_sessions[i][0]
-                    del self.sessions[session_id]
-                    logger.info(f"Removed old session due to limit: {session_id}")
+                logger.info("Cleaned up expired session: %s", session_id)
+
+            self._evict_excess_sessions()
+
+    def _evict_excess_sessions(self) -> None:
+        """セッション数が最大値を超えている場合、最も古いセッションを削除（sessions_lock取得済みで呼ぶ）"""
+        while len(self.sessions) > self.max_sessions:
+            session_id, _ = self.sessions.popitem(last=False)
+            logger.info("Removed old session due to limit: %s", session_id)
 
     def _get_or_create_session(
         self,
@@ -604,40 +1393,63 @@ class ChatService:
         task_type: str,
         system_prompt: Optional[str],
         model_name: str,
-    ) -> tuple[str, Dict]:
+    ) -> Tuple[str, _Session]:
         """セッションを取得または新規作成"""
         if session_id is None or session_id not in self.sessions:
             session_id = str(uuid.uuid4())
             final_system_prompt = self._get_system_prompt_for_task(task_type, system_prompt, model_name)
-            self.sessions[session_id] = {
-                "messages": [],
-                "system_prompt": final_system_prompt,
-                "model_name": model_name,
-                "task_type": task_type,
-                "created_at": datetime.now(),
-                "last_access": datetime.now(),
-            }
+            self.sessions[session_id] = _Session(
+                # 上限を超えた古いメッセージは追加時に自動で破棄される
+                messages=deque(maxlen=self.max_history_messages * 2),
+                system_prompt=final_system_prompt,
+                model_name=model_name,
+                template=self._get_prompt_template(model_name),
+                task_type=task_type,
+            )
+            self._evict_excess_sessions()
         elif system_prompt:
-            self.sessions[session_id]["system_prompt"] = system_prompt
-            self.sessions[session_id]["task_type"] = task_type
+            if system_prompt != self.sessions[session_id].system_prompt:
+                self._reset_kv_cache(self.sessions[session_id])
+            self.sessions[session_id].system_prompt = system_prompt
+            self.sessions[session_id].task_type = task_type
 
         if model_name:
-            self.sessions[session_id]["model_name"] = model_name
+            if model_name != self.sessions[session_id].model_name:
+                self._reset_kv_cache(self.sessions[session_id])
+            self.sessions[session_id].model_name = model_name
+            self.sessions[session_id].template = self._get_prompt_template(model_name)
 
-        self.sessions[session_id]["last_access"] = datetime.now()
+        self.sessions[session_id].last_access_mono = time.monotonic()
+        self.sessions.move_to_end(session_id)
         return session_id, self.sessions[session_id]
 
-    def _add_user_message(self, session: Dict, message: str) -> None:
+    def _add_user_message(self, session: "_Session", message: str, timestamp: Optional[float] = None) -> None:
         """ユーザーメッセージをセッションに追加"""
-        user_message = {
-            "role": "user",
-            "content": message,
-            "timestamp": datetime.now().isoformat(),
-        }
-        session["messages"].append(user_message)
+        self._append_message(session, {"role": "user", "content": message, "timestamp": timestamp or time.time()})
 
-        if len(session["messages"]) > self.max_history_messages * 2:
-            session["messages"] = session["messages"][-(self.max_history_messages * 2) :]
+    def _discard_user_message(self, session: "_Session", message: str, timestamp: float) -> None:
+        """応答を返せなかったユーザーメッセージを履歴から取り除く（その後に別のメッセージが追加されていれば何もしない）"""
+        with self.sessions_lock:
+            if session.messages:
+                last = session.messages[-1]
+                if last["role"] == "user" and last["content"] == message and last["timestamp"] == timestamp:
+                    session.messages.pop()
+
+    def _append_message(self, session: "_Session", message: Dict) -> bool:
+        """
+        メッセージを履歴に追加
+
+        Returns:
+            古いメッセージが破棄されずに追加できたか
+        """
+        if len(session.messages) == session.messages.maxlen:
+            # 先頭の履歴が変わるためフォーマット済みプロンプトのキャッシュは使えない
+            session.prompt_cache = None
+            session.prefix_tokens = None
+            session.messages.append(message)
+            return False
+        session.messages.append(message)
+        return True
 
     def _process_task_specific_response(self, response_text: str, task_type: str, message: str) -> str:
         """タスク固有の後処理を実行"""
@@ -674,37 +1486,235 @@ class ChatService:
         if task_type is None:
             task_type = self._detect_task_type(message)
 
+        # ユーザー・アシスタント両方のメッセージで同じリクエスト時刻を使う
+        timestamp = time.time()
+
         try:
-            self._cleanup_old_sessions()
-
-            with self.sessions_lock:
-                session_id, session = self._get_or_create_session(session_id, task_type, system_prompt, model_name)
-                used_model = session["model_name"]
-                self._add_user_message(session, message)
-                prompt = self._format_prompt(session["messages"][:], session["system_prompt"], model_name=used_model)
-
-            response_text = self._generate_response(prompt, used_model, task_type=session.get("task_type", "general"))
-            response_text = self._process_task_specific_response(response_text, session.get("task_type"), message)
-
-            with self.sessions_lock:
-                assistant_message = {
-                    "role": "assistant",
-                    "content": response_text,
-                    "timestamp": datetime.now().isoformat(),
-                }
-                session["messages"].append(assistant_message)
+            session_id, session, used_model, prompt = self._prepare_chat(
+                message, session_id, system_prompt, model_name, task_type, timestamp
+            )
+            response_text = self._generate_response(prompt, used_model, task_type=session.task_type, session=session)
+            return self._finish_chat(session_id, session, used_model, prompt, response_text, message, timestamp)
 
-            return {
-                "response": response_text,
-                "session_id": session_id,
-                "model": used_model,
-                "timestamp": assistant_message["timestamp"],
-            }
+        except Exception as e:
+            logger.error("Chat error: %s", e)
+            return {"error": str(e)}
+
+    async def achat(
+        self,
+        message: str,
+        session_id: Optional[str] = None,
+        system_prompt: Optional[str] = None,
+        model_name: Optional[str] = None,
+        task_type: Optional[str] = None,
+    ) -> Dict:
+        """
+        chat() の非同期版。生成処理を専用スレッドプールで実行し、イベントループをブロックしない
+
+        Args:
+            message: ユーザーメッセージ
+            session_id: セッションID（指定しない場合は新規作成）
+            system_prompt: システムプロンプト（優先）
+            model_name: 使用するモデル名（指定しない場合はデフォルト）
+            task_type: タスクタイプ（自動検出される、明示的に指定も可）
+
+        Returns:
+            応答情報を含む辞書
+        """
+        if model_name is None:
+            model_name = self.model_name
+
+        if task_type is None:
+            task_type = self._detect_task_type(message)
+
+        # ユーザー・アシスタント両方のメッセージで同じリクエスト時刻を使う
+        timestamp = time.time()
+
+        try:
+            session_id, session, used_model, prompt = self._prepare_chat(
+                message, session_id, system_prompt, model_name, task_type, timestamp
+            )
+            response_text = await asyncio.get_running_loop().run_in_executor(
+                self._gen_executor,
+                functools.partial(self._generate_response, prompt, used_model, task_type=session.task_type, session=session),
+            )
+            return self._finish_chat(session_id, session, used_model, prompt, response_text, message, timestamp)
 
         except Exception as e:
-            logger.error(f"Chat error: {e}")
+            logger.error("Chat error: %s", e)
             return {"error": str(e)}
 
+    def chat_stream(
+        self,
+        message: str,
+        session_id: Optional[str] = None,
+        system_prompt: Optional[str] = None,
+        model_name: Optional[str] = None,
+        task_type: Optional[str] = None,
+    ) -> Iterator[Dict]:
+        """
+        チャットメッセージを処理し、生成されたテキストを逐次返す
+
+        生成中は {"session_id", "delta"} を順に返し、最後に chat() と同じ形式の応答に
+        "done": True を加えた辞書を返す。最終応答は後処理済みのため、delta の連結と一致しない場合がある
+
+        Args:
+            message: ユーザーメッセージ
+            session_id: セッションID（指定しない場合は新規作成）
+            system_prompt: システムプロンプト（優先）
+            model_name: 使用するモデル名（指定しない場合はデフォルト）
+            task_type: タスクタイプ（自動検出される、明示的に指定も可）
+
+        Yields:
+            生成途中のテキスト片、または最終応答を含む辞書
+        """
+        if model_name is None:
+            model_name = self.model_name
+
+        if task_type is None:
+            task_type = self._detect_task_type(message)
+
+        timestamp = time.time()
+
+        try:
+            session_id, session, used_model, prompt = self._prepare_chat(
+                message, session_id, system_prompt, model_name, task_type, timestamp
+            )
+            try:
+                response_text = yield from self._stream_response(prompt, used_model, session_id, session.task_type)
+            except GeneratorExit:
+                # 応答の途中で受信側が閉じた（クライアントの切断など）場合は、応答のないユーザーメッセージを残さない
+                self._discard_user_message(session, message, timestamp)
+                raise
+            yield {
+                **self._finish_chat(session_id, session, used_model, prompt, response_text, message, timestamp),
+                "done": True,
+            }
+
+        except Exception as e:
+            logger.error("Chat error: %s", e)
+            yield {"error": str(e), "done": True}
+
+    def _stream_response(
+        self, prompt: str, model_name: str, session_id: str, task_type: str = "general"
+    ) -> Generator[Dict, None, str]:
+        """
+        LLMの生成テキストを逐次返し、最後に後処理済みの応答テキストを返す
+
+        次のターンの開始（区切り）が現れた時点、または受信側が閉じた時点で生成を止める
+        """
+        if self.use_mock:
+            response_text = self._generate_mock_response(prompt)
+            yield {"session_id": session_id, "delta": response_text}
+            return response_text
+
+        loaded = self._acquire_model(model_name)
+        model = loaded.model
+        tokenizer = loaded.tokenizer
+        inputs = self._tokenize_prompt(None, prompt, model_name, tokenizer)
+
+        # 生成は別スレッドで行い、デコードされたテキスト片を受け取る
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        stop = threading.Event()
+        generation = self._gen_executor.submit(
+            _generate_to_streamer,
+            model,
+            streamer,
+            **inputs,
+            **self._get_generate_kwargs(model_name, tokenizer, task_type),
+            stopping_criteria=StoppingCriteriaList([_StopOnEvent(stop)]),
+        )
+
+        generated_text = ""
+        sent = 0  # 送出済みの文字数
+        try:
+            for chunk in streamer:
+                generated_text += chunk
+                delimiter = _TURN_DELIMITER_RE.search(generated_text, sent)
+                if delimiter is not None:
+                    generated_text = generated_text[: delimiter.start()]
+                    if len(generated_text) > sent:
+                        yield {"session_id": session_id, "delta": generated_text[sent:]}
+                    # 区切り以降は生成しない（max_new_tokens まで生成を続けて推論スレッドを占有しない）
+                    break
+
+                # 区切りの途中かもしれない末尾（区切りはすべて改行で始まる）は次のテキスト片まで保留する
+                newline = generated_text.rfind("\n", max(sent, len(generated_text) - _TURN_DELIMITER_MAX_LENGTH))
+                safe_end = newline if newline != -1 else len(generated_text)
+                if safe_end > sent:
+                    yield {"session_id": session_id, "delta": generated_text[sent:safe_end]}
+                    sent = safe_end
+            else:
+                if len(generated_text) > sent:
+                    yield {"session_id": session_id, "delta": generated_text[sent:]}
+        finally:
+            # 区切りの検出後や受信側が閉じた場合も、次のトークンで生成を止める
+            stop.set()
+
+        # 生成スレッドの終了を待ち、例外があれば伝播させる
+        generation.result()
+
+        return self._post_process_response(self._clean_generated_text(generated_text), task_type)
+
+    def _prepare_chat(
+        self,
+        message: str,
+        session_id: Optional[str],
+        system_prompt: Optional[str],
+        model_name: str,
+        task_type: str,
+        timestamp: float,
+    ) -> Tuple[str, _Session, str, str]:
+        """セッションを準備してユーザーメッセージを追加し、プロンプトを構築"""
+        with self.sessions_lock:
+            session_id, session = self._get_or_create_session(session_id, task_type, system_prompt, model_name)
+            used_model = session.model_name
+            self._add_user_message(session, message, timestamp)
+            prompt = self._build_incremental_prompt(session, used_model)
+            if prompt is None:
+                # 全体のフォーマットはロック外で行うため、履歴の参照のみを取得しておく
+                messages_snapshot = tuple(session.messages)
+                system_prompt = session.system_prompt
+
+        if prompt is None:
+            prompt = self._format_prompt(messages_snapshot, system_prompt, model_name=used_model)
+
+        return session_id, session, used_model, prompt
+
+    def _finish_chat(
+        self,
+        session_id: str,
+        session: "_Session",
+        used_model: str,
+        prompt: str,
+        response_text: str,
+        message: str,
+        timestamp: float,
+    ) -> Dict:
+        """生成結果を後処理して履歴に追加し、応答辞書を作成"""
+        response_text = self._process_task_specific_response(response_text, session.task_type, message)
+
+        with self.sessions_lock:
+            assistant_message = {
+                "role": "assistant",
+                "content": response_text,
+                "timestamp": timestamp,
+            }
+            pending = None
+            if self._append_message(session, assistant_message):
+                pending = self._update_prompt_cache(session, prompt, response_text, used_model)
+
+        # トークナイズは全セッション共通のロックの外で行い、他のセッションの処理を止めない
+        if pending is not None:
+            self._store_prefix_tokens(session, self._extend_prefix_tokens(used_model, *pending))
+
+        return {
+            "response": response_text,
+            "session_id": session_id,
+            "model": used_model,
+            "timestamp": datetime.fromtimestamp(timestamp).isoformat(),
+        }
+
     def get_history(self, session_id: str) -> Dict:
         """
         セッションの会話履歴を取得
@@ -721,13 +1731,17 @@ class ChatService:
 
             session = self.sessions[session_id]
             # 最終アクセス時刻を更新
-            session["last_access"] = datetime.now()
+            session.last_access_mono = time.monotonic()
+            self.sessions.move_to_end(session_id)
 
             return {
                 "session_id": session_id,
-                "messages": session["messages"][:],  # コピーを返す
-                "system_prompt": session["system_prompt"],
-                "created_at": session["created_at"].isoformat(),
+                # タイムスタンプはエポック秒で保持しているため、表示用に変換したコピーを返す
+                "messages": [
+                    {**msg, "timestamp": datetime.fromtimestamp(msg["timestamp"]).isoformat()} for msg in session.messages
+                ],
+                "system_prompt": session.system_prompt,
+                "created_at": datetime.fromtimestamp(session.created_at_ts).isoformat(),
             }
 
     def delete_history(self, session_id: str) -> Dict:
@@ -756,6 +1770,8 @@ class ChatService:
         """
         with self.sessions_lock:
             sessions_info = []
+            # 単調時計の最終アクセス時刻を表示用の実時刻に変換するためのオフセット
+            wall_offset = time.time() - time.monotonic()
             # 辞書のコピーを作成してから反復
             sessions_copy = dict(self.sessions)
 
@@ -763,9 +1779,9 @@ class ChatService:
                 sessions_info.append(
                     {
                         "session_id": sid,
-                        "message_count": len(session["messages"]),
-                        "created_at": session["created_at"].isoformat(),
-                        "last_access": session.get("last_access", session["created_at"]).isoformat(),
+                        "message_count": len(session.messages),
+                        "created_at": datetime.fromtimestamp(session.created_at_ts).isoformat(),
+                        "last_access": datetime.fromtimestamp(session.last_access_mono + wall_offset).isoformat(),
                     }
                 )
 
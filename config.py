@@ -3,7 +3,8 @@
 """
 
 import os
-from typing import Dict, List
+import types
+from typing import Dict, List, Mapping
 
 
 # 利用可能なチャットモデルの定義
@@ -52,6 +53,11 @@ AVAILABLE_CHAT_MODELS: Dict[str, Dict] = {
     },
 }
 
+# モデルキー（小文字）-> Hugging Face モデル名（読み取り専用、インポート時に一度だけ作る）
+MODEL_NAME_BY_KEY: Mapping[str, str] = types.MappingProxyType(
+    {key.lower(): info["name"] for key, info in AVAILABLE_CHAT_MODELS.items()}
+)
+
 # デフォルトのチャットモデル（環境変数で変更可能）
 DEFAULT_CHAT_MODEL = os.getenv("CHAT_MODEL", "qwen2.5-7b")
 
@@ -61,8 +67,64 @@ CHAT_CONFIG = {
     "session_timeout_minutes": int(os.getenv("CHAT_SESSION_TIMEOUT", "60")),
     "max_sessions": int(os.getenv("CHAT_MAX_SESSIONS", "100")),
     "cache_dir": os.getenv("CHAT_MODEL_CACHE_DIR", "./models/chat_llm"),
+    # 重みの量子化形式（"fp16", "int8", "int4"）
+    "quantization": os.getenv("CHAT_MODEL_QUANTIZATION", "int8"),
+    "performance_hint": os.getenv("CHAT_OV_PERFORMANCE_HINT", "THROUGHPUT"),
+    "num_streams": os.getenv("CHAT_OV_NUM_STREAMS") or None,
+    "inference_precision_hint": os.getenv("CHAT_OV_INFERENCE_PRECISION") or None,
+    "kv_cache_precision": os.getenv("CHAT_OV_KV_CACHE_PRECISION", "u8") or None,
+    "dynamic_quantization_group_size": os.getenv("CHAT_OV_DYNAMIC_QUANTIZATION_GROUP_SIZE", "32") or None,
+    # 同時リクエストの生成をまとめてバッチ処理する
+    "batch_generation": os.getenv("CHAT_BATCH_GENERATION", "false").lower() == "true",
+    # ロード直後に短い生成を行い、初回リクエストの遅延を減らす
+    "warmup": os.getenv("CHAT_MODEL_WARMUP", "true").lower() == "true",
+    # 同時に保持するモデル数の上限（超えると最も長く使われていないモデルを解放）
+    "model_capacity": int(os.getenv("CHAT_MODEL_CAPACITY", "2")),
+    # バッチ処理（トークナイズ・生成）の結果を待つ最大秒数
+    "batch_timeout": float(os.getenv("CHAT_BATCH_TIMEOUT", "300")),
+}
+
+# translate_to 指定時に応答を逐次生成し、完成した文から順に翻訳する（翻訳の待ち時間を生成に重ねる）
+# 逐次生成ではプレフィックスの再利用とバッチ生成が効かず、文ごとの翻訳では前後の文脈が訳文に反映されないため既定では無効
+CHAT_TRANSLATE_WHILE_GENERATING = os.getenv("CHAT_TRANSLATE_WHILE_GENERATING", "false").lower() == "true"
+
+
+# 翻訳サービスの設定
+TRANSLATION_CONFIG = {
+    # 翻訳モデル（"marian": 言語ペアごとの Helsinki-NLP/opus-mt、"nllb": 多言語モデル NLLB-200）
+    "backend": os.getenv("TRANSLATION_BACKEND", "marian"),
+    # 複数テキストを翻訳するときに1回の推論でまとめる件数
+    "batch_size": int(os.getenv("TRANSLATION_BATCH_SIZE", "8")),
+    # エクスポート時の重みの量子化形式（"fp16", "int8"）
+    "quantization": os.getenv("TRANSLATION_MODEL_QUANTIZATION", "int8"),
+    # Webサービスでは同時リクエストをさばけるようスループット優先でコンパイルする
+    "performance_hint": os.getenv("TRANSLATION_OV_PERFORMANCE_HINT", "THROUGHPUT"),
+    "num_streams": os.getenv("TRANSLATION_OV_NUM_STREAMS") or None,
+    # 同時に保持するモデル数の上限（英語を経由する翻訳には2つ必要）
+    "model_capacity": int(os.getenv("TRANSLATION_MODEL_CAPACITY", "3")),
+    # 翻訳結果をメモリに保持する件数の上限（0 で無効）
+    "result_cache_size": int(os.getenv("TRANSLATION_RESULT_CACHE_SIZE", "5000")),
+    # ビームサーチの幅（未指定でモデルの既定値、1 で貪欲法）
+    "num_beams": int(os.environ["TRANSLATION_NUM_BEAMS"]) if os.getenv("TRANSLATION_NUM_BEAMS") else None,
+    # 英語を経由する言語ペアを多言語モデル NLLB-200 1つで直接翻訳する（2つのモデルを保持しない）
+    "multilingual_pivot": os.getenv("TRANSLATION_MULTILINGUAL_PIVOT", "false").lower() == "true",
+    # 起動時に未エクスポートのモデルをバックグラウンドでエクスポートする
+    "prefetch_exports": os.getenv("TRANSLATION_PREFETCH_EXPORTS", "false").lower() == "true",
+    # 同時リクエストの翻訳を言語ペアごとにまとめてバッチ処理する
+    "batch_requests": os.getenv("TRANSLATION_BATCH_REQUESTS", "false").lower() == "true",
+    # 翻訳結果をSQLiteにも保存し、再起動後も再利用する
+    "persistent_cache": os.getenv("TRANSLATION_PERSISTENT_CACHE", "false").lower() == "true",
+    # 永続キャッシュに保持する件数の上限（1件数百バイト程度のため、既定値でおよそ数百MB）
+    "persistent_cache_size": int(os.getenv("TRANSLATION_PERSISTENT_CACHE_SIZE", "1000000")),
+    # ロード直後に1回推論して初回リクエストの初期化コストを先に払う
+    "warmup": os.getenv("TRANSLATION_MODEL_WARMUP", "true").lower() == "true",
 }
 
+# 起動時に事前ロードする翻訳の言語ペア（例: "ja-en,en-ja"、空なら最初のリクエスト時にロード）
+TRANSLATION_PREWARM_PAIRS = [
+    tuple(pair.strip().split("-", 1)) for pair in os.getenv("TRANSLATION_PREWARM_PAIRS", "").split(",") if "-" in pair
+]
+
 
 def get_model_info(model_key: str) -> Dict:
     """
@@ -74,10 +136,11 @@ def get_model_info(model_key: str) -> Dict:
     Returns:
         モデル情報の辞書
     """
-    if model_key not in AVAILABLE_CHAT_MODELS:
+    info = AVAILABLE_CHAT_MODELS.get(model_key.lower())
+    if info is None:
         raise ValueError(f"Unknown model: {model_key}. Available: {list(AVAILABLE_CHAT_MODELS.keys())}")
 
-    return AVAILABLE_CHAT_MODELS[model_key]
+    return info
 
 
 def get_model_name(model_key: str) -> str:
@@ -90,7 +153,11 @@ def get_model_name(model_key: str) -> str:
     Returns:
         Hugging Face モデル名
     """
-    return get_model_info(model_key)["name"]
+    model_name = MODEL_NAME_BY_KEY.get(model_key.lower())
+    if model_name is None:
+        raise ValueError(f"Unknown model: {model_key}. Available: {list(AVAILABLE_CHAT_MODELS.keys())}")
+
+    return model_name
 
 
 def list_available_models() -> List[Dict]:
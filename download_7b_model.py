@@ -3,14 +3,149 @@ Qwen2.5-7B-Instruct モデルをダウンロードして OpenVINO 形式に変
 """
 
 
+import json
+import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from huggingface_hub import snapshot_download
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# hf_transfer（Rust実装の並列ダウンローダー）が使える場合は有効化する
+# （huggingface_hub はインポート時に設定を読むため、インポート前に設定する）
+try:
+    import hf_transfer  # noqa: F401
+
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+except ImportError:
+    logger.warning("hf_transfer が見つからないため、標準のダウンローダーを使用します（pip install hf_transfer で高速化できます）")
+
+# 大きなファイルの読み取りが一時的に止まっても失敗にしない
+os.environ.setdefault("HF_HUB_DOWNLOAD_TIMEOUT", "30")
+
+import requests  # noqa: E402
+from huggingface_hub import HfApi, configure_http_backend, hf_hub_download, hf_hub_url, snapshot_download  # noqa: E402
+from huggingface_hub.utils import build_hf_headers, get_session  # noqa: E402
+from requests.adapters import HTTPAdapter  # noqa: E402
+from urllib3.util.retry import Retry  # noqa: E402
+
+# 並列ダウンロード数
+MAX_WORKERS = 8
+# 通信エラー時の再試行回数と初回の待機秒数（再試行ごとに倍にする）
+MAX_RETRIES = 5
+RETRY_BACKOFF_SECONDS = 2.0
+
+# 大きなファイルを何本の Range リクエストに分けて並列取得するか（0 または 1 で無効）
+DOWNLOAD_PARALLELISM = int(os.getenv("AIO_DOWNLOAD_PARALLELISM", "0"))
+# 分割ダウンロードの対象にするファイルサイズの下限
+RANGED_DOWNLOAD_MIN_BYTES = 256 * 1024 * 1024
+# 1回の読み書きの単位
+CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def _http_backend_factory() -> requests.Session:
+    """
+    Hugging Face Hub との通信に使うセッションを作成
+
+    接続をプールして並列ダウンロード間で再利用し（TLSハンドシェイクを繰り返さない）、
+    サーバー側の一時的なエラーは自動で再試行する
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504]),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+configure_http_backend(backend_factory=_http_backend_factory)
+
+
+def _snapshot_download_with_retry(model_id: str, local_dir: Path) -> str:
+    """
+    通信エラー時に指数バックオフで再試行しながらスナップショットをダウンロード
+
+    ダウンロード済みのファイルはスキップされ、途中のファイルは続きから再開される
+    """
+    for attempt in range(1, MAX_RETRIES + 1):
+        try:
+            return snapshot_download(
+                repo_id=model_id,
+                local_dir=str(local_dir),
+                max_workers=MAX_WORKERS,
+            )
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            wait = RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            logger.warning("⚠️  通信エラーのため %.0f 秒後に再試行します (%s/%s): %s", wait, attempt, MAX_RETRIES, e)
+            time.sleep(wait)
+
+
+def _download_range(url: str, headers: dict, path: Path, start: int, end: int) -> None:
+    """ファイルの start〜end バイト目（end を含む）を取得し、事前に確保したファイルの同じ位置に書き込む"""
+    range_headers = {**headers, "Range": f"bytes={start}-{end}"}
+    with get_session().get(url, headers=range_headers, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise RuntimeError(f"Range リクエストに対応していません: {url}")
+        with open(path, "r+b") as f:
+            f.seek(start)
+            for chunk in response.iter_content(chunk_size=CHUNK_BYTES):
+                f.write(chunk)
+
+
+def _download_file_ranged(model_id: str, filename: str, size: int, local_dir: Path, parallelism: int) -> None:
+    """1つの大きなファイルを複数の Range リクエストで並列にダウンロード"""
+    path = local_dir / filename
+    if path.exists() and path.stat().st_size == size:
+        return
+
+    # 完了前のファイルは別名で確保し、すべての範囲を書き込んでから置き換える
+    partial = path.with_name(path.name + ".incomplete")
+    partial.parent.mkdir(parents=True, exist_ok=True)
+    with open(partial, "wb") as f:
+        f.truncate(size)
+
+    url = hf_hub_url(model_id, filename)
+    headers = build_hf_headers()
+    part_size = -(-size // parallelism)
+    ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        futures = [executor.submit(_download_range, url, headers, partial, start, end) for start, end in ranges]
+        for future in futures:
+            future.result()
+
+    partial.replace(path)
+
+
+def _download_snapshot_ranged(model_id: str, local_dir: Path, parallelism: int) -> None:
+    """大きなファイルは分割して並列に、それ以外は hf_hub_download で1ファイルずつダウンロード"""
+    info = HfApi().model_info(model_id, files_metadata=True)
+    for sibling in info.siblings:
+        if sibling.size is not None and sibling.size > RANGED_DOWNLOAD_MIN_BYTES:
+            logger.info("📥 %s を %s 分割でダウンロード中...", sibling.rfilename, parallelism)
+            _download_file_ranged(model_id, sibling.rfilename, sibling.size, local_dir, parallelism)
+        else:
+            hf_hub_download(model_id, sibling.rfilename, local_dir=str(local_dir))
+
+
+def _is_download_complete(local_dir: Path) -> bool:
+    """設定ファイルとすべての重みファイルがそろい、途中までのファイルが残っていないか"""
+    if not (local_dir / "config.json").exists() or any(local_dir.glob("*.incomplete")):
+        return False
+    index_path = local_dir / "model.safetensors.index.json"
+    if index_path.exists():
+        shards = set(json.loads(index_path.read_text(encoding="utf-8"))["weight_map"].values())
+        return all((local_dir / shard).exists() for shard in shards)
+    return (local_dir / "model.safetensors").exists()
+
 
 def download_qwen_7b():
     """Qwen2.5-7B-Instruct をダウンロード"""
@@ -19,26 +154,25 @@ def download_qwen_7b():
     cache_dir.mkdir(parents=True, exist_ok=True)
 
     model_id = "Qwen/Qwen2.5-7B-Instruct"
-    target_dir = cache_dir / "Qwen_Qwen2.5-7B-Instruct"
+    # 変換前の重みはエクスポート済みモデルと区別するため別ディレクトリに直接保存する
+    source_dir = cache_dir / "Qwen_Qwen2.5-7B-Instruct_hf"
 
     # 既存チェック
-    if target_dir.exists() and list(target_dir.glob("*.xml")):
-        logger.info(f"✓ {model_id} は既にダウンロード済みです")
+    if _is_download_complete(source_dir):
+        logger.info("✓ %s は既にダウンロード済みです", model_id)
         return True
 
     try:
-        logger.info(f"📥 {model_id} をダウンロード中...")
+        logger.info("📥 %s をダウンロード中...", model_id)
         logger.info("⚠️  これには 15-30 分かかる場合があります...")
 
         # HuggingFace からダウンロード
-        snapshot_download(
-            repo_id=model_id,
-            cache_dir=str(cache_dir),
-            local_dir_use_symlinks=False,
-            resume_download=True,
-        )
+        if DOWNLOAD_PARALLELISM > 1:
+            _download_snapshot_ranged(model_id, source_dir, DOWNLOAD_PARALLELISM)
+        else:
+            _snapshot_download_with_retry(model_id, source_dir)
 
-        logger.info(f"✓ {model_id} のダウンロードが完了しました")
+        logger.info("✓ %s のダウンロードが完了しました: %s", model_id, source_dir)
 
         # OpenVINO 変換が必要な場合、別途スクリプトを実行
         logger.info("📝 注意: OpenVINO 形式への変換が必要な場合は、別途実行してください")
@@ -47,7 +181,7 @@ def download_qwen_7b():
         return True
 
     except Exception as e:
-        logger.error(f"❌ ダウンロード失敗: {e}")
+        logger.error("❌ ダウンロード失敗: %s", e)
         return False
 
 
@@ -27,10 +27,12 @@ try:
 except ImportError:
     LANGCHAIN_AVAILABLE = False
 
-    # LangChainが利用できない場合のダミークラス
+    # LangChainが利用できない場合のダミー（クラス定義と型注釈の評価に必要）
     class LLM:
         pass
 
+    CallbackManagerForLLMRun = Any
+
 
 from chat_service import ChatService
 
@@ -78,18 +80,19 @@ class OpenVINOChatLangChain(LLM):
             session_id: セッションID（指定しない場合は新規作成）
             system_prompt: システムプロンプト
         """
-        super().__init__(**kwargs)
-
+        # LangChainの有無は生成時に一度だけ確認し、呼び出しごとには確認しない
         if not LANGCHAIN_AVAILABLE:
             raise ImportError("LangChainが利用できません。以下のコマンドでインストールしてください:\n" "pip install langchain")
 
+        super().__init__(**kwargs)
+
         # ChatServiceのインスタンスを取得または作成
         if chat_service is not None:
             self.chat_service = chat_service
             logger.info("Using shared ChatService instance")
         else:
             self.chat_service = ChatService(model_name=self.model_name)
-            logger.info(f"Created new ChatService instance with model: {self.model_name}")
+            logger.info("Created new ChatService instance with model: %s", self.model_name)
 
     @property
     def _llm_type(self) -> str:
@@ -114,19 +117,18 @@ class OpenVINOChatLangChain(LLM):
 
         Returns:
             生成されたテキスト
-        """
-        try:
-            result = self.chat_service.chat(message=prompt, session_id=self.session_id, system_prompt=self.system_prompt)
 
-            # セッションIDを保存
-            if self.session_id is None:
-                self.session_id = result["session_id"]
+        例外はそのまま送出し、LangChainのコールバックマネージャーに処理を任せる
+        """
+        result = self.chat_service.chat(message=prompt, session_id=self.session_id, system_prompt=self.system_prompt)
+        if "error" in result:
+            raise RuntimeError(result["error"])
 
-            return result["response"]
+        # セッションIDを保存
+        if self.session_id is None:
+            self.session_id = result["session_id"]
 
-        except Exception as e:
-            logger.error(f"LangChain adapter error: {e}")
-            raise
+        return result["response"]
 
     def get_history(self) -> Dict:
         """
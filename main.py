@@ -2,57 +2,117 @@
 OpenVINO AI Toolkit - FastAPIアプリケーション
 """
 
-import threading
+import asyncio
+import hashlib
+import json
 import logging
+import os
+import re
+import weakref
 import uvicorn
-from typing import Optional, List, Dict
+from contextlib import asynccontextmanager, suppress
+from typing import Annotated, Optional, List, Dict, Tuple
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from pydantic import BaseModel, ConfigDict, StringConstraints
 from translation_service import TranslationService
 from chat_service import ChatService
 import config
 
 logger = logging.getLogger(__name__)
 
+# orjson が使える場合はJSON応答のエンコードに使う（標準の json より高速）
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def _create_chat_service() -> ChatService:
+    """デフォルトモデルでチャットサービスを生成（モデルのロードを含むブロッキング処理）"""
+    # デフォルトモデルを config から取得
+    default_model_key = config.DEFAULT_CHAT_MODEL
+    model_name = config.get_model_name(default_model_key)
+
+    service = ChatService(model_name=model_name, use_mock=False, **config.CHAT_CONFIG)
+    logger.info("Chat service initialized with model: %s", model_name)
+    return service
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    起動時にチャットサービスを初期化し（設定があれば翻訳モデルも事前ロード）、終了時に停止する
+
+    ワーカーごとに1回だけ実行され、最初のリクエストがモデルのロードを待たずに済む。
+    初期化に失敗しても翻訳機能は使えるよう、チャットAPIのみ利用不可にして起動を続ける
+    """
+    try:
+        app.state.chat_service = await run_in_threadpool(_create_chat_service)
+    except Exception as e:
+        logger.error("Failed to initialize chat service: %s", e)
+        app.state.chat_service = None
+
+    if config.TRANSLATION_PREWARM_PAIRS:
+        await run_in_threadpool(translation_service.prewarm, config.TRANSLATION_PREWARM_PAIRS)
+
+    yield
+
+    if app.state.chat_service is not None:
+        app.state.chat_service.close()
+    translation_service.close()
+
+
 # FastAPIアプリケーションの初期化
 app = FastAPI(
     title="OpenVINO AI Toolkit",
     description="OpenVINOを使った高速AI翻訳とチャット機能を提供するWebサービス",
     version="2.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse if ORJSON_AVAILABLE else JSONResponse,
 )
 
 # 静的ファイルとテンプレートの設定
 app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+# テンプレートは実行中に変更しないため更新確認を省き、コンパイル結果をプロセス間で再利用する
+templates = Jinja2Templates(
+    env=Environment(
+        loader=FileSystemLoader("templates"),
+        bytecode_cache=FileSystemBytecodeCache(),
+        auto_reload=False,
+        cache_size=400,
+        autoescape=True,
+    )
+)
 
 # 翻訳サービスの初期化
-translation_service = TranslationService()
-
-# チャットサービスの初期化（遅延ロード、スレッドセーフ）
-
-chat_service = None
-chat_service_lock = threading.Lock()
+translation_service = TranslationService(**config.TRANSLATION_CONFIG)
 
+# サポート言語の一覧は固定のため、起動時に一度だけ取得して応答本体とETagを作っておく
+SUPPORTED_LANGUAGES = tuple(translation_service.get_supported_languages())
+_LANGUAGES_BODY = json.dumps({"languages": SUPPORTED_LANGUAGES}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+_LANGUAGES_HEADERS = {
+    "Cache-Control": "public, max-age=3600",
+    "ETag": f'"{hashlib.md5(_LANGUAGES_BODY, usedforsecurity=False).hexdigest()}"',
+}
 
-def get_chat_service():
-    """チャットサービスのインスタンスを取得（遅延ロード、スレッドセーフ）"""
-    global chat_service
+# トップページはリクエストごとに変わる内容を含まないため、起動時に一度だけ描画しておく
+_INDEX_HTML = templates.get_template("index.html").render(languages=SUPPORTED_LANGUAGES)
+_INDEX_HEADERS = {"Cache-Control": "public, max-age=300"}
 
-    if chat_service is None:
-        with chat_service_lock:
-            # ダブルチェックロッキングパターン
-            if chat_service is None:
-                # デフォルトモデルを config から取得
-                default_model_key = config.DEFAULT_CHAT_MODEL
-                model_name = config.get_model_name(default_model_key)
 
-                chat_service = ChatService(model_name=model_name, use_mock=False, **config.CHAT_CONFIG)
-                logger.info(f"Chat service initialized with model: {model_name}")
-
-    return chat_service
+def get_chat_service(request: Request) -> ChatService:
+    """起動時に初期化したチャットサービスを取得"""
+    service = getattr(request.app.state, "chat_service", None)
+    if service is None:
+        raise HTTPException(status_code=503, detail="Chat service is not available")
+    return service
 
 
 # リクエストモデル
@@ -61,14 +121,15 @@ class TranslationRequest(BaseModel):
     target_lang: str
     source_lang: Optional[str] = None
 
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "text": "Hello, world!",
                 "target_lang": "ja",
                 "source_lang": "en",
             }
         }
+    )
 
 
 # レスポンスモデル
@@ -82,15 +143,16 @@ class TranslationResponse(BaseModel):
 
 # Chat リクエストモデル
 class ChatRequest(BaseModel):
-    message: str
-    session_id: Optional[str] = None
+    # 前後の空白を除いた上で空でないこと、セッションIDは英数字・ハイフン・アンダースコアのみ（パース時に検証）
+    message: Annotated[str, StringConstraints(strip_whitespace=True, min_length=1, max_length=8192)]
+    session_id: Annotated[Optional[str], StringConstraints(pattern=r"^[A-Za-z0-9_-]{1,100}$")] = None
     model: Optional[str] = None
     system_prompt: Optional[str] = None
     use_langchain: Optional[bool] = False
     translate_to: Optional[str] = None
 
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "message": "こんにちは",
                 "session_id": "optional-session-id",
@@ -100,6 +162,7 @@ class ChatRequest(BaseModel):
                 "translate_to": "en",
             }
         }
+    )
 
 
 # Chat レスポンスモデル
@@ -127,10 +190,9 @@ async def health():
 
 # ルートページ - Webインターフェース
 @app.get("/", response_class=HTMLResponse)
-async def read_root(request: Request):
+async def read_root():
     """翻訳Webインターフェースを表示"""
-    languages = translation_service.get_supported_languages()
-    return templates.TemplateResponse("index.html", {"request": request, "languages": languages})
+    return HTMLResponse(content=_INDEX_HTML, headers=_INDEX_HEADERS)
 
 
 # 翻訳API エンドポイント
@@ -143,7 +205,12 @@ async def translate(request: TranslationRequest):
     - **target_lang**: ターゲット言語コード (例: "ja", "en", "zh")
     - **source_lang**: ソース言語コード (オプション)
     """
-    result = translation_service.translate(
+    # 翻訳サービスは空の入力をそのまま返すため、APIとしてはここで入力エラーにする
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="Text is empty")
+
+    # 翻訳はブロッキング処理のため、イベントループを止めないよう別スレッドで実行する（設定により同時リクエストとまとめる）
+    result = await translation_service.translate_async(
         text=request.text,
         target_lang=request.target_lang,
         source_lang=request.source_lang,
@@ -152,16 +219,21 @@ async def translate(request: TranslationRequest):
     if "error" in result:
         raise HTTPException(status_code=400, detail=result["error"])
 
-    return TranslationResponse(**result)
+    # response_model による検証・変換は1回で済むよう、モデルを作らずに辞書のまま返す
+    return result
 
 
 # サポートされている言語のリストを取得
 @app.get("/api/languages")
-async def get_languages():
+async def get_languages(request: Request):
     """
     サポートされている言語のリストを取得
+
+    キャッシュ済みの内容と同じ場合（If-None-Match がETagと一致）は 304 を返す
     """
-    return {"languages": translation_service.get_supported_languages()}
+    if request.headers.get("if-none-match") == _LANGUAGES_HEADERS["ETag"]:
+        return Response(status_code=304, headers=_LANGUAGES_HEADERS)
+    return Response(content=_LANGUAGES_BODY, media_type="application/json", headers=_LANGUAGES_HEADERS)
 
 
 # ヘルスチェック
@@ -173,23 +245,33 @@ async def health_check():
 
 # ========== Chat API エンドポイント ==========
 
+# 利用可能なモデル一覧（設定は固定のため起動時に一度だけ作る）
+_AVAILABLE_MODELS = tuple(config.list_available_models())
+
+# セッションID -> 同じセッションへのリクエストを直列化するロック
+# （処理中のリクエストが参照している間だけ保持され、使われなくなれば自動的に消える）
+_session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
 
-def _validate_chat_request(request: ChatRequest) -> None:
-    """チャットリクエストの検証"""
-    if not request.message or not request.message.strip():
-        raise HTTPException(status_code=400, detail="Message cannot be empty")
-    if request.session_id and len(request.session_id) > 100:
-        raise HTTPException(status_code=400, detail="Session ID is too long")
+def _get_session_lock(session_id: Optional[str]) -> asyncio.Lock:
+    """同じセッションへの同時リクエストを1件ずつ処理するためのロックを取得（新規セッションは他と共有しない）"""
+    if not session_id:
+        return asyncio.Lock()
+    lock = _session_locks.get(session_id)
+    if lock is None:
+        lock = _session_locks[session_id] = asyncio.Lock()
+    return lock
 
 
 def _resolve_model_name(model_key: Optional[str]) -> Optional[str]:
     """モデルキーからHugging Face名を解決"""
     if not model_key:
         return None
-    try:
-        return config.get_model_name(model_key)
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    # 例外を使わず辞書の参照だけで解決する
+    model_name = config.MODEL_NAME_BY_KEY.get(model_key.lower())
+    if model_name is None:
+        raise HTTPException(status_code=400, detail=f"Unknown model: {model_key}. Available: {list(config.MODEL_NAME_BY_KEY)}")
+    return model_name
 
 
 def _translate_response(response_text: str, target_lang: str) -> Optional[str]:
@@ -203,14 +285,107 @@ def _translate_response(response_text: str, target_lang: str) -> Optional[str]:
         if "error" not in translation_result:
             return translation_result["translated_text"]
         else:
-            logger.warning(f"Translation failed: {translation_result['error']}")
+            logger.warning("Translation failed: %s", translation_result["error"])
     except Exception as e:
-        logger.error(f"Translation error: {e}")
+        logger.error("Translation error: %s", e)
     return None
 
 
+# 文の区切り（句点・感嘆符・疑問符・改行、または空白が続くピリオド。区切り文字と後続の空白は文に含める）
+_SENTENCE_RE = re.compile(r".*?(?:[。！？!?\n]+|\.(?=\s)|$)\s*", re.S)
+
+# 訳文を空白なしで連結する言語
+_NO_SPACE_LANGS = frozenset({"ja", "zh"})
+
+
+# ピリオドで終わっても文末ではない略語（小文字で比較。"J." のような1文字のイニシャルも文末とみなさない）
+_ABBREVIATIONS = frozenset(
+    {"e.g.", "i.e.", "etc.", "vs.", "cf.", "approx.", "no.", "fig.", "mr.", "mrs.", "ms.", "dr.", "prof.", "st.", "jr.", "sr."}
+)
+_INITIAL_RE = re.compile(r"(?:^|\s)[A-Za-z]\.$")
+
+
+def _ends_with_abbreviation(sentence: str) -> bool:
+    stripped = sentence.rstrip()
+    if "\n" in sentence[len(stripped) :]:
+        return False
+    last_word = stripped.rsplit(None, 1)[-1].lower() if stripped else ""
+    return last_word in _ABBREVIATIONS or _INITIAL_RE.search(stripped) is not None
+
+
+def _split_sentences(text: str) -> List[str]:
+    """テキストを文ごとに分割（"e.g. " などの略語のピリオドでは分割しない）"""
+    sentences: List[str] = []
+    for m in _SENTENCE_RE.finditer(text):
+        sentence = m.group()
+        if not sentence:
+            continue
+        if sentences and _ends_with_abbreviation(sentences[-1]):
+            sentences[-1] += sentence
+        else:
+            sentences.append(sentence)
+    return sentences
+
+
+def _join_translations(sentences: List[str], translations: List[str], target_lang: str) -> str:
+    """文ごとの訳文を連結（元の文の後ろにあった改行は保つ）"""
+    separator = "" if target_lang in _NO_SPACE_LANGS else " "
+    parts = []
+    for sentence, translation in zip(sentences, translations):
+        trailing = sentence[len(sentence.rstrip()) :]
+        parts.append(translation + (trailing if "\n" in trailing else separator))
+    return "".join(parts).strip()
+
+
+async def _chat_and_translate(
+    service: ChatService, request: ChatRequest, model_name: Optional[str]
+) -> Tuple[Dict, Optional[str]]:
+    """
+    応答を逐次生成しながら、完成した文から順に翻訳を始める（生成と翻訳を並行させる）
+
+    生成の完了後は後処理済みの最終応答を文に分け、生成中に翻訳を始めた文と一致するものはその結果を使い、
+    後処理で変わった文だけを新たに翻訳する
+    """
+    target_lang = request.translate_to
+    tasks: Dict[str, asyncio.Future] = {}
+
+    def start_translation(sentence: str) -> None:
+        key = sentence.strip()
+        if key and key not in tasks:
+            tasks[key] = asyncio.ensure_future(run_in_threadpool(_translate_response, key, target_lang))
+
+    result: Dict = {"error": "No response generated"}
+    pending = ""
+    events = service.chat_stream(
+        message=request.message,
+        session_id=request.session_id,
+        system_prompt=request.system_prompt,
+        model_name=model_name,
+    )
+    async for event in iterate_in_threadpool(events):
+        if "delta" not in event:
+            result = event
+            continue
+        # 最後の1文はまだ続く可能性があるため、それ以前の文だけ翻訳を始める
+        sentences = _split_sentences(pending + event["delta"])
+        for sentence in sentences[:-1]:
+            start_translation(sentence)
+        pending = sentences[-1] if sentences else ""
+
+    if "error" in result:
+        return result, None
+
+    sentences = [sentence for sentence in _split_sentences(result["response"]) if sentence.strip()]
+    for sentence in sentences:
+        start_translation(sentence)
+    translations = await asyncio.gather(*(tasks[sentence.strip()] for sentence in sentences))
+    if not sentences or None in translations:
+        return result, None
+    return result, _join_translations(sentences, translations, target_lang)
+
+
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """
     チャットメッセージを送信して応答を取得
 
@@ -220,57 +395,111 @@ async def chat(request: ChatRequest):
     - **model**: 使用するモデル (オプション、例: "tinyllama", "japanese-gpt-neox")
     - **translate_to**: 応答を翻訳する言語コード (オプション)
     """
-    _validate_chat_request(request)
-    service = get_chat_service()
+    service = get_chat_service(http_request)
     model_name = _resolve_model_name(request.model)
 
-    result = service.chat(
-        message=request.message.strip(),
-        session_id=request.session_id,
-        system_prompt=request.system_prompt,
-        model_name=model_name,
-    )
+    # 生成はチャットサービスの生成用スレッドプールで実行される
+    # 同じセッションへの同時リクエストは、履歴の更新が混ざらないよう前の生成の完了を待つ
+    # 文ごとの並行翻訳は逐次生成を使うため、プレフィックスの再利用とバッチ生成が効かない（既定では無効）
+    translated_response = None
+    async with _get_session_lock(request.session_id):
+        if request.translate_to and config.CHAT_TRANSLATE_WHILE_GENERATING:
+            result, translated_response = await _chat_and_translate(service, request, model_name)
+        else:
+            result = await service.achat(
+                message=request.message,
+                session_id=request.session_id,
+                system_prompt=request.system_prompt,
+                model_name=model_name,
+            )
 
     if "error" in result:
         raise HTTPException(status_code=400, detail=result["error"])
 
-    translated_response = None
-    if request.translate_to:
-        translated_response = _translate_response(result["response"], request.translate_to)
-
-    return ChatResponse(
-        response=result["response"],
-        session_id=result["session_id"],
-        timestamp=result["timestamp"],
-        translated_response=translated_response,
+    # 応答全体を1回で翻訳し、文をまたぐ文脈を訳文に反映させる
+    if request.translate_to and not config.CHAT_TRANSLATE_WHILE_GENERATING:
+        translated_response = await run_in_threadpool(_translate_response, result["response"], request.translate_to)
+
+    return {
+        "response": result["response"],
+        "session_id": result["session_id"],
+        "timestamp": result["timestamp"],
+        "translated_response": translated_response,
+    }
+
+
+def _encode_sse_event(event: Dict) -> bytes:
+    """イベントを Server-Sent Events の data 行にエンコード"""
+    if ORJSON_AVAILABLE:
+        data = orjson.dumps(event)
+    else:
+        data = json.dumps(event, ensure_ascii=False).encode("utf-8")
+    return b"data: " + data + b"\n\n"
+
+
+async def _chat_event_stream(service: ChatService, request: ChatRequest, model_name: Optional[str]):
+    """chat_stream のイベントをスレッドプールで取り出しながら SSE として送出"""
+    # 同じセッションへの同時リクエストは前の生成の完了を待つ（/api/chat と共通のロック）
+    async with _get_session_lock(request.session_id):
+        events = service.chat_stream(
+            message=request.message,
+            session_id=request.session_id,
+            system_prompt=request.system_prompt,
+            model_name=model_name,
+        )
+        try:
+            async for event in iterate_in_threadpool(events):
+                yield _encode_sse_event(event)
+        finally:
+            # クライアントが切断した場合は生成を止め、応答のないユーザーメッセージを履歴から取り除く
+            # （スレッドプールで次のイベントを取り出している最中は閉じられないため、その場合は取り出し後の破棄に任せる）
+            with suppress(ValueError):
+                events.close()
+
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """
+    チャットメッセージを送信し、生成された応答を Server-Sent Events で逐次受け取る
+
+    生成中は {"session_id", "delta"} を、最後に /api/chat と同じ内容に "done": true を加えたイベントを送る。
+    エラー時は {"error", "done": true} を送る（translate_to は無視される）
+    """
+    service = get_chat_service(http_request)
+    model_name = _resolve_model_name(request.model)
+    return StreamingResponse(
+        _chat_event_stream(service, request, model_name),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
     )
 
 
 @app.get("/api/chat/history/{session_id}", response_model=ChatHistoryResponse)
-async def get_chat_history(session_id: str):
+async def get_chat_history(session_id: str, request: Request):
     """
     セッションの会話履歴を取得
 
     - **session_id**: セッションID
     """
-    service = get_chat_service()
-    result = service.get_history(session_id)
+    service = get_chat_service(request)
+    # セッションのロックを取るため、イベントループを止めないようスレッドプールで実行する
+    result = await run_in_threadpool(service.get_history, session_id)
 
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
 
-    return ChatHistoryResponse(**result)
+    return result
 
 
 @app.delete("/api/chat/history/{session_id}")
-async def delete_chat_history(session_id: str):
+async def delete_chat_history(session_id: str, request: Request):
     """
     セッションの会話履歴を削除
 
     - **session_id**: セッションID
     """
-    service = get_chat_service()
-    result = service.delete_history(session_id)
+    service = get_chat_service(request)
+    result = await run_in_threadpool(service.delete_history, session_id)
 
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
@@ -279,20 +508,16 @@ async def delete_chat_history(session_id: str):
 
 
 @app.get("/api/chat/models")
-async def get_available_models():
+async def get_available_models(request: Request):
     """
     利用可能なチャットモデルの一覧を取得
 
     Ollamaライクなモデル管理機能
     """
-    models = config.list_available_models()
-
-    # 現在ロードされているモデルの情報を追加
-    service = get_chat_service()
-    loaded_models = service.get_loaded_models()
-
-    for model in models:
-        model["loaded"] = model["name"] in loaded_models
+    # 現在ロードされているモデルの情報を追加（共有の一覧は書き換えずにコピーへ付け加える）
+    service = get_chat_service(request)
+    loaded_models = set(await run_in_threadpool(service.get_loaded_models))
+    models = [{**model, "loaded": model["name"] in loaded_models} for model in _AVAILABLE_MODELS]
 
     return {
         "models": models,
@@ -302,35 +527,50 @@ async def get_available_models():
 
 
 @app.get("/api/chat/models/{model_key}")
-async def get_model_info(model_key: str):
+async def get_model_info(model_key: str, request: Request):
     """
     特定のモデルの詳細情報を取得
 
     - **model_key**: モデルのキー (例: "tinyllama", "japanese-gpt-neox")
     """
-    try:
-        info = config.get_model_info(model_key)
-        service = get_chat_service()
-        loaded = info["name"] in service.get_loaded_models()
-
-        return {
-            "key": model_key,
-            **info,
-            "loaded": loaded,
-        }
-    except ValueError as e:
-        raise HTTPException(status_code=404, detail=str(e))
+    info = config.AVAILABLE_CHAT_MODELS.get(model_key.lower())
+    if info is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Unknown model: {model_key}. Available: {list(config.AVAILABLE_CHAT_MODELS.keys())}",
+        )
+
+    service = get_chat_service(request)
+    loaded = info["name"] in await run_in_threadpool(service.get_loaded_models)
+
+    return {
+        "key": model_key,
+        **info,
+        "loaded": loaded,
+    }
 
 
 @app.get("/api/chat/sessions")
-async def list_chat_sessions():
+async def list_chat_sessions(request: Request):
     """
     すべてのアクティブなチャットセッションをリスト
     """
-    service = get_chat_service()
-    return service.list_sessions()
+    service = get_chat_service(request)
+    return await run_in_threadpool(service.list_sessions)
 
 
 if __name__ == "__main__":
     # アプリケーションを起動
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # 開発時は UVICORN_RELOAD=true で自動リロード（単一プロセス）、それ以外は WEB_CONCURRENCY 個のワーカーで起動する
+    # （チャットのセッションとモデルはワーカーごとに持つため、既定は1ワーカー）
+    # イベントループとHTTPパーサーは uvloop / httptools がインストールされていれば自動で使われる
+    reload = os.getenv("UVICORN_RELOAD", "false").lower() == "true"
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=reload,
+        workers=None if reload else int(os.getenv("WEB_CONCURRENCY", "1")),
+        loop="auto",
+        http="auto",
+    )
@@ -3,11 +3,92 @@
 小さいLLMの限界を超える専門的な処理ロジック
 """
 
+import functools
 import re
 import logging
 
 logger = logging.getLogger(__name__)
 
+# プロンプト改善リクエストの区切り（正規表現を使わず文字列検索で分割する）
+_PROMPT_MARKER = "改善したいプロンプト："
+_PROBLEM_MARKER = "問題："
+
+# 正規表現はリクエストごとに使うため、インポート時に一度だけコンパイルしておく
+_BIG_MIRROR_RE = re.compile(r"大きな鏡")
+_WS_RE = re.compile(r"\s+")
+_COMMA_RUN_RE = re.compile(r"、{2,}")
+_JP_ONLY_RE = re.compile(r"[^ぁ-ん ァ-ヴー一-龥々〆〤ゝゞ、。・ー，、]")
+_ENGLISH_WORD_RE = re.compile(r"\b[a-zA-Z]+\b")
+_CJK_RE = re.compile(r"[\u4e00-\u9fff]")
+# ルールベースのプロンプト生成で付け足す固定の接尾辞
+# （以前は "," で連結していたが、直後の日本語フィルタで "," は消えるため結果は同じ）
+_SUFFIX_DANCE = "、高品質、明るい照明"
+_SUFFIX_QUALITY_LIGHTING = "、高品質明るい照明"
+_SUFFIX_QUALITY = "、高品質"
+_SUFFIX_LIGHTING = "、明るい照明"
+
+# 同じリクエストの再送に備えて処理結果をキャッシュする（長すぎる入力はキャッシュしない）
+_RESULT_CACHE_SIZE = 1024
+_RESULT_CACHE_MAX_INPUT_LENGTH = 4096
+
+# 英単語・英字・日本語文字を1回の走査で数えるためのパターン
+# 連続した文字をまとめて一致させるので、Pythonのループは文字ごとではなく連続部分ごとになる
+_LANG_RUN_RE = re.compile(
+    r"(?P<word>\b[a-zA-Z]+\b)|(?P<latin>[a-zA-Z]+)|(?P<japanese>[\u3040-\u309f\u30a0-\u30ff\u4e00-\u9fff]+)"
+)
+
+# プロンプト生成リクエストから取り除く指示パターン（より広範に）
+# 前のパターンで除去した結果に次のパターンを適用するため、この順序で1つずつ適用する
+_INSTRUCTION_RES = tuple(
+    re.compile(pattern)
+    for pattern in (
+        r"^画像生成.*?ください。?",  # 行頭から
+        r"プロンプト.*?返してください",
+        r"プロンプト.*?ください",
+        r"日本語.*?返してください",
+        r"日本語.*?ください",
+        r"１行.*?ください",
+        r"1行.*?ください",
+    )
+)
+# どのパターンも必ずこの文字列で終わるため、含まれなければ正規表現を走らせない
+_INSTRUCTION_SUFFIX = "ください"
+
+# LLM応答に説明的な内容が含まれていないかを1回の検索で調べるパターン
+_IMPROVEMENT_EXPLANATION_RE = re.compile(
+    "|".join(map(re.escape, ("注意", "備考", "ただし", "ですが", "説明", "理由", "詳細", "ます", "ました", "します")))
+)
+_GENERATION_EXPLANATION_RE = re.compile("|".join(map(re.escape, ("注意", "備考", "ただし", "ですが", "説明", "理由", "です", "ます", "ました"))))
+
+
+def _count_matches(pattern: re.Pattern, text: str, limit: int) -> int:
+    """パターンの一致数を数える（limit に達した時点で走査を打ち切る）"""
+    count = 0
+    for _ in pattern.finditer(text):
+        count += 1
+        if count >= limit:
+            break
+    return count
+
+
+def _lang_stats(text: str, max_english_words: int) -> tuple[int, int, int]:
+    """英単語数・英字数・日本語文字数を1回の走査で数える
+
+    英単語が max_english_words に達した時点で打ち切る（他の数は途中までの値になる）
+    """
+    english_words = english_chars = japanese_chars = 0
+    for match in _LANG_RUN_RE.finditer(text):
+        group = match.lastgroup
+        if group == "japanese":
+            japanese_chars += match.end() - match.start()
+        else:
+            english_chars += match.end() - match.start()
+            if group == "word":
+                english_words += 1
+                if english_words >= max_english_words:
+                    break
+    return english_words, english_chars, japanese_chars
+
 
 class PromptImprovementEngine:
     """画像生成プロンプト改善の専門エンジン"""
@@ -16,13 +97,17 @@ class PromptImprovementEngine:
     def extract_original_prompt(user_message: str) -> tuple[str, str]:
         """ユーザーメッセージからプロンプトと問題を抽出"""
         # パターン1: 「改善したいプロンプト：」と「問題：」で区切られている場合
-        prompt_match = re.search(r"改善したいプロンプト：(.+?)(?:問題：|$)", user_message, re.DOTALL)
-        problem_match = re.search(r"問題：(.+?)$", user_message, re.DOTALL)
+        prompt = ""
+        start = user_message.find(_PROMPT_MARKER)
+        if start != -1:
+            rest = user_message[start + len(_PROMPT_MARKER) :]
+            # プロンプトは1文字以上なので、直後の「問題：」は区切りとみなさない
+            end = rest.find(_PROBLEM_MARKER, 1)
+            prompt = (rest if end == -1 else rest[:end]).strip()
 
-        prompt = prompt_match.group(1).strip() if prompt_match else ""
-        problem = problem_match.group(1).strip() if problem_match else ""
+        _, _, problem = user_message.partition(_PROBLEM_MARKER)
 
-        return prompt, problem
+        return prompt, problem.strip()
 
     @staticmethod
     def improve_prompt(original_prompt: str, problem: str = "") -> str:
@@ -38,31 +123,38 @@ class PromptImprovementEngine:
         if problem:
             # 「鏡の中がおかしい」などの問題を解決する表現を追加
             if "鏡" in problem:
-                prompt = re.sub(r"大きな鏡", "大きな鏡（鏡に映る人物の手足が正確で自然な姿勢）", prompt)
+                prompt = _BIG_MIRROR_RE.sub("大きな鏡（鏡に映る人物の手足が正確で自然な姿勢）", prompt)
                 if "大きな鏡" not in prompt:
                     prompt += "、鏡に正確に映る人物の姿勢"
 
-        # フォーマット改善
-        parts = [p.strip() for p in prompt.split("、") if p.strip()]
+        # フォーマット改善（部品の追加が必要な場合だけ分割して組み直す）
+        if "高品質" in prompt and "超詳細" not in prompt:
+            improved_parts = []
+            added_detail = False
 
-        # プロンプト部品を整理
-        improved_parts = []
-        added_corrections = set()
+            for part in prompt.split("、"):
+                part = part.strip()
+                if not part:
+                    continue
+                improved_parts.append(part)
 
-        for part in parts:
-            improved_parts.append(part)
-
-            # 一般的な改善を自動追加
-            if "高品質" in part and "超詳細" not in prompt:
-                if "超詳細" not in added_corrections:
+                # 一般的な改善を自動追加
+                if not added_detail and "高品質" in part:
                     improved_parts.append("超詳細な描写")
-                    added_corrections.add("超詳細")
+                    added_detail = True
 
-        # 改善されたプロンプトを生成
-        improved = "、".join(improved_parts)
+            # 改善されたプロンプトを生成
+            improved = "、".join(improved_parts)
 
-        # 日本語のみを確保
-        improved = re.sub(r"\s+", "", improved)  # 空白を削除
+            # 日本語のみを確保
+            improved = _WS_RE.sub("", improved)  # 空白を削除
+        else:
+            improved = _WS_RE.sub("", prompt)  # 空白を削除
+
+            # 空の部品（連続・先頭・末尾の読点）を取り除く
+            if "、、" in improved:
+                improved = _COMMA_RUN_RE.sub("、", improved)
+            improved = improved.strip("、")
 
         logger.info(f"改善されたプロンプト: {improved}")
         return improved
@@ -77,38 +169,37 @@ class PromptImprovementEngine:
             return "画像生成のプロンプト"
 
         # 句点や句読点の清掃
-        prompt = prompt.lstrip("。、")
-        prompt = prompt.strip()
+        # 末尾は strip 済みなので先頭だけ整える
+        prompt = prompt.lstrip("。、").lstrip()
 
         # 既に十分な長さの場合はそのまま使用
         if len(prompt) > 15:
             # 日本語のみを確保
-            prompt = re.sub(r"[^ぁ-ん ァ-ヴー一-龥々〆〤ゝゞ、。・ー，、]", "", prompt)
-            prompt = prompt.strip().rstrip("。、 ")
+            prompt = _JP_ONLY_RE.sub("", prompt)
+            # 日本語のみにした後で残る空白は半角スペースだけ
+            prompt = prompt.rstrip("。、 ").lstrip(" ")
 
             # よくあるキーワードが入っていなければ追加
             if "高品質" not in prompt:
                 if "ダンス" in prompt or "教室" in prompt:
-                    prompt = f"{prompt}、高品質、明るい照明"
+                    prompt += _SUFFIX_DANCE
 
             return prompt
 
         # よくあるキーワードを追加
-        add_details = []
-
         if "ダンス" in description or "教室" in description or "スタジオ" in description:
-            if "高品質" not in prompt:
-                add_details.append("高品質")
-            if "明るい" not in prompt and "照明" not in prompt:
-                add_details.append("明るい照明")
-
-        if add_details:
-            prompt = f"{prompt}、{','.join(add_details)}"
+            add_quality = "高品質" not in prompt
+            add_lighting = "明るい" not in prompt and "照明" not in prompt
+            if add_quality and add_lighting:
+                prompt += _SUFFIX_QUALITY_LIGHTING
+            elif add_quality:
+                prompt += _SUFFIX_QUALITY
+            elif add_lighting:
+                prompt += _SUFFIX_LIGHTING
 
         # 日本語のみを確保
-        prompt = re.sub(r"[^ぁ-ん ァ-ヴー一-龥々〆〤ゝゞ、。・ー，、]", "", prompt)
-        prompt = re.sub(r"[\s、]+$", "", prompt)  # 末尾の空白と句点を削除
-        prompt = re.sub(r",\s*", "、", prompt)  # コンマを日本語句点に統一
+        prompt = _JP_ONLY_RE.sub("", prompt)
+        prompt = prompt.rstrip("、 ")  # 末尾の空白と句点を削除
 
         logger.info(f"生成されたプロンプト: {prompt}")
         return prompt
@@ -125,7 +216,13 @@ def process_prompt_improvement_request(user_message: str, llm_response: str = ""
     Returns:
         改善されたプロンプト
     """
+    if len(user_message) + len(llm_response) <= _RESULT_CACHE_MAX_INPUT_LENGTH:
+        return _cached_prompt_improvement(user_message, llm_response)
+    return _process_prompt_improvement(user_message, llm_response)
+
 
+def _process_prompt_improvement(user_message: str, llm_response: str) -> str:
+    """プロンプト改善リクエストの処理本体"""
     # ユーザーメッセージからプロンプトと問題を抽出
     original_prompt, problem = PromptImprovementEngine.extract_original_prompt(user_message)
 
@@ -139,29 +236,28 @@ def process_prompt_improvement_request(user_message: str, llm_response: str = ""
 
         # 言語混合検出：複数言語が混在しているかをチェック
 
-        # 英字カウント (単語として)
-        english_words = len(re.findall(r"\b[a-zA-Z]+\b", cleaned))
-
-        # 中国語（簡体字）カウント（が、ゃ、など日本語と区別）
-        chinese_simplified = len(re.findall(r"[\u4e00-\u9fff]", cleaned))
+        # 英字カウント (単語として、判定に必要な数に達したら打ち切る)
+        english_words = _count_matches(_ENGLISH_WORD_RE, cleaned, 2)
 
         # 言語混合判定：英字が3個以上含まれている場合、言語混合の可能性が高い
         if english_words >= 2:
-            logger.warning(f"言語混合検出（英字 {english_words}個）: {cleaned[:60]} - ルールベース処理に切り替え")
+            logger.warning(f"言語混合検出（英字 {english_words}個以上）: {cleaned[:60]} - ルールベース処理に切り替え")
             improved = PromptImprovementEngine.improve_prompt(original_prompt, problem)
             return improved
 
+        # 中国語（簡体字）カウント（が、ゃ、など日本語と区別）
+        chinese_simplified = _count_matches(_CJK_RE, cleaned, 10)
+
         # 中国語が10文字以上混在している場合
         if chinese_simplified >= 10:
-            logger.warning(f"中国語混合検出: {chinese_simplified}文字 - ルールベース処理に切り替え")
+            logger.warning(f"中国語混合検出: {chinese_simplified}文字以上 - ルールベース処理に切り替え")
             improved = PromptImprovementEngine.improve_prompt(original_prompt, problem)
             return improved
 
         # その他の検証
         if len(cleaned) > 10 and len(cleaned) < 500:
             # 説明的な内容が含まれていないか確認
-            bad_markers = ["注意", "備考", "ただし", "ですが", "説明", "理由", "詳細", "ます", "ました", "します"]
-            has_explanation = any(marker in cleaned for marker in bad_markers)
+            has_explanation = _IMPROVEMENT_EXPLANATION_RE.search(cleaned) is not None
 
             if not has_explanation:
                 logger.info(f"LLM応答を採用: {cleaned[:50]}")
@@ -185,32 +281,27 @@ def process_prompt_generation_request(user_message: str, llm_response: str = "")
     Returns:
         生成されたプロンプト
     """
+    if len(user_message) + len(llm_response) <= _RESULT_CACHE_MAX_INPUT_LENGTH:
+        return _cached_prompt_generation(user_message, llm_response)
+    return _process_prompt_generation(user_message, llm_response)
+
 
+def _process_prompt_generation(user_message: str, llm_response: str) -> str:
+    """プロンプト生成リクエストの処理本体"""
     if not user_message:
         return "申し訳ありませんが、説明が確認できませんでした。"
 
     # ユーザーメッセージから実際の説明部分を抽出
     # 「プロンプトを作成」「プロンプトを生成」などの指示部分を除去
+    # よくある指示パターンを削除
     message_clean = user_message
-
-    # よくある指示パターンを削除（より広範に）
-    instruction_patterns = [
-        r"^画像生成.*?ください。?",  # 行頭から
-        r"プロンプト.*?返してください",
-        r"プロンプト.*?ください",
-        r"日本語.*?返してください",
-        r"日本語.*?ください",
-        r"１行.*?ください",
-        r"1行.*?ください",
-    ]
-
-    for pattern in instruction_patterns:
-        message_clean = re.sub(pattern, "", message_clean)
+    if _INSTRUCTION_SUFFIX in message_clean:
+        for pattern in _INSTRUCTION_RES:
+            message_clean = pattern.sub("", message_clean)
 
     # さらにクリーンアップ
-    message_clean = message_clean.strip().lstrip("。、")
-    message_clean = re.sub(r"^(\.)*", "", message_clean)
-    message_clean = message_clean.strip()
+    # 末尾は最初の strip で整うので、以降は先頭だけを削る
+    message_clean = message_clean.strip().lstrip("。、").lstrip(".").lstrip()
 
     if not message_clean:
         message_clean = user_message
@@ -220,13 +311,11 @@ def process_prompt_generation_request(user_message: str, llm_response: str = "")
         cleaned = llm_response.strip()
 
         # 言語混合検出
-        english_words = len(re.findall(r"\b[a-zA-Z]+\b", cleaned))
-        english_chars = len(re.findall(r"[a-zA-Z]", cleaned))
-        japanese_chars = len(re.findall(r"[\u3040-\u309f\u30a0-\u30ff\u4e00-\u9fff]", cleaned))
+        english_words, english_chars, japanese_chars = _lang_stats(cleaned, max_english_words=2)
 
         # 言語混合が2個以上の英単語があった場合はフォールバック
         if english_words >= 2:
-            logger.warning(f"言語混合検出（英単語 {english_words}個）: フォールバック")
+            logger.warning(f"言語混合検出（英単語 {english_words}個以上）: フォールバック")
             generated = PromptImprovementEngine.generate_prompt(message_clean)
             return generated
 
@@ -239,8 +328,7 @@ def process_prompt_generation_request(user_message: str, llm_response: str = "")
         # 日本語のみで、適切な長さの場合は採用
         if japanese_chars > 5 and len(cleaned) > 5 and len(cleaned) < 300:
             # 説明的な内容が含まれていないか確認
-            bad_markers = ["注意", "備考", "ただし", "ですが", "説明", "理由", "です", "ます", "ました"]
-            has_explanation = any(marker in cleaned for marker in bad_markers)
+            has_explanation = _GENERATION_EXPLANATION_RE.search(cleaned) is not None
 
             if not has_explanation:
                 logger.info(f"LLM応答を採用: {cleaned[:50]}")
@@ -253,6 +341,11 @@ def process_prompt_generation_request(user_message: str, llm_response: str = "")
     return generated
 
 
+# 入力は文字列のみで結果は入力だけで決まるため、そのままメモ化できる
+_cached_prompt_improvement = functools.lru_cache(maxsize=_RESULT_CACHE_SIZE)(_process_prompt_improvement)
+_cached_prompt_generation = functools.lru_cache(maxsize=_RESULT_CACHE_SIZE)(_process_prompt_generation)
+
+
 if __name__ == "__main__":
     # テスト
     test_message = """あなたはプロのAIデザイナーです。
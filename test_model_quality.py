@@ -14,6 +14,17 @@ from chat_service import ChatService  # noqa: E402
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# テスト用プロンプト（繰り返し計測しても同じ文字列オブジェクトを使う）
+_PROMPT_IMPROVE = """あなたはプロのAIデザイナーです。
+次のプロンプトを改善してください。
+レスポンスは、日本語でプロンプトのみをテキストで返してください。見出しも不要。
+改善したいプロンプト：日本のダンススタジオ、大きな鏡、木製フロア、バー、明るい照明、エネルギッシュ、プロフェッショナル、高品質、8k、広々とした空間
+問題：鏡の中がおかしい。変な手・足"""
+
+_PROMPT_MOCK = """あなたはプロのAIデザイナーです。
+次のプロンプトを改善してください。
+レスポンスは、プロンプトのみを返してください。"""
+
 
 def test_with_openvino():
     """OpenVINO変換モデルでテスト"""
@@ -23,13 +34,7 @@ def test_with_openvino():
 
     service = ChatService(model_name="Qwen/Qwen2.5-1.5B-Instruct", use_mock=False)
 
-    test_prompt = """あなたはプロのAIデザイナーです。
-次のプロンプトを改善してください。
-レスポンスは、日本語でプロンプトのみをテキストで返してください。見出しも不要。
-改善したいプロンプト：日本のダンススタジオ、大きな鏡、木製フロア、バー、明るい照明、エネルギッシュ、プロフェッショナル、高品質、8k、広々とした空間
-問題：鏡の中がおかしい。変な手・足"""
-
-    result = service.chat(test_prompt, task_type="image_prompt_improvement")
+    result = service.chat(_PROMPT_IMPROVE, task_type="image_prompt_improvement")
     logger.info(f"応答: {result['response']}")
     return result["response"]
 
@@ -42,11 +47,7 @@ def test_with_mock():
 
     service = ChatService(use_mock=True)
 
-    test_prompt = """あなたはプロのAIデザイナーです。
-次のプロンプトを改善してください。
-レスポンスは、プロンプトのみを返してください。"""
-
-    result = service.chat(test_prompt, task_type="image_prompt_improvement")
+    result = service.chat(_PROMPT_MOCK, task_type="image_prompt_improvement")
     logger.info(f"応答: {result['response']}")
     return result["response"]
 
@@ -0,0 +1,23 @@
+"""
+テスト共通のフィクスチャ
+"""
+
+from unittest.mock import patch
+
+import pytest
+from starlette.testclient import TestClient
+
+from chat_service import ChatService
+from main import app
+
+
+@pytest.fixture(scope="session")
+def client():
+    """
+    テストクライアントのフィクスチャ（起動・終了処理はセッションで1回だけ実行する）
+
+    チャットサービスはモデルをロードしないモックモードで起動し、チャットAPIの実際の応答を検証できるようにする
+    """
+    with patch("main._create_chat_service", lambda: ChatService(use_mock=True)):
+        with TestClient(app) as test_client:
+            yield test_client
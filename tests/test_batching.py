@@ -0,0 +1,64 @@
+"""
+batching モジュールのユニットテスト
+"""
+
+from concurrent.futures import CancelledError
+import threading
+
+import pytest
+
+from batching import QueueBatcher
+
+
+class EchoBatcher(QueueBatcher):
+    """要求をそのまま結果として返すバッチ処理（gate が設定されるまで処理を止める）"""
+
+    name = "echo-batcher"
+
+    def __init__(self, max_wait_ms: float = 0.0):
+        self.gate = threading.Event()
+        self.gate.set()
+        self.batches = []
+        super().__init__(max_batch=1, max_wait_ms=max_wait_ms)
+
+    def submit(self, request):
+        return self._enqueue(request)
+
+    def _process(self, items):
+        self.gate.wait(timeout=5)
+        self.batches.append([request for request, _ in items])
+        for request, future in items:
+            if request == "fail":
+                raise RuntimeError("process failed")
+            future.set_result(request)
+
+
+def test_cancelled_request_does_not_stop_batcher():
+    """キャンセルされた要求があっても後続の要求が処理されるかのテスト"""
+    batcher = EchoBatcher()
+    try:
+        batcher.gate.clear()
+        first = batcher.submit("first")
+        cancelled = batcher.submit("cancelled")
+        assert cancelled.cancel()
+        batcher.gate.set()
+
+        assert first.result(timeout=2) == "first"
+        assert batcher.submit("after").result(timeout=2) == "after"
+        with pytest.raises(CancelledError):
+            cancelled.result(timeout=0)
+        assert ["cancelled"] not in batcher.batches
+    finally:
+        batcher.close()
+
+
+def test_process_error_fails_pending_requests():
+    """処理中の例外は未完了の要求に設定され、スレッドは処理を続けるかのテスト"""
+    batcher = EchoBatcher()
+    try:
+        with pytest.raises(RuntimeError, match="process failed"):
+            batcher.submit("fail").result(timeout=2)
+        assert batcher.submit("after").result(timeout=2) == "after"
+        assert batcher._thread.is_alive()
+    finally:
+        batcher.close()
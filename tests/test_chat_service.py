@@ -2,37 +2,24 @@
 チャットサービスのテスト
 """
 
-from unittest.mock import patch, MagicMock
-from chat_service import ChatService
-
-
-class TestChatService:
-    """ChatServiceクラスのテスト"""
-
-    @patch("chat_service.OVModelForCausalLM")
-    @patch("chat_service.AutoTokenizer")
-    def test_chat_service_initialization(self, mock_tokenizer, mock_model):
-        """チャットサービスの初期化テスト"""
-
-        # モックの設定
-        mock_model.from_pretrained = MagicMock()
-        mock_tokenizer.from_pretrained = MagicMock()
-        mock_tokenizer_instance = MagicMock()
-        mock_tokenizer_instance.pad_token = None
-        mock_tokenizer_instance.eos_token = "<eos>"
-        mock_tokenizer.from_pretrained.return_value = mock_tokenizer_instance
+import threading
+import time
+from datetime import datetime
 
-        service = ChatService()
+import pytest
+import torch
+from unittest.mock import patch, MagicMock
+from chat_service import ChatService, _Session, _TokenizeBatcher
 
-        assert service.model_name == "Qwen/Qwen2.5-7B-Instruct"  # 7Bモデル
-        assert service.sessions == {}
+# セッションの作成日時（表示用のエポック秒）は固定値を使う
+# 期限切れ判定に使う last_access_mono は実時間に合わせる必要があるため time.monotonic() のまま
+_FIXED_CREATED_AT = datetime(2024, 1, 1).timestamp()
 
-    @patch("chat_service.OVModelForCausalLM")
-    @patch("chat_service.AutoTokenizer")
-    def test_chat_creates_new_session(self, mock_tokenizer, mock_model):
-        """新規セッションの作成テスト"""
 
-        # モックの設定
+@pytest.fixture
+def patched_service():
+    """モデルとトークナイザーをモックに差し替えたチャットサービス（状態を変更するためテストごとに作る）"""
+    with patch("chat_service.OVModelForCausalLM") as mock_model, patch("chat_service.AutoTokenizer") as mock_tokenizer:
         mock_model_instance = MagicMock()
         mock_model_instance.generate = MagicMock(return_value=[[1, 2, 3, 4, 5]])  # ダミートークン
         mock_model.from_pretrained = MagicMock(return_value=mock_model_instance)
@@ -42,12 +29,45 @@ class TestChatService:
         mock_tokenizer_instance.eos_token = "<eos>"
         mock_tokenizer_instance.eos_token_id = 1
         mock_tokenizer_instance.return_value = {"input_ids": MagicMock(shape=(1, 3))}
-        mock_tokenizer_instance.decode = MagicMock(return_value="こんにちは！")
         mock_tokenizer.from_pretrained = MagicMock(return_value=mock_tokenizer_instance)
 
         service = ChatService()
         service.tokenizer = mock_tokenizer_instance
         service.model = mock_model_instance
+        yield service
+        service.close()
+
+
+@pytest.fixture
+def mock_service():
+    """モックモードのチャットサービス（状態を変更するためテストごとに作る）"""
+    service = ChatService(use_mock=True)
+    yield service
+    service.close()
+
+
+@pytest.fixture(scope="class")
+def shared_mock_service():
+    """状態を変更しないテストで共有するモックモードのチャットサービス"""
+    service = ChatService(use_mock=True)
+    yield service
+    service.close()
+
+
+class TestChatService:
+    """ChatServiceクラスのテスト"""
+
+    def test_chat_service_initialization(self, patched_service):
+        """チャットサービスの初期化テスト"""
+        service = patched_service
+
+        assert service.model_name == "Qwen/Qwen2.5-7B-Instruct"  # 7Bモデル
+        assert service.sessions == {}
+
+    def test_chat_creates_new_session(self, patched_service):
+        """新規セッションの作成テスト"""
+        service = patched_service
+        service.tokenizer.decode = MagicMock(return_value="こんにちは！")
 
         result = service.chat("こんにちは")
 
@@ -56,27 +76,10 @@ class TestChatService:
         assert "timestamp" in result
         assert result["session_id"] in service.sessions
 
-    @patch("chat_service.OVModelForCausalLM")
-    @patch("chat_service.AutoTokenizer")
-    def test_chat_reuses_existing_session(self, mock_tokenizer, mock_model):
+    def test_chat_reuses_existing_session(self, patched_service):
         """既存セッションの再利用テスト"""
-
-        # モックの設定
-        mock_model_instance = MagicMock()
-        mock_model_instance.generate = MagicMock(return_value=[[1, 2, 3, 4, 5]])  # ダミートークン
-        mock_model.from_pretrained = MagicMock(return_value=mock_model_instance)
-
-        mock_tokenizer_instance = MagicMock()
-        mock_tokenizer_instance.pad_token = None
-        mock_tokenizer_instance.eos_token = "<eos>"
-        mock_tokenizer_instance.eos_token_id = 1
-        mock_tokenizer_instance.return_value = {"input_ids": MagicMock(shape=(1, 3))}
-        mock_tokenizer_instance.decode = MagicMock(return_value="応答です")
-        mock_tokenizer.from_pretrained = MagicMock(return_value=mock_tokenizer_instance)
-
-        service = ChatService()
-        service.tokenizer = mock_tokenizer_instance
-        service.model = mock_model_instance
+        service = patched_service
+        service.tokenizer.decode = MagicMock(return_value="応答です")
 
         # 最初のメッセージ
         result1 = service.chat("こんにちは")
@@ -86,39 +89,27 @@ class TestChatService:
         result2 = service.chat("元気ですか？", session_id=session_id)
 
         assert result2["session_id"] == session_id
-        assert len(service.sessions[session_id]["messages"]) == 4  # 2往復
+        assert len(service.sessions[session_id].messages) == 4  # 2往復
 
-    @patch("chat_service.OVModelForCausalLM")
-    @patch("chat_service.AutoTokenizer")
-    def test_get_history(self, mock_tokenizer, mock_model):
+    def test_get_history(self, patched_service):
         """履歴取得のテスト"""
-
-        # モックの設定
-        mock_model_instance = MagicMock()
-        mock_tokenizer_instance = MagicMock()
-        mock_tokenizer_instance.pad_token = None
-        mock_tokenizer_instance.eos_token = "<eos>"
-        mock_model.from_pretrained = MagicMock(return_value=mock_model_instance)
-        mock_tokenizer.from_pretrained = MagicMock(return_value=mock_tokenizer_instance)
-
-        service = ChatService()
+        service = patched_service
 
         # テスト用セッションを手動で作成
-        from datetime import datetime
-
         test_session_id = "test-session-123"
-        service.sessions[test_session_id] = {
-            "messages": [
-                {"role": "user", "content": "こんにちは", "timestamp": "2024-01-01"},
+        service.sessions[test_session_id] = _Session(
+            messages=[
+                {"role": "user", "content": "こんにちは", "timestamp": 1704067200.0},
                 {
                     "role": "assistant",
                     "content": "こんにちは！",
-                    "timestamp": "2024-01-01",
+                    "timestamp": 1704067200.0,
                 },
             ],
-            "system_prompt": "あなたは親切なアシスタントです",
-            "created_at": datetime.now(),
-        }
+            system_prompt="あなたは親切なアシスタントです",
+            created_at_ts=_FIXED_CREATED_AT,
+            last_access_mono=time.monotonic(),
+        )
 
         result = service.get_history(test_session_id)
 
@@ -126,92 +117,58 @@ class TestChatService:
         assert len(result["messages"]) == 2
         assert "system_prompt" in result
 
-    @patch("chat_service.OVModelForCausalLM")
-    @patch("chat_service.AutoTokenizer")
-    def test_get_history_not_found(self, mock_tokenizer, mock_model):
+    def test_get_history_not_found(self, patched_service):
         """存在しないセッションの履歴取得テスト"""
-
-        # モックの設定
-        mock_model_instance = MagicMock()
-        mock_tokenizer_instance = MagicMock()
-        mock_tokenizer_instance.pad_token = None
-        mock_tokenizer_instance.eos_token = "<eos>"
-        mock_model.from_pretrained = MagicMock(return_value=mock_model_instance)
-        mock_tokenizer.from_pretrained = MagicMock(return_value=mock_tokenizer_instance)
-
-        service = ChatService()
+        service = patched_service
         result = service.get_history("non-existent-session")
 
         assert "error" in result
         assert result["error"] == "Session not found"
 
-    @patch("chat_service.OVModelForCausalLM")
-    @patch("chat_service.AutoTokenizer")
-    def test_delete_history(self, mock_tokenizer, mock_model):
+    def test_delete_history(self, patched_service):
         """履歴削除のテスト"""
-
-        # モックの設定
-        mock_model_instance = MagicMock()
-        mock_tokenizer_instance = MagicMock()
-        mock_tokenizer_instance.pad_token = None
-        mock_tokenizer_instance.eos_token = "<eos>"
-        mock_model.from_pretrained = MagicMock(return_value=mock_model_instance)
-        mock_tokenizer.from_pretrained = MagicMock(return_value=mock_tokenizer_instance)
-
-        service = ChatService()
+        service = patched_service
 
         # テスト用セッションを作成
-        from datetime import datetime
-
         test_session_id = "test-session-123"
-        service.sessions[test_session_id] = {
-            "messages": [],
-            "system_prompt": "test",
-            "created_at": datetime.now(),
-        }
+        service.sessions[test_session_id] = _Session(
+            messages=[],
+            system_prompt="test",
+            created_at_ts=_FIXED_CREATED_AT,
+            last_access_mono=time.monotonic(),
+        )
 
         result = service.delete_history(test_session_id)
 
         assert result["success"] is True
         assert test_session_id not in service.sessions
 
-    @patch("chat_service.OVModelForCausalLM")
-    @patch("chat_service.AutoTokenizer")
-    def test_list_sessions(self, mock_tokenizer, mock_model):
+    def test_list_sessions(self, patched_service):
         """セッション一覧のテスト"""
-
-        # モックの設定
-        mock_model_instance = MagicMock()
-        mock_tokenizer_instance = MagicMock()
-        mock_tokenizer_instance.pad_token = None
-        mock_tokenizer_instance.eos_token = "<eos>"
-        mock_model.from_pretrained = MagicMock(return_value=mock_model_instance)
-        mock_tokenizer.from_pretrained = MagicMock(return_value=mock_tokenizer_instance)
-
-        service = ChatService()
+        service = patched_service
 
         # テスト用セッションを作成
-        from datetime import datetime
-
-        service.sessions["session1"] = {
-            "messages": [{"role": "user", "content": "test"}],
-            "system_prompt": "test",
-            "created_at": datetime.now(),
-        }
-        service.sessions["session2"] = {
-            "messages": [],
-            "system_prompt": "test",
-            "created_at": datetime.now(),
-        }
+        service.sessions["session1"] = _Session(
+            messages=[{"role": "user", "content": "test"}],
+            system_prompt="test",
+            created_at_ts=_FIXED_CREATED_AT,
+            last_access_mono=time.monotonic(),
+        )
+        service.sessions["session2"] = _Session(
+            messages=[],
+            system_prompt="test",
+            created_at_ts=_FIXED_CREATED_AT,
+            last_access_mono=time.monotonic(),
+        )
 
         result = service.list_sessions()
 
         assert result["total"] == 2
         assert len(result["sessions"]) == 2
 
-    def test_task_type_detection(self):
+    def test_task_type_detection(self, shared_mock_service):
         """タスクタイプ検出のテスト"""
-        service = ChatService(use_mock=True)
+        service = shared_mock_service
 
         # 画像プロンプト改善のテスト
         assert service._detect_task_type("プロンプトを改善してください") == "image_prompt_improvement"
@@ -222,12 +179,407 @@ class TestChatService:
         assert service._detect_task_type("こんにちは") == "general"
         assert service._detect_task_type("天気はどうですか？") == "general"
 
-    def test_system_prompt_for_image_improvement(self):
+    def test_system_prompt_for_image_improvement(self, shared_mock_service):
         """画像プロンプト改善用のシステムプロンプトテスト"""
-        service = ChatService(use_mock=True)
+        service = shared_mock_service
 
         prompt = service._get_system_prompt_for_task("image_prompt_improvement", None)
 
         # 画像プロンプト改善タスク用の指示が含まれていることを確認
         assert "プロンプト専門家" in prompt or "専門家" in prompt
         assert "改善" in prompt or "Improve" in prompt
+
+    def test_quantized_model_path(self):
+        """量子化形式ごとのモデル保存先のテスト"""
+        service = ChatService(use_mock=True, quantization="int4")
+        assert service._get_model_path("Qwen/Qwen2.5-1.5B-Instruct").name == "Qwen_Qwen2.5-1.5B-Instruct_int4"
+
+        service = ChatService(use_mock=True, quantization="fp16")
+        assert service._get_model_path("Qwen/Qwen2.5-1.5B-Instruct").name == "Qwen_Qwen2.5-1.5B-Instruct"
+
+    def test_invalid_quantization(self):
+        """不正な量子化形式のテスト"""
+        with pytest.raises(ValueError):
+            ChatService(use_mock=True, quantization="int3")
+
+    def test_reusable_kv_cache(self):
+        """KVキャッシュ再利用判定のテスト"""
+        import torch
+
+        service = ChatService(use_mock=True, reuse_kv_cache=True)
+        session = _Session(messages=[], system_prompt="test")
+        session.kv = "cached-kv"
+        session.kv_input_ids = torch.tensor([1, 2, 3])
+
+        # 先頭が一致する場合は再利用
+        assert service._get_reusable_kv_cache(session, torch.tensor([[1, 2, 3, 4]])) == "cached-kv"
+
+        # 先頭が一致しない場合は破棄
+        assert service._get_reusable_kv_cache(session, torch.tensor([[1, 9, 3, 4]])) is None
+        assert session.kv is None
+
+    def test_mock_response_keywords(self, shared_mock_service):
+        """モック応答のキーワード判定テスト"""
+        service = shared_mock_service
+
+        # 複数のキーワードを含む場合は優先度の高い応答
+        assert service._generate_mock_response("<|user|>\nありがとう、hello</s>").startswith("こんにちは")
+        assert "「what?」" in service._generate_mock_response("<|user|>\nWhat?</s>")
+        assert "モックモード" in service._generate_mock_response("<|user|>\n猫</s>")
+
+    def test_incremental_prompt_matches_full_format(self, mock_service):
+        """キャッシュから追記したプロンプトが全体のフォーマットと一致するかのテスト"""
+        model_name = "Qwen/Qwen2.5-0.5B-Instruct"
+        service = mock_service
+
+        result = service.chat("こんにちは", model_name=model_name)
+        service.chat("元気ですか？", session_id=result["session_id"], model_name=model_name)
+
+        session = service.sessions[result["session_id"]]
+        service._add_user_message(session, "ありがとう")
+
+        expected = service._format_prompt(session.messages, session.system_prompt, model_name=model_name)
+        assert session.prompt_cache is not None
+        assert service._build_prompt(session, model_name) == expected
+
+    def test_cleanup_expired_sessions(self):
+        """タイムアウトしたセッションのクリーンアップテスト"""
+        service = ChatService(use_mock=True, session_timeout_minutes=1)
+        service.sessions["expired"] = _Session(
+            messages=[],
+            system_prompt="test",
+            created_at_ts=_FIXED_CREATED_AT,
+            last_access_mono=time.monotonic() - 120,
+        )
+        service.sessions["active"] = _Session(
+            messages=[],
+            system_prompt="test",
+            created_at_ts=_FIXED_CREATED_AT,
+            last_access_mono=time.monotonic(),
+        )
+
+        service._cleanup_old_sessions()
+
+        assert list(service.sessions) == ["active"]
+
+    def test_session_limit_evicts_least_recently_used(self):
+        """セッション数上限時に最も使われていないセッションが削除されるかのテスト"""
+        service = ChatService(use_mock=True, max_sessions=2)
+
+        first = service.chat("こんにちは")["session_id"]
+        second = service.chat("こんにちは")["session_id"]
+        service.get_history(first)  # firstを最近使用したセッションにする
+        third = service.chat("こんにちは")["session_id"]
+        service._cleanup_old_sessions()
+
+        assert list(service.sessions) == [first, third]
+        assert second not in service.sessions
+
+    @pytest.mark.asyncio
+    async def test_achat_matches_chat(self, mock_service):
+        """非同期チャットが同期版と同じ形式の応答を返すことを確認"""
+        service = mock_service
+
+        result = await service.achat("こんにちは")
+
+        assert "error" not in result
+        assert result["response"]
+        assert len(service.sessions[result["session_id"]].messages) == 2
+
+    @patch("chat_service.OVModelForCausalLM")
+    @patch("chat_service.AutoTokenizer")
+    def test_model_shared_between_instances(self, mock_tokenizer, mock_model):
+        """同じモデルを使うインスタンス間でロード済みモデルを共有するかのテスト"""
+        mock_tokenizer.from_pretrained.return_value.pad_token = "<pad>"
+
+        first = ChatService(model_name="test/shared-model")
+        second = ChatService(model_name="test/shared-model")
+
+        assert second.models["test/shared-model"] is first.models["test/shared-model"]
+        assert mock_model.from_pretrained.call_count == 1
+
+    @patch("chat_service.OVModelForCausalLM")
+    @patch("chat_service.AutoTokenizer")
+    def test_least_recently_used_model_unloaded(self, mock_tokenizer, mock_model):
+        """保持数の上限を超えると最も長く使われていないモデルを解放するかのテスト"""
+        mock_tokenizer.from_pretrained.return_value.pad_token = "<pad>"
+
+        service = ChatService(model_name="test/lru-a", model_capacity=2, batch_generation=True)
+        service._acquire_model("test/lru-b")
+        service._acquire_model("test/lru-a")
+        batcher = service.generation_batchers["test/lru-b"]
+        service._acquire_model("test/lru-c")
+
+        assert list(service.models) == ["test/lru-a", "test/lru-c"]
+        assert "test/lru-b" not in service.tokenizers
+        assert "test/lru-b" not in service.generation_batchers
+        batcher._thread.join(timeout=1)
+        assert not batcher._thread.is_alive()
+
+    @patch("chat_service.OVModelForCausalLM")
+    @patch("chat_service.AutoTokenizer")
+    def test_acquire_returns_model_evicted_by_other_load(self, mock_tokenizer, mock_model):
+        """ロード直後に他のモデルのロードで登録解除されても、ロードしたモデルを返すかのテスト"""
+        mock_tokenizer.from_pretrained.return_value.pad_token = "<pad>"
+        service = ChatService(model_name="test/evict-a", model_capacity=1)
+        load_model_unlocked = service._load_model_unlocked
+
+        def load_then_evict(model_name):
+            # 別スレッドが直後に別のモデルをロードした状況を再現する
+            loaded = load_model_unlocked(model_name)
+            if model_name == "test/evict-b":
+                load_model_unlocked("test/evict-c")
+            return loaded
+
+        with patch.object(service, "_load_model_unlocked", side_effect=load_then_evict) as mock_load:
+            loaded = service._acquire_model("test/evict-b")
+
+        assert loaded is not None
+        assert list(service.models) == ["test/evict-c"]
+        assert mock_load.call_count == 1
+
+    @patch("chat_service.OVModelForCausalLM")
+    @patch("chat_service.AutoTokenizer")
+    def test_tokenizer_shared_within_family(self, mock_tokenizer, mock_model):
+        """同じファミリーのモデル間でトークナイザーを共有するかのテスト"""
+        mock_tokenizer.from_pretrained.side_effect = lambda *args, **kwargs: MagicMock(pad_token="<pad>")
+
+        service = ChatService(model_name="Qwen/Qwen2.5-0.5B-Instruct", model_capacity=3)
+        service._acquire_model("Qwen/Qwen2.5-1.5B-Instruct")
+        service._acquire_model("test/other-model")
+
+        assert service.tokenizers["Qwen/Qwen2.5-0.5B-Instruct"] is service.tokenizers["Qwen/Qwen2.5-1.5B-Instruct"]
+        assert service.tokenizers["test/other-model"] is not service.tokenizers["Qwen/Qwen2.5-0.5B-Instruct"]
+        assert mock_tokenizer.from_pretrained.call_count == 2
+
+    def test_prefix_tokens_tokenized_outside_sessions_lock(self):
+        """応答後のトークナイズを全セッション共通のロックの外で行い、更新済みのキャッシュは上書きしないかのテスト"""
+        model_name = "Qwen/Qwen2.5-0.5B-Instruct"
+        service = ChatService(use_mock=True, model_name=model_name)
+        lock_held = []
+
+        def char_tokenizer(text, add_special_tokens=True):
+            lock_held.append(service.sessions_lock.locked())
+            return {"input_ids": [ord(c) for c in text]}
+
+        service.tokenizers[model_name] = char_tokenizer
+
+        result = service.chat("こんにちは")
+        session = service.sessions[result["session_id"]]
+        assert lock_held and not any(lock_held)
+
+        # トークナイズ中に別のターンでキャッシュが更新された場合は古いトークン列を保存しない
+        stale = service._extend_prefix_tokens(model_name, "古いキャッシュ", None, None)
+        service._store_prefix_tokens(session, stale)
+        assert session.prefix_tokens[1] is session.prompt_cache
+
+    def test_prefix_tokens_reused_between_turns(self):
+        """前ターンまでのトークン列を再利用して追記部分のみトークナイズするかのテスト"""
+
+        def char_tokenizer(text, add_special_tokens=True):
+            return {"input_ids": [ord(c) for c in text]}
+
+        model_name = "Qwen/Qwen2.5-0.5B-Instruct"
+        service = ChatService(use_mock=True, model_name=model_name)
+        service.tokenizers[model_name] = char_tokenizer
+
+        result = service.chat("こんにちは")
+        session = service.sessions[result["session_id"]]
+        assert session.prefix_tokens[2] == char_tokenizer(session.prompt_cache)["input_ids"]
+
+        service._add_user_message(session, "ありがとう")
+        prompt = service._build_prompt(session, model_name)
+        inputs = service._tokenize_with_prefix(session, prompt, model_name, char_tokenizer, max_length=2048)
+
+        assert inputs["input_ids"][0].tolist() == char_tokenizer(prompt)["input_ids"]
+        assert service._tokenize_with_prefix(session, prompt, model_name, char_tokenizer, max_length=10) is None
+
+    def test_post_process_replaces_romaji(self, shared_mock_service):
+        """画像プロンプトの英語表記が長い表記を優先して日本語に置換されるかのテスト"""
+        service = shared_mock_service
+
+        result = service._post_process_response("明るいSTUDIOとBARREのあるFLOOR", "image_prompt_generation")
+
+        assert result == "明るいスタジオとバーのある床。"
+
+    def test_history_window_drops_oldest_messages(self):
+        """履歴が上限を超えると古いメッセージから破棄されるかのテスト"""
+        service = ChatService(use_mock=True, max_history_messages=2)
+
+        session_id = service.chat("1")["session_id"]
+        for message in ("2", "3"):
+            service.chat(message, session_id=session_id)
+
+        messages = service.sessions[session_id].messages
+        assert len(messages) == 4
+        assert [m["content"] for m in messages if m["role"] == "user"] == ["2", "3"]
+        assert isinstance(service.get_history(session_id)["messages"][0]["timestamp"], str)
+
+    def test_close_stops_cleanup_thread(self, mock_service):
+        """close() でバックグラウンドのクリーンアップスレッドが停止するかのテスト"""
+        service = mock_service
+        assert service._cleanup_thread.is_alive()
+
+        service.close()
+        service._cleanup_thread.join(timeout=5)
+
+        assert not service._cleanup_thread.is_alive()
+
+    def test_chat_stream_yields_deltas_then_final(self, mock_service):
+        """ストリーミングでテキスト片の後に最終応答が返り、履歴に保存されるかのテスト"""
+        service = mock_service
+
+        events = list(service.chat_stream("こんにちは"))
+
+        assert events[-1]["done"] is True
+        assert "".join(e["delta"] for e in events[:-1]) == events[-1]["response"]
+        assert len(service.sessions[events[-1]["session_id"]].messages) == 2
+
+    def test_chat_stream_closed_midway_discards_user_message(self, mock_service):
+        """応答の途中でストリームを閉じた場合に、応答のないユーザーメッセージを履歴に残さないかのテスト"""
+        service = mock_service
+
+        events = service.chat_stream("こんにちは")
+        session_id = next(events)["session_id"]
+        events.close()
+
+        assert len(service.sessions[session_id].messages) == 0
+
+    def test_stream_response_stops_generation_after_delimiter(self, mock_service):
+        """区切りが現れた時点で生成を止め、max_new_tokens まで生成を続けないかのテスト"""
+        service = mock_service
+        service.use_mock = False
+        steps = []
+
+        def generate(streamer, stopping_criteria, **kwargs):
+            for i in range(1000):
+                if stopping_criteria(torch.zeros((1, 1), dtype=torch.long), None).all():
+                    break
+                steps.append(i)
+                streamer.on_finalized_text("回答です" if i == 0 else "\n質問: 続き")
+                time.sleep(0.001)
+            streamer.end()
+
+        loaded = MagicMock(model=MagicMock(generate=generate))
+        with patch.object(service, "_acquire_model", return_value=loaded), patch.object(
+            service, "_tokenize_prompt", return_value={}
+        ), patch.object(service, "_get_generate_kwargs", return_value={}):
+            stream = service._stream_response("prompt", "test/model", "session")
+            deltas = []
+            try:
+                while True:
+                    deltas.append(next(stream)["delta"])
+            except StopIteration as stop:
+                response_text = stop.value
+
+        assert "".join(deltas) == "回答です"
+        assert response_text == "回答です"
+        assert len(steps) < 1000
+
+    def test_tokenize_falls_back_when_batcher_closed(self, mock_service):
+        """モデルの解放で閉じられたバッチ処理の代わりに単独でトークナイズするかのテスト"""
+        service = mock_service
+        tokenizer = MagicMock(return_value={"input_ids": torch.tensor([[5, 6, 7]])})
+        batcher = _TokenizeBatcher(tokenizer)
+        batcher.close()
+        service.tokenize_batchers["test/model"] = batcher
+
+        inputs = service._tokenize_prompt(None, "prompt", "test/model", tokenizer)
+
+        assert inputs["input_ids"].tolist() == [[5, 6, 7]]
+        assert inputs["attention_mask"].tolist() == [[1, 1, 1]]
+
+    def test_batched_request_times_out(self, mock_service):
+        """バッチ処理の結果が batch_timeout 秒以内に返らない場合にタイムアウトするかのテスト"""
+        service = mock_service
+        service.batch_timeout = 0.05
+        release = threading.Event()
+
+        def tokenizer(prompts, **kwargs):
+            release.wait(5)
+            raise RuntimeError("released")
+
+        batcher = _TokenizeBatcher(tokenizer)
+        try:
+            with pytest.raises(TimeoutError, match="tokenize-batcher"):
+                service._run_batched(batcher, "prompt")
+        finally:
+            release.set()
+            batcher.close()
+
+    def test_generate_kwargs_greedy_for_prompt_tasks(self, shared_mock_service):
+        """画像プロンプト系タスクではサンプリングせず貪欲法で生成するかのテスト"""
+        service = shared_mock_service
+        tokenizer = MagicMock(pad_token_id=0, eos_token_id=1)
+
+        greedy = service._get_generate_kwargs("Qwen/Qwen2.5-0.5B-Instruct", tokenizer, "image_prompt_generation")
+        sampling = service._get_generate_kwargs("Qwen/Qwen2.5-0.5B-Instruct", tokenizer, "general")
+
+        assert greedy["do_sample"] is False
+        assert greedy["num_beams"] == 1
+        assert "temperature" not in greedy and "top_p" not in greedy and "top_k" not in greedy
+        assert sampling["do_sample"] is True
+        assert sampling["temperature"] == 0.7
+
+
+def test_tokenize_batcher_splits_rows():
+    """バッチトークナイズ結果が行ごとにパディングなしで返されるかのテスト"""
+    import torch
+    from chat_service import _TokenizeBatcher
+
+    calls = []
+
+    def fake_tokenizer(prompts, **kwargs):
+        calls.append(list(prompts))
+        max_len = max(len(p) for p in prompts)
+        ids = [[ord(c) for c in p] + [0] * (max_len - len(p)) for p in prompts]
+        mask = [[1] * len(p) + [0] * (max_len - len(p)) for p in prompts]
+        return {"input_ids": torch.tensor(ids), "attention_mask": torch.tensor(mask)}
+
+    batcher = _TokenizeBatcher(fake_tokenizer, max_wait_ms=50)
+    future1 = batcher.submit("ab")
+    future2 = batcher.submit("abcd")
+
+    assert future1.result(timeout=5)["input_ids"].tolist() == [[97, 98]]
+    assert future2.result(timeout=5)["input_ids"].tolist() == [[97, 98, 99, 100]]
+    assert calls == [["ab", "abcd"]]
+
+
+def test_incremental_no_repeat_ngram_matches_transformers():
+    """差分更新のN-gram禁止処理がtransformers標準と同じトークンを禁止するかのテスト"""
+    import torch
+    from transformers import NoRepeatNGramLogitsProcessor
+    from chat_service import _IncrementalNoRepeatNGramLogitsProcessor
+
+    processor = _IncrementalNoRepeatNGramLogitsProcessor(3)
+    sequence = torch.tensor([[1, 2, 3, 1, 2], [4, 4, 4, 5, 4]])
+
+    # 1トークンずつ伸ばしながら各ステップの結果を比較
+    for length in range(3, sequence.shape[1] + 1):
+        input_ids = sequence[:, :length]
+        expected = NoRepeatNGramLogitsProcessor(3)(input_ids, torch.zeros(2, 8))
+        actual = processor(input_ids, torch.zeros(2, 8))
+        assert torch.equal(actual, expected)
+
+
+def test_generation_batcher_left_pads_rows():
+    """バッチ生成で左パディングした入力が渡され、行ごとの生成トークンが返るかのテスト"""
+    import torch
+    from chat_service import _GenerationBatcher
+
+    received = {}
+
+    def fake_generate(inputs):
+        received.update(inputs)
+        # 入力の末尾に行番号のトークンを1つ追加したものを生成結果とする
+        rows = torch.arange(inputs["input_ids"].shape[0]).unsqueeze(1)
+        return torch.cat([inputs["input_ids"], rows], dim=1)
+
+    batcher = _GenerationBatcher(fake_generate, pad_token_id=0, max_wait_ms=200)
+    first = batcher.submit(torch.tensor([5, 6, 7]))
+    second = batcher.submit(torch.tensor([8]))
+
+    assert first.result(timeout=5).tolist() == [0]
+    assert second.result(timeout=5).tolist() == [1]
+    assert received["input_ids"].tolist() == [[5, 6, 7], [0, 0, 8]]
+    assert received["attention_mask"].tolist() == [[1, 1, 1], [0, 0, 1]]
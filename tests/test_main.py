@@ -2,17 +2,14 @@
 FastAPI エンドポイントのテスト
 """
 
+import json
+
 import pytest
-from starlette.testclient import TestClient
+from chat_service import ChatService
+import main
 from main import app
 
 
-@pytest.fixture(scope="module")
-def client():
-    """テストクライアントのフィクスチャ"""
-    return TestClient(app)
-
-
 def test_read_root(client):
     """ルートページが正常に表示されるかテスト"""
     response = client.get("/")
@@ -34,6 +31,15 @@ def test_get_languages(client):
     assert "name" in first_lang
 
 
+def test_get_languages_not_modified(client):
+    """ETagが一致する場合にサポート言語一覧APIが304を返すかのテスト"""
+    etag = client.get("/api/languages").headers["etag"]
+
+    response = client.get("/api/languages", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert "max-age" in response.headers["cache-control"]
+
+
 def test_health_check(client):
     """ヘルスチェックAPIのテスト"""
     response = client.get("/api/health")
@@ -43,29 +49,21 @@ def test_health_check(client):
     assert "service" in data
 
 
-def test_translate_missing_text(client):
-    """テキストが空の場合のエラーハンドリングテスト"""
-    response = client.post("/api/translate", json={"text": "", "target_lang": "ja"})
-    # 空のテキストでも422エラーが返る可能性がある
-    assert response.status_code in [400, 422]
-
-
-def test_translate_invalid_language(client):
-    """無効な言語コードのテスト"""
-    response = client.post("/api/translate", json={"text": "Hello", "target_lang": "invalid_lang"})
-    # サービスによっては400か翻訳結果のエラーが返る
-    assert response.status_code in [400, 200]
-
-
-def test_translate_request_structure(client):
-    """翻訳リクエストの構造テスト"""
-    response = client.post(
-        "/api/translate",
-        json={"text": "Test", "target_lang": "ja", "source_lang": "en"},
-    )
-    # モデルが未ロードの場合は失敗する可能性があるため、
-    # ステータスコードのみチェック
-    assert response.status_code in [200, 400, 500]
+@pytest.mark.parametrize(
+    "payload, expected_statuses",
+    [
+        # 空のテキストでも422エラーが返る可能性がある
+        pytest.param({"text": "", "target_lang": "ja"}, [400, 422], id="missing_text"),
+        # サービスによっては400か翻訳結果のエラーが返る
+        pytest.param({"text": "Hello", "target_lang": "invalid_lang"}, [400, 200], id="invalid_language"),
+        # モデルが未ロードの場合は失敗する可能性があるため、ステータスコードのみチェック
+        pytest.param({"text": "Test", "target_lang": "ja", "source_lang": "en"}, [200, 400, 500], id="request_structure"),
+    ],
+)
+def test_translate_status(client, payload, expected_statuses):
+    """翻訳APIのエラーハンドリングとリクエスト構造のテスト"""
+    response = client.post("/api/translate", json=payload)
+    assert response.status_code in expected_statuses
 
 
 def test_api_docs(client):
@@ -92,9 +90,22 @@ def test_chat_endpoint_structure(client):
         "/api/chat",
         json={"message": "Hello"},
     )
-    # モデルが未ロードの場合は失敗する可能性があるため、
-    # ステータスコードのみチェック
-    assert response.status_code in [200, 400, 500]
+    assert response.status_code == 200
+    data = response.json()
+    assert data["response"]
+    assert data["session_id"]
+
+
+def test_chat_unavailable_returns_503(client):
+    """チャットサービスの初期化に失敗した場合に503を返すかのテスト"""
+    original = app.state.chat_service
+    app.state.chat_service = None
+    try:
+        response = client.post("/api/chat", json={"message": "Hello"})
+    finally:
+        app.state.chat_service = original
+
+    assert response.status_code == 503
 
 
 def test_chat_missing_message(client):
@@ -104,36 +115,88 @@ def test_chat_missing_message(client):
     assert response.status_code in [400, 422]
 
 
+def test_chat_stream_sends_events(client):
+    """ストリーミングチャットがSSEで逐次イベントと完了イベントを送るかのテスト"""
+    original = app.state.chat_service
+    app.state.chat_service = ChatService(use_mock=True)
+    try:
+        response = client.post("/api/chat/stream", json={"message": "こんにちは"})
+    finally:
+        app.state.chat_service.close()
+        app.state.chat_service = original
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [json.loads(line[len("data: ") :]) for line in response.text.splitlines() if line.startswith("data: ")]
+    assert events[0]["delta"]
+    assert events[-1]["done"] is True
+    assert events[-1]["session_id"] == events[0]["session_id"]
+
+
+def test_chat_translates_whole_response(client, monkeypatch):
+    """翻訳指定時に既定では応答全体を1回で翻訳するかのテスト"""
+    calls = []
+    monkeypatch.setattr(main, "_translate_response", lambda text, target_lang: calls.append(text) or f"<{text}>")
+    original = app.state.chat_service
+    app.state.chat_service = ChatService(use_mock=True)
+    try:
+        response = client.post("/api/chat", json={"message": "hello", "translate_to": "en"})
+    finally:
+        app.state.chat_service.close()
+        app.state.chat_service = original
+
+    assert response.status_code == 200
+    data = response.json()
+    assert calls == [data["response"]]
+    assert data["translated_response"] == f"<{data['response']}>"
+
+
+def test_split_sentences_keeps_abbreviations():
+    """略語やイニシャルのピリオドで文を分割しないかのテスト"""
+    text = "Use a fruit, e.g. an apple. Ask Dr. J. Smith.\nこんにちは。元気？"
+    assert main._split_sentences(text) == ["Use a fruit, e.g. an apple. ", "Ask Dr. J. Smith.\n", "こんにちは。", "元気？"]
+
+
+def test_chat_translates_response_by_sentence(client, monkeypatch):
+    """生成と翻訳を重ねる設定の場合に応答を文ごとに翻訳して連結するかのテスト"""
+    monkeypatch.setattr(main.config, "CHAT_TRANSLATE_WHILE_GENERATING", True)
+    monkeypatch.setattr(main, "_translate_response", lambda text, target_lang: f"<{text}>")
+    original = app.state.chat_service
+    app.state.chat_service = ChatService(use_mock=True)
+    try:
+        response = client.post("/api/chat", json={"message": "hello", "translate_to": "en"})
+    finally:
+        app.state.chat_service.close()
+        app.state.chat_service = original
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["translated_response"] == " ".join(f"<{s.strip()}>" for s in main._split_sentences(data["response"]))
+
+
 def test_chat_with_session_id(client):
     """セッションIDを指定したチャットのテスト"""
     response = client.post(
         "/api/chat",
         json={"message": "Hello", "session_id": "test-session-123"},
     )
-    # モデルロード状況により結果が変わる
-    assert response.status_code in [200, 400, 500]
-
-
-def test_get_chat_history_not_found(client):
-    """存在しないセッションの履歴取得テスト"""
-    response = client.get("/api/chat/history/non-existent-session")
-    # セッションが存在しない場合は404が返る
-    assert response.status_code in [404, 500]
+    assert response.status_code == 200
+    # 存在しないセッションIDの場合は新しいセッションが作られる
+    assert response.json()["session_id"]
 
 
-def test_delete_chat_history_not_found(client):
-    """存在しないセッションの削除テスト"""
-    response = client.delete("/api/chat/history/non-existent-session")
+@pytest.mark.parametrize("method", ["get", "delete"])
+def test_chat_history_not_found(client, method):
+    """存在しないセッションの履歴取得・削除テスト"""
+    response = client.request(method, "/api/chat/history/non-existent-session")
     # セッションが存在しない場合は404が返る
-    assert response.status_code in [404, 500]
+    assert response.status_code == 404
 
 
 def test_list_chat_sessions(client):
     """チャットセッション一覧のテスト"""
     response = client.get("/api/chat/sessions")
-    # モデルが未ロードの場合でもエンドポイント自体は存在する
-    assert response.status_code in [200, 500]
-    if response.status_code == 200:
-        data = response.json()
-        assert "sessions" in data
-        assert "total" in data
+    assert response.status_code == 200
+    data = response.json()
+    assert "sessions" in data
+    assert "total" in data
@@ -0,0 +1,80 @@
+"""
+プロンプト改善エンジンのユニットテスト
+"""
+
+import prompt_improvement_engine
+from prompt_improvement_engine import (
+    PromptImprovementEngine,
+    process_prompt_generation_request,
+    process_prompt_improvement_request,
+)
+
+IMPROVE_MESSAGE = """次のプロンプトを改善してください。
+改善したいプロンプト：日本のダンススタジオ、大きな鏡、木製フロア、高品質、8k
+問題：鏡の中がおかしい。変な手・足"""
+
+
+def test_extract_original_prompt():
+    """プロンプトと問題の抽出テスト"""
+    prompt, problem = PromptImprovementEngine.extract_original_prompt(IMPROVE_MESSAGE)
+    assert prompt == "日本のダンススタジオ、大きな鏡、木製フロア、高品質、8k"
+    assert problem == "鏡の中がおかしい。変な手・足"
+
+    assert PromptImprovementEngine.extract_original_prompt("何もない") == ("", "")
+
+
+def test_improve_prompt_rule_based():
+    """ルールベースのプロンプト改善テスト"""
+    improved = PromptImprovementEngine.improve_prompt("猫、高品質、 夕焼け,", "鏡が変")
+    assert improved == "猫、高品質、超詳細な描写、夕焼け、鏡に正確に映る人物の姿勢"
+
+
+def test_generate_prompt_rule_based():
+    """ルールベースのプロンプト生成テスト"""
+    assert PromptImprovementEngine.generate_prompt("ダンス") == "ダンス、高品質明るい照明"
+    assert PromptImprovementEngine.generate_prompt("a") == "画像生成のプロンプト"
+    assert PromptImprovementEngine.generate_prompt("夜の東京の街並み、beautiful, 4k, 明るい") == "夜の東京の街並み、  明るい"
+
+
+def test_process_prompt_improvement_request():
+    """LLM応答の採用とフォールバックのテスト"""
+    accepted = "明るいダンススタジオ、鏡、木製フロア、高品質"
+    assert process_prompt_improvement_request(IMPROVE_MESSAGE, accepted) == accepted
+
+    # 英単語が混在する応答はルールベースに切り替わる
+    fallback = process_prompt_improvement_request(IMPROVE_MESSAGE, "A dance studio 鏡")
+    assert fallback.startswith("日本のダンススタジオ、大きな鏡（鏡に映る人物の手足が正確で自然な姿勢）")
+
+    assert process_prompt_improvement_request("何もない") == "申し訳ありませんが、プロンプトが確認できませんでした。"
+
+
+def test_process_prompt_generation_request():
+    """指示部分の除去とフォールバックのテスト"""
+    message = "画像生成用のプロンプトを作ってください。ダンス教室で踊る子供たち"
+    assert process_prompt_generation_request(message) == "ダンス教室で踊る子供たち、高品質明るい照明"
+
+    accepted = "美しい夕焼けの海辺、高品質、明るい照明"
+    assert process_prompt_generation_request(message, accepted) == accepted
+    assert process_prompt_generation_request(message, "cat猫") == "ダンス教室で踊る子供たち、高品質明るい照明"
+
+
+def test_process_results_are_cached():
+    """同じ入力の再処理がキャッシュから返されるテスト"""
+    cache = prompt_improvement_engine._cached_prompt_improvement
+    cache.cache_clear()
+
+    first = process_prompt_improvement_request(IMPROVE_MESSAGE, "A dance studio 鏡")
+    second = process_prompt_improvement_request(IMPROVE_MESSAGE, "A dance studio 鏡")
+
+    assert first == second
+    assert cache.cache_info().hits == 1
+
+    # 長すぎる入力はキャッシュしない
+    process_prompt_improvement_request(IMPROVE_MESSAGE + "猫" * 5000)
+    assert cache.cache_info().currsize == 1
+
+
+def test_generation_instructions_removed_in_order():
+    """指示パターンを順番に1つずつ適用した結果になるかのテスト"""
+    assert process_prompt_generation_request("日本語でプロンプトを返してください") == "日本語で"
+    assert process_prompt_generation_request("日本語で1行のプロンプトをください。夕焼けの海") == "日本語で行の。夕焼けの海"
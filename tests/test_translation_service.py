@@ -2,7 +2,12 @@
 TranslationService のユニットテスト
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import pytest
+import threading
+from unittest.mock import patch
+import translation_service as translation_module
 from translation_service import TranslationService
 
 
@@ -41,6 +46,13 @@ def test_detect_language(translation_service):
     """言語検出のテスト"""
     # 日本語
     assert translation_service._detect_language("こんにちは") == "ja"
+    assert translation_service._detect_language("日本語です") == "ja"
+
+    # 韓国語
+    assert translation_service._detect_language("안녕하세요") == "ko"
+
+    # ロシア語
+    assert translation_service._detect_language("Привет") == "ru"
 
     # 中国語（簡体字） - 日本語の漢字と同じものは日本語として判定される可能性がある
     detected = translation_service._detect_language("你好")
@@ -74,6 +86,29 @@ def test_same_language_translation(translation_service):
     assert result["original_text"] == "Hello"
 
 
+@pytest.mark.parametrize("text", ["", "   ", "12345", "https://example.com/path?q=1"])
+def test_passthrough_inputs_skip_model(translation_service, monkeypatch, text):
+    """空白・数字・URLのみの入力はモデルを呼ばずにそのまま返すかのテスト"""
+    monkeypatch.setattr(translation_service, "_load_model", lambda model_name: pytest.fail("model should not be loaded"))
+
+    result = translation_service.translate(text, target_lang="ja", source_lang="en")
+
+    assert result["translated_text"] == text
+    assert result["original_text"] == text
+
+
+def test_same_language_results_are_not_cached(tmp_path):
+    """同じ言語の入力はメモリとディスクのキャッシュに保存しないかのテスト"""
+    service = TranslationService(cache_dir=str(tmp_path), persistent_cache=True)
+    try:
+        result = service.translate("Hello", target_lang="en", source_lang="en")
+        assert result["translated_text"] == "Hello"
+        assert len(service._result_cache) == 0
+        assert service._persistent_cache.get("en", "en", "Hello") is None
+    finally:
+        service.close()
+
+
 def test_translation_result_structure(translation_service):
     """翻訳結果の構造テスト"""
     result = translation_service.translate(text="Test", target_lang="ja", source_lang="en")
@@ -92,3 +127,367 @@ def test_translation_result_structure(translation_service):
         assert "translated_text" in result
         assert "source_lang" in result
         assert "target_lang" in result
+
+
+class FakeTokenizer:
+    """テキストをそのままトークンIDとして扱うトークナイザー"""
+
+    src_lang = None
+
+    def __call__(self, texts, **kwargs):
+        return {"input_ids": list(texts), "attention_mask": [[1] * len(text) for text in texts]}
+
+    def pad(self, encodings, **kwargs):
+        return encodings
+
+    def convert_tokens_to_ids(self, token):
+        return token
+
+    def batch_decode(self, ids, **kwargs):
+        return list(ids)
+
+
+class FakeModel:
+    """入力テキストに translate_fn を適用した結果を生成結果として返すモデル"""
+
+    def __init__(self, translate_fn, calls=None):
+        self.translate_fn = translate_fn
+        self.calls = calls
+
+    def generate(self, input_ids, attention_mask=None, **kwargs):
+        if self.calls is not None:
+            self.calls.append((list(input_ids), kwargs))
+        return [self.translate_fn(text) for text in input_ids]
+
+
+def fake_loaded(translate_fn, calls=None):
+    """フェイクのモデルとトークナイザーでロード済みモデルを作成"""
+    return translation_module._LoadedModel(FakeModel(translate_fn, calls), FakeTokenizer())
+
+
+def test_translate_batch_groups_by_language(translation_service, monkeypatch):
+    """ソース言語ごとにまとめて翻訳し、入力の順序で結果を返すかのテスト"""
+    calls = []
+
+    def fake_load_model(model_name):
+        def translate(text):
+            calls.append((model_name, text))
+            return f"{model_name.rsplit('-', 1)[-1]}:{text}"
+
+        return fake_loaded(translate)
+
+    monkeypatch.setattr(translation_service, "_load_model", fake_load_model)
+
+    results = translation_service.translate_batch(["Hello", "こんにちは", "World"], target_lang="fr")
+
+    assert [r["translated_text"] for r in results] == ["fr:Hello", "fr:en:こんにちは", "fr:World"]
+    assert results[1]["via_english"] is True
+    # 英語の2件は1回の呼び出しにまとめられる
+    batch_calls = []
+    monkeypatch.setattr(translation_service, "_load_model", lambda model_name: fake_loaded(str.upper, batch_calls))
+    translation_service.translate_batch(["Good", "Morning"], target_lang="fr")
+    assert [texts for texts, _ in batch_calls] == [["Good", "Morning"]]
+
+
+def test_translate_batch_sorts_by_length(tmp_path, monkeypatch):
+    """長さの近い入力同士でバッチを組み、元の順序で結果を返すかのテスト"""
+    service = TranslationService(cache_dir=str(tmp_path), batch_size=2)
+    calls = []
+    monkeypatch.setattr(service, "_load_model", lambda model_name: fake_loaded(str.upper, calls))
+
+    texts = ["long sentence", "a", "medium", "bb"]
+    results = service.translate_batch(texts, target_lang="ja", source_lang="en")
+
+    assert [r["translated_text"] for r in results] == [text.upper() for text in texts]
+    assert [texts for texts, _ in calls] == [["a", "bb"], ["medium", "long sentence"]]
+
+
+def test_nllb_backend_translates_directly(tmp_path, monkeypatch):
+    """NLLBバックエンドでは英語を経由せず、言語コードを渡して直接翻訳するかのテスト"""
+    service = TranslationService(cache_dir=str(tmp_path), backend="nllb", num_beams=1)
+    loaded_names = []
+    calls = []
+    loaded = fake_loaded(lambda text: "Bonjour", calls)
+
+    def fake_load_model(model_name):
+        loaded_names.append(model_name)
+        return loaded
+
+    monkeypatch.setattr(service, "_load_model", fake_load_model)
+
+    result = service.translate("こんにちは", target_lang="fr")
+
+    assert result["translated_text"] == "Bonjour"
+    assert "via_english" not in result
+    assert loaded_names == ["facebook/nllb-200-distilled-600M"]
+    # ソース言語はトークナイザーに、ターゲット言語は出力先頭のトークンとして渡す
+    assert loaded.tokenizer.src_lang == "jpn_Jpan"
+    assert calls == [(["こんにちは"], {"num_beams": 1, "forced_bos_token_id": "fra_Latn"})]
+    assert service._get_model_name("invalid", "ja") is None
+
+    with pytest.raises(ValueError):
+        TranslationService(cache_dir=str(tmp_path), backend="unknown")
+
+
+def test_multilingual_pivot_uses_single_model(tmp_path, monkeypatch):
+    """言語ペアのモデルがない場合に英語を経由せず多言語モデルで直接翻訳するかのテスト"""
+    service = TranslationService(cache_dir=str(tmp_path), multilingual_pivot=True)
+    loaded_names = []
+
+    def fake_load_model(model_name):
+        loaded_names.append(model_name)
+        return fake_loaded(lambda text: "Bonjour")
+
+    monkeypatch.setattr(service, "_load_model", fake_load_model)
+
+    result = service.translate("こんにちは", target_lang="fr")
+
+    assert result["translated_text"] == "Bonjour"
+    assert "via_english" not in result
+    assert loaded_names == ["facebook/nllb-200-distilled-600M"]
+    # 直接のモデルがある言語ペアは言語ペアごとのモデルを使う
+    assert service._get_model_name("ja", "en") == "Helsinki-NLP/opus-mt-ja-en"
+
+
+def test_quantized_model_path(tmp_path):
+    """量子化形式ごとのモデル保存先と量子化設定のテスト"""
+    service = TranslationService(cache_dir=str(tmp_path))
+    assert service._get_model_path("Helsinki-NLP/opus-mt-en-ja").name == "Helsinki-NLP_opus-mt-en-ja_int8"
+    assert service._get_quantization_config().bits == 8
+
+    service = TranslationService(cache_dir=str(tmp_path), quantization="fp16")
+    assert service._get_model_path("Helsinki-NLP/opus-mt-en-ja").name == "Helsinki-NLP_opus-mt-en-ja"
+    assert service._get_quantization_config() is None
+
+
+@patch("translation_service.AutoTokenizer")
+@patch("translation_service.OVModelForSeq2SeqLM")
+def test_least_recently_used_model_unloaded(mock_model, mock_tokenizer, tmp_path):
+    """保持数の上限を超えると最も長く使われていないモデルを解放するかのテスト"""
+    service = TranslationService(cache_dir=str(tmp_path), model_capacity=2)
+
+    for model_name in ("test/model-a", "test/model-b", "test/model-a", "test/model-c"):
+        service._load_model(model_name)
+
+    assert list(service.loaded_models) == ["test/model-a", "test/model-c"]
+    assert mock_tokenizer.from_pretrained.call_count == 3
+
+
+@patch("translation_service.OVModelForSeq2SeqLM")
+def test_concurrent_exports_are_deduplicated(mock_model, tmp_path):
+    """同じモデルのエクスポートが実行中なら重複して実行せずに完了を待つかのテスト"""
+    service = TranslationService(cache_dir=str(tmp_path))
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_export(*args, **kwargs):
+        started.set()
+        release.wait(timeout=5)
+        return mock_model.return_value
+
+    mock_model.from_pretrained.side_effect = slow_export
+    mock_model.return_value.save_pretrained.side_effect = lambda path: path.mkdir()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(service._ensure_exported, "test/model-a")
+        started.wait(timeout=5)
+        second = executor.submit(service._ensure_exported, "test/model-a")
+        release.set()
+
+    assert first.result() == second.result() == service._get_model_path("test/model-a")
+    assert mock_model.from_pretrained.call_count == 1
+    assert service._export_futures == {}
+
+
+@patch("translation_service.OVModelForSeq2SeqLM")
+def test_prefetch_export_failure_is_logged(mock_model, tmp_path, caplog):
+    """バックグラウンドのエクスポートの失敗がモデル名付きでログに出るかのテスト"""
+    mock_model.from_pretrained.side_effect = RuntimeError("download failed")
+
+    service = TranslationService(cache_dir=str(tmp_path), backend="nllb", prefetch_exports=True)
+    service._export_executor.shutdown(wait=True)
+
+    assert "Background export failed for facebook/nllb-200-distilled-600M: download failed" in caplog.text
+
+
+def test_prewarm_loads_required_models(tmp_path, monkeypatch):
+    """事前ロードで言語ペアに必要なモデル（英語経由なら2つ）を重複なくロードするかのテスト"""
+    service = TranslationService(cache_dir=str(tmp_path))
+    loaded = []
+    monkeypatch.setattr(service, "_load_model", loaded.append)
+
+    service.prewarm([("ja", "en"), ("ja", "fr"), ("en", "en")])
+
+    assert sorted(loaded) == ["Helsinki-NLP/opus-mt-en-fr", "Helsinki-NLP/opus-mt-ja-en"]
+    assert service._get_ov_config()["CACHE_DIR"] == str(tmp_path / "ov_cache")
+
+
+@patch("translation_service.AutoTokenizer")
+@patch("translation_service.OVModelForSeq2SeqLM")
+def test_warmup_runs_generate_after_load(mock_model, mock_tokenizer, tmp_path):
+    """ウォームアップ有効時にロード直後にバッチサイズ分の入力で1回生成するかのテスト"""
+    service = TranslationService(cache_dir=str(tmp_path), batch_size=4, warmup=True)
+
+    service._load_model("test/model-a")
+
+    model = mock_model.from_pretrained.return_value
+    tokenizer = mock_tokenizer.from_pretrained.return_value
+    model.generate.assert_called_once()
+    assert len(tokenizer.call_args.args[0]) == 4
+
+
+def test_translation_results_are_cached(tmp_path, monkeypatch):
+    """同じテキストの再翻訳でモデルを呼ばずにキャッシュから返すかのテスト"""
+    service = TranslationService(cache_dir=str(tmp_path), result_cache_size=2)
+    calls = []
+    monkeypatch.setattr(service, "_load_model", lambda model_name: fake_loaded(str.upper, calls))
+
+    first = service.translate("hello", target_lang="ja", source_lang="en")
+    first["translated_text"] = "changed"
+    results = service.translate_batch(["hello", "world"], target_lang="ja", source_lang="en")
+
+    assert [r["translated_text"] for r in results] == ["HELLO", "WORLD"]
+    assert [texts for texts, _ in calls] == [["hello"], ["world"]]
+
+    service.translate("again", target_lang="ja", source_lang="en")
+    assert ("en", "ja", "hello") not in service._result_cache
+
+
+def test_detect_latin_language_with_lingua(translation_service, monkeypatch):
+    """lingua が使える場合はラテン文字の文を判別器に任せるかのテスト"""
+    monkeypatch.setattr(translation_module, "LINGUA_AVAILABLE", True)
+    monkeypatch.setattr(translation_module, "_detect_latin_language", lambda text: "fr")
+
+    assert translation_service._detect_language("Bonjour tout le monde") == "fr"
+    # 文字種で判別できる言語は判別器を使わない
+    assert translation_service._detect_language("こんにちは") == "ja"
+
+
+@pytest.mark.asyncio
+async def test_translate_async_batches_concurrent_requests(tmp_path, monkeypatch):
+    """同時に届いたリクエストを言語ペアごとに1回の推論にまとめるかのテスト"""
+    service = TranslationService(cache_dir=str(tmp_path), batch_requests=True, batch_wait_ms=50)
+    calls = []
+    monkeypatch.setattr(service, "_load_model", lambda model_name: fake_loaded(str.upper, calls))
+
+    try:
+        results = await asyncio.gather(
+            service.translate_async("hello", target_lang="ja", source_lang="en"),
+            service.translate_async("world", target_lang="ja", source_lang="en"),
+            service.translate_async("bonjour", target_lang="en", source_lang="fr"),
+        )
+    finally:
+        service.close()
+
+    assert [r["translated_text"] for r in results] == ["HELLO", "WORLD", "BONJOUR"]
+    assert sorted(texts for texts, _ in calls) == [["bonjour"], ["hello", "world"]]
+
+
+def test_persistent_cache_survives_restart(tmp_path, monkeypatch):
+    """永続キャッシュに保存した翻訳結果を別インスタンスでもモデルを呼ばずに再利用するかのテスト"""
+    service = TranslationService(cache_dir=str(tmp_path), persistent_cache=True)
+    monkeypatch.setattr(service, "_load_model", lambda model_name: fake_loaded(str.upper))
+    service.translate("hello", target_lang="ja", source_lang="en")
+    service.close()
+
+    restarted = TranslationService(cache_dir=str(tmp_path), persistent_cache=True)
+    monkeypatch.setattr(restarted, "_load_model", lambda model_name: pytest.fail("model should not be loaded"))
+    try:
+        result = restarted.translate("hello", target_lang="ja", source_lang="en")
+    finally:
+        restarted.close()
+
+    assert result["translated_text"] == "HELLO"
+    assert ("en", "ja", "hello") in restarted._result_cache
+
+
+def test_persistent_cache_evicts_oldest_entries(tmp_path):
+    """永続キャッシュが上限を超えたときに古く保存したものから削除するかのテスト"""
+    cache = translation_module._PersistentResultCache(tmp_path / "cache.sqlite3", max_entries=10)
+    try:
+        for i in range(12):
+            cache.put_many([("en", "ja", f"text{i}", {"translated_text": str(i)})])
+        assert cache.get("en", "ja", "text0") is None
+        assert cache.get("en", "ja", "text11") == {"translated_text": "11"}
+        assert cache._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0] <= 10
+    finally:
+        cache.close()
+
+
+def test_persistent_cache_errors_do_not_fail_translation(tmp_path, monkeypatch):
+    """永続キャッシュの読み書きに失敗しても翻訳結果を返すかのテスト"""
+    import sqlite3
+
+    class LockedConnection:
+        in_transaction = False
+
+        def execute(self, *args):
+            raise sqlite3.OperationalError("database is locked")
+
+        executemany = execute
+
+    service = TranslationService(cache_dir=str(tmp_path), persistent_cache=True)
+    monkeypatch.setattr(service, "_load_model", lambda model_name: fake_loaded(str.upper))
+    real_conn = service._persistent_cache._conn
+    service._persistent_cache._conn = LockedConnection()
+    try:
+        result = service.translate("hello", target_lang="ja", source_lang="en")
+    finally:
+        service._persistent_cache._conn = real_conn
+        service.close()
+
+    assert result["translated_text"] == "HELLO"
+
+
+def test_cached_result_keeps_pivot_flag(tmp_path, monkeypatch):
+    """キャッシュから返す結果が翻訳直後と同じ形式になるかのテスト"""
+    service = TranslationService(cache_dir=str(tmp_path))
+    monkeypatch.setattr(service, "_load_model", lambda model_name: fake_loaded(str.upper))
+
+    first = service.translate("こんにちは", target_lang="fr", source_lang="ja")
+    second = service.translate("こんにちは", target_lang="fr", source_lang="ja")
+
+    assert first == second
+    assert second["via_english"] is True
+    assert service._result_cache[("ja", "fr", "こんにちは")] == ("こんにちは", True)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_async_request_does_not_block_later_requests(tmp_path, monkeypatch):
+    """待機中にキャンセルされたリクエストがあっても、後続のリクエストが完了するかのテスト"""
+    service = TranslationService(cache_dir=str(tmp_path), batch_requests=True, batch_wait_ms=50)
+    monkeypatch.setattr(service, "_load_model", lambda model_name: fake_loaded(str.upper))
+
+    try:
+        task = asyncio.ensure_future(service.translate_async("hello", target_lang="ja", source_lang="en"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        result = await asyncio.wait_for(service.translate_async("world", target_lang="ja", source_lang="en"), timeout=2)
+    finally:
+        service.close()
+
+    assert result["translated_text"] == "WORLD"
+
+
+@pytest.mark.asyncio
+async def test_async_language_detection_runs_off_event_loop(tmp_path, monkeypatch):
+    """batch_requests が有効な場合、言語の自動検出をイベントループのスレッドで行わないかのテスト"""
+    detect_threads = []
+
+    def detect_language(self, text):
+        detect_threads.append(threading.current_thread())
+        return "en"
+
+    monkeypatch.setattr(TranslationService, "_detect_language", detect_language)
+    service = TranslationService(cache_dir=str(tmp_path), batch_requests=True, batch_wait_ms=1)
+    monkeypatch.setattr(service, "_load_model", lambda model_name: fake_loaded(str.upper))
+    try:
+        result = await asyncio.wait_for(service.translate_async("hello", target_lang="ja"), timeout=2)
+    finally:
+        service.close()
+
+    assert result["translated_text"] == "HELLO"
+    assert result["source_lang"] == "en"
+    assert detect_threads and threading.current_thread() not in detect_threads
@@ -1,80 +1,592 @@
 """
 OpenVINOを使った翻訳サービス
-Helsinki-NLP/opus-mt モデルを使用して多言語翻訳を実現
+Helsinki-NLP/opus-mt モデル（または多言語モデル NLLB-200）を使用して多言語翻訳を実現
 """
 
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
-from optimum.intel import OVModelForSeq2SeqLM
-from transformers import AutoTokenizer, pipeline
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from optimum.intel import OVModelForSeq2SeqLM, OVWeightQuantizationConfig
+from transformers import AutoTokenizer
+from batching import QueueBatcher
+import asyncio
+import functools
+import gc
+import hashlib
+import json
 import logging
+import re
+import sqlite3
+import threading
+
+# lingua（オプション: pip install lingua-language-detector）が使える場合は
+# ラテン文字の言語（英語・フランス語・ドイツ語・スペイン語）を判別する（無い場合は英語とみなす）
+try:
+    from lingua import Language, LanguageDetectorBuilder
+
+    LINGUA_AVAILABLE = True
+except ImportError:
+    LINGUA_AVAILABLE = False
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 言語ペアごとの Helsinki-NLP/opus-mt モデル（直接のペアがない場合は英語を経由する）
+MARIAN_MODELS = {
+    ("ja", "en"): "Helsinki-NLP/opus-mt-ja-en",
+    ("en", "ja"): "Helsinki-NLP/opus-mt-en-ja",
+    ("en", "zh"): "Helsinki-NLP/opus-mt-en-zh",
+    ("zh", "en"): "Helsinki-NLP/opus-mt-zh-en",
+    ("en", "fr"): "Helsinki-NLP/opus-mt-en-fr",
+    ("fr", "en"): "Helsinki-NLP/opus-mt-fr-en",
+    ("en", "de"): "Helsinki-NLP/opus-mt-en-de",
+    ("de", "en"): "Helsinki-NLP/opus-mt-de-en",
+    ("en", "es"): "Helsinki-NLP/opus-mt-en-es",
+    ("es", "en"): "Helsinki-NLP/opus-mt-es-en",
+    ("en", "ru"): "Helsinki-NLP/opus-mt-en-ru",
+    ("ru", "en"): "Helsinki-NLP/opus-mt-ru-en",
+}
+
+# 1つのモデルで全言語ペアを直接翻訳する多言語モデル（英語を経由しない）
+NLLB_MODEL_NAME = "facebook/nllb-200-distilled-600M"
+
+# 言語コード -> NLLB の言語コード
+NLLB_LANG_CODES = {
+    "en": "eng_Latn",
+    "ja": "jpn_Jpan",
+    "zh": "zho_Hans",
+    "fr": "fra_Latn",
+    "de": "deu_Latn",
+    "es": "spa_Latn",
+    "ru": "rus_Cyrl",
+}
+
+TRANSLATION_BACKENDS = ("marian", "nllb")
+
+# サポート言語の一覧（固定のため呼び出しごとに作り直さない）
+_SUPPORTED_LANGUAGES = (
+    {"code": "en", "name": "English"},
+    {"code": "ja", "name": "Japanese (日本語)"},
+    {"code": "zh", "name": "Chinese (中文)"},
+    {"code": "fr", "name": "French (Français)"},
+    {"code": "de", "name": "German (Deutsch)"},
+    {"code": "es", "name": "Spanish (Español)"},
+    {"code": "ru", "name": "Russian (Русский)"},
+)
+
+# 翻訳しても変わらない入力（URLのみ）
+_URL_RE = re.compile(r"\s*(?:https?://|www\.)\S+\s*", re.IGNORECASE)
+
+# 言語検出に使う文字種（C実装の正規表現で走査し、最初に見つかった時点で打ち切る）
+_KANA_RE = re.compile(r"[\u3040-\u309f\u30a0-\u30ff]")
+_HANGUL_RE = re.compile(r"[\uac00-\ud7a3]")
+_CJK_RE = re.compile(r"[\u4e00-\u9fff]")
+_CYRILLIC_RE = re.compile(r"[\u0400-\u04ff]")
+
+
+@functools.lru_cache(maxsize=1)
+def _get_latin_detector():
+    """サポート言語のうちラテン文字の言語だけを候補にした検出器（初回使用時に作成）"""
+    return LanguageDetectorBuilder.from_languages(Language.ENGLISH, Language.FRENCH, Language.GERMAN, Language.SPANISH).build()
+
+
+@functools.lru_cache(maxsize=4096)
+def _detect_latin_language(text: str) -> str:
+    """ラテン文字の文の言語を判別（判別できない場合は英語）"""
+    language = _get_latin_detector().detect_language_of(text)
+    if language is None:
+        return "en"
+    return language.iso_code_639_1.name.lower()
+
+
+def _is_passthrough(text: str) -> bool:
+    """空白のみ・数字のみ・URLのみなど、モデルに渡さずそのまま返す入力か"""
+    stripped = text.strip()
+    return not stripped or stripped.isdigit() or _URL_RE.fullmatch(stripped) is not None
+
+
+def _passthrough_result(text: str, source_lang: str, target_lang: str) -> dict:
+    """翻訳せずに入力をそのまま返す結果"""
+    return {
+        "translated_text": text,
+        "source_lang": source_lang,
+        "target_lang": target_lang,
+        "original_text": text,
+    }
+
+
+class _CachedTranslation(NamedTuple):
+    """
+    キャッシュに保持する翻訳結果
+
+    言語ペアと原文はキャッシュのキーに含まれるため、結果の辞書ではなく訳文と経由の有無だけを保持する
+    """
+
+    translated_text: str
+    via_english: bool = False
+
+    def to_result(self, text: str, source_lang: str, target_lang: str) -> dict:
+        """translate と同じ形式の結果辞書を作成"""
+        result = {
+            "translated_text": self.translated_text,
+            "source_lang": source_lang,
+            "target_lang": target_lang,
+            "original_text": text,
+        }
+        if self.via_english:
+            result["via_english"] = True
+        return result
+
+
+# 重みのみ量子化の設定（quantization -> OVWeightQuantizationConfig の引数）
+# fp16 は量子化なし（エクスポート時のデフォルト精度）
+QUANTIZATION_PRESETS = {
+    "fp16": None,
+    "int8": {"bits": 8, "sym": True},
+}
+
+
+class _LoadedModel:
+    """ロード済みの翻訳モデルとトークナイザーの組"""
+
+    __slots__ = ("model", "tokenizer", "tokenizer_lock")
+
+    def __init__(self, model, tokenizer):
+        self.model = model
+        self.tokenizer = tokenizer
+        # NLLB のトークナイザーはソース言語を属性で受け取るため、設定とエンコードを1組で行う
+        self.tokenizer_lock = threading.Lock()
+
+
+class _PersistentResultCache:
+    """
+    翻訳結果をSQLiteに保存し、プロセスを再起動しても同じ文を再翻訳しないようにするキャッシュ
+
+    キーはテキストそのものではなく BLAKE2b のダイジェスト（長い文でもキーの長さが一定になる）。
+    件数が上限を超えたら古く保存したものから削除する。読み書きの失敗（他のワーカーによるロックなど）は
+    ログに記録するだけで翻訳自体は続行する
+    """
+
+    def __init__(self, path: Path, max_entries: int = 1_000_000, timeout: float = 1.0):
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(str(path), timeout=timeout, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "source_lang TEXT NOT NULL, target_lang TEXT NOT NULL, text_hash BLOB NOT NULL, result TEXT NOT NULL, "
+                "PRIMARY KEY (source_lang, target_lang, text_hash))"
+            )
+            self._conn.commit()
+            # 件数の概算（追加のたびに数え直さず、上限を超えたときだけ正確に数える）
+            self._count = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    @staticmethod
+    def _hash(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, source_lang: str, target_lang: str, text: str) -> Optional[dict]:
+        """保存済みの翻訳結果を取得（無い場合と読み取りに失敗した場合は None）"""
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT result FROM translations WHERE source_lang = ? AND target_lang = ? AND text_hash = ?",
+                    (source_lang, target_lang, self._hash(text)),
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Failed to read persistent translation cache: %s", e)
+            return None
+        return json.loads(row[0]) if row is not None else None
+
+    def put_many(self, entries: List[Tuple[str, str, str, dict]]) -> None:
+        """(ソース言語, ターゲット言語, テキスト, 翻訳結果) をまとめて1回のトランザクションで保存（失敗しても例外は送出しない）"""
+        rows = [
+            (source_lang, target_lang, self._hash(text), json.dumps(result, ensure_ascii=False))
+            for source_lang, target_lang, text, result in entries
+        ]
+        with self._lock:
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)", rows)
+                self._count += len(rows)
+                if self._count > self.max_entries:
+                    self._evict_locked()
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning("Failed to write persistent translation cache: %s", e)
+                if self._conn.in_transaction:
+                    self._conn.rollback()
+
+    def _evict_locked(self) -> None:
+        """上限を超えた分を保存の古い順（rowid 順）に削除（_lock を保持した状態で呼び出すこと）"""
+        self._count = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        excess = self._count - self.max_entries
+        if excess <= 0:
+            return
+        # 上限付近で毎回削除しないよう、上限の1割を余分に削除する
+        excess += self.max_entries // 10
+        self._conn.execute(
+            "DELETE FROM translations WHERE rowid IN (SELECT rowid FROM translations ORDER BY rowid LIMIT ?)", (excess,)
+        )
+        self._count = max(0, self._count - excess)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class _TranslationBatcher(QueueBatcher):
+    """
+    同時に到着した翻訳要求をまとめて言語ペアごとに1回の推論で処理
+
+    バックグラウンドスレッドがキューから最大 max_batch 件（max_wait_ms 以内に到着した分）を取り出し、
+    (ソース言語, ターゲット言語) ごとにまとめて translate_group に渡した後、各Futureに結果を返す
+    ソース言語が指定されていない要求は、イベントループを止めないようこのスレッドで detect_language により判別する
+    """
+
+    name = "translation-batcher"
+
+    def __init__(
+        self,
+        translate_group: Callable[[List[str], str, str], List[dict]],
+        detect_language: Callable[[str], str],
+        max_batch: int = 8,
+        max_wait_ms: float = 10.0,
+    ):
+        self.translate_group = translate_group
+        self.detect_language = detect_language
+        super().__init__(max_batch, max_wait_ms)
+
+    def submit(self, text: str, source_lang: Optional[str], target_lang: str) -> Future:
+        """翻訳要求を登録し、翻訳結果を受け取るFutureを返す（source_lang が None の場合は自動検出）"""
+        return self._enqueue((text, source_lang, target_lang))
+
+    def _process(self, items: List[Tuple[Tuple[str, Optional[str], str], Future]]) -> None:
+        groups: Dict[Tuple[str, str], List[Tuple[str, Future]]] = {}
+        for (text, source_lang, target_lang), future in items:
+            if source_lang is None:
+                try:
+                    source_lang = self.detect_language(text)
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+            groups.setdefault((source_lang, target_lang), []).append((text, future))
+
+        for (source_lang, target_lang), group in groups.items():
+            try:
+                results = self.translate_group([text for text, _ in group], source_lang, target_lang)
+            except Exception as e:
+                for _, future in group:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(group, results):
+                future.set_result(result)
+
 
 class TranslationService:
     """OpenVINOベースの翻訳サービス"""
 
-    def __init__(self, cache_dir: str = "./models"):
+    def __init__(
+        self,
+        cache_dir: str = "./models",
+        batch_size: int = 8,
+        backend: str = "marian",
+        quantization: str = "int8",
+        performance_hint: str = "LATENCY",
+        num_streams: Optional[str] = None,
+        model_capacity: int = 3,
+        result_cache_size: int = 5000,
+        warmup: bool = False,
+        num_beams: Optional[int] = None,
+        batch_requests: bool = False,
+        batch_wait_ms: float = 10.0,
+        multilingual_pivot: bool = False,
+        prefetch_exports: bool = False,
+        persistent_cache: bool = False,
+        persistent_cache_size: int = 1_000_000,
+    ):
+        """
+        Args:
+            cache_dir: OpenVINO形式に変換したモデルの保存先
+            batch_size: 複数テキストを翻訳するときに1回の推論でまとめる件数
+            backend: 翻訳モデル（"marian": 言語ペアごとのモデル、"nllb": 全ペアを1つで扱う多言語モデル）
+            quantization: エクスポート時の重みの量子化形式（"fp16", "int8"）
+            performance_hint: OpenVINOの性能ヒント（"LATENCY" は単一リクエスト向け、"THROUGHPUT" は同時リクエスト向け）
+            num_streams: 推論ストリーム数（None でヒントに応じたデフォルト、"AUTO" も指定可）
+            model_capacity: 同時に保持するモデル数の上限（超えると最も長く使われていないモデルを解放）
+            result_cache_size: 翻訳結果をメモリに保持する件数の上限（0 で無効）
+            warmup: モデルのロード直後にバッチサイズ分の短い入力で1回推論し、初回リクエストの初期化コストを先に払う
+            num_beams: ビームサーチの幅（None でモデルの既定値、1 で貪欲法になり数倍速くなる代わりに品質が下がる場合がある）
+            batch_requests: translate_async の同時リクエストを言語ペアごとにまとめて1回の推論で処理する
+            batch_wait_ms: batch_requests 有効時に後続のリクエストを待つ最大時間（ミリ秒）
+            multilingual_pivot: marian で言語ペアのモデルがない場合に、英語を経由せず多言語モデル1つで翻訳する
+            prefetch_exports: 起動時に未エクスポートのモデルをバックグラウンドでエクスポートし、最初のリクエストが待たずに済むようにする
+            persistent_cache: 翻訳結果を cache_dir 内のSQLiteにも保存し、再起動後も再利用する
+            persistent_cache_size: 永続キャッシュに保持する件数の上限（超えると古く保存したものから削除）
+        """
+        if backend not in TRANSLATION_BACKENDS:
+            raise ValueError(f"Unknown translation backend: {backend}. Available: {list(TRANSLATION_BACKENDS)}")
+        if quantization not in QUANTIZATION_PRESETS:
+            raise ValueError(f"Unknown quantization: {quantization}. Available: {list(QUANTIZATION_PRESETS.keys())}")
+        if model_capacity < 1:
+            raise ValueError(f"model_capacity must be at least 1: {model_capacity}")
+
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(exist_ok=True)
-        self.loaded_models = {}
-
-    def _get_model_name(self, source_lang: str, target_lang: str) -> str:
-        """言語ペアに基づいてモデル名を取得"""
-        # マルチリンガル モデルを使用
-        lang_pairs = {
-            ("ja", "en"): "Helsinki-NLP/opus-mt-ja-en",
-            ("en", "ja"): "Helsinki-NLP/opus-mt-en-ja",
-            ("en", "zh"): "Helsinki-NLP/opus-mt-en-zh",
-            ("zh", "en"): "Helsinki-NLP/opus-mt-zh-en",
-            ("en", "fr"): "Helsinki-NLP/opus-mt-en-fr",
-            ("fr", "en"): "Helsinki-NLP/opus-mt-fr-en",
-            ("en", "de"): "Helsinki-NLP/opus-mt-en-de",
-            ("de", "en"): "Helsinki-NLP/opus-mt-de-en",
-            ("en", "es"): "Helsinki-NLP/opus-mt-en-es",
-            ("es", "en"): "Helsinki-NLP/opus-mt-es-en",
-            ("en", "ru"): "Helsinki-NLP/opus-mt-en-ru",
-            ("ru", "en"): "Helsinki-NLP/opus-mt-ru-en",
-        }
+        self.batch_size = batch_size
+        self.backend = backend
+        self.quantization = quantization
+        self.performance_hint = performance_hint
+        self.num_streams = num_streams
+        self.model_capacity = model_capacity
+        # ロード済みモデル（使用順に並べ、先頭が最も長く使われていないモデル）
+        self.loaded_models: "OrderedDict[str, object]" = OrderedDict()
+        self._models_lock = threading.Lock()
+        # (ソース言語, ターゲット言語, テキスト) -> 翻訳結果（同じ文の再翻訳を省く）
+        self.result_cache_size = result_cache_size
+        self._result_cache: "OrderedDict[Tuple[str, str, str], _CachedTranslation]" = OrderedDict()
+        self._result_cache_lock = threading.Lock()
+        self._persistent_cache = None
+        if persistent_cache:
+            try:
+                self._persistent_cache = _PersistentResultCache(
+                    self.cache_dir / "translations.sqlite3", max_entries=persistent_cache_size
+                )
+            except sqlite3.Error as e:
+                # 永続キャッシュが使えなくても翻訳はメモリのキャッシュだけで続ける
+                logger.warning("Persistent translation cache disabled: %s", e)
+        self.warmup = warmup
+        self.num_beams = num_beams
+        self.multilingual_pivot = multilingual_pivot
+        # モデル名 -> 実行中のエクスポート（同じモデルの重複エクスポートを防ぐ）
+        self._export_futures: Dict[str, Future] = {}
+        self._export_lock = threading.Lock()
+        self._export_executor = (
+            ThreadPoolExecutor(max_workers=2, thread_name_prefix="translation-export") if prefetch_exports else None
+        )
+        self._batcher = (
+            _TranslationBatcher(self._translate_group, self._detect_language, max_batch=batch_size, max_wait_ms=batch_wait_ms)
+            if batch_requests
+            else None
+        )
+        if self._export_executor is not None:
+            self._prefetch_exports()
+
+    def _get_model_name(self, source_lang: str, target_lang: str) -> Optional[str]:
+        """言語ペアに基づいてモデル名を取得（直接翻訳できない場合は None）"""
+        nllb_supported = source_lang in NLLB_LANG_CODES and target_lang in NLLB_LANG_CODES
+        if self.backend == "nllb":
+            return NLLB_MODEL_NAME if nllb_supported else None
 
-        # 直接のペアがない場合は、英語を経由
-        if (source_lang, target_lang) in lang_pairs:
-            return lang_pairs[(source_lang, target_lang)]
+        model_name = MARIAN_MODELS.get((source_lang, target_lang))
+        # 言語ペアのモデルがない場合は、英語を経由して2つのモデルを使う代わりに多言語モデル1つで直接翻訳する
+        if model_name is None and self.multilingual_pivot and nllb_supported:
+            return NLLB_MODEL_NAME
+        return model_name
 
-        return None
+    def _get_required_models(self, source_lang: str, target_lang: str) -> List[str]:
+        """言語ペアの翻訳に必要なモデル名（英語を経由する場合は2つ、翻訳できない場合は空）"""
+        if source_lang == target_lang:
+            return []
+
+        model_name = self._get_model_name(source_lang, target_lang)
+        if model_name is not None:
+            return [model_name]
+
+        intermediate_model = self._get_model_name(source_lang, "en")
+        final_model = self._get_model_name("en", target_lang)
+        if intermediate_model and final_model:
+            return [intermediate_model, final_model]
+        return []
+
+    def prewarm(self, pairs: List[Tuple[str, str]]) -> None:
+        """
+        指定した言語ペアのモデルを並列にロードし、最初のリクエストがエクスポート・コンパイルを待たずに済むようにする
+
+        Args:
+            pairs: (ソース言語, ターゲット言語) のリスト
+        """
+        # lingua の検出器は作成に時間がかかるため、最初の自動検出を待たせないよう先に作成する
+        if LINGUA_AVAILABLE:
+            _get_latin_detector()
+
+        model_names: List[str] = []
+        for source_lang, target_lang in pairs:
+            for model_name in self._get_required_models(source_lang, target_lang):
+                if model_name not in model_names:
+                    model_names.append(model_name)
+
+        # 上限を超えてロードしても先にロードしたものが解放されるだけなので、保持できる数までに留める
+        if len(model_names) > self.model_capacity:
+            logger.warning(
+                "Prewarming only %d of %d translation models (model_capacity=%d)",
+                self.model_capacity,
+                len(model_names),
+                self.model_capacity,
+            )
+            model_names = model_names[: self.model_capacity]
+        if not model_names:
+            return
+
+        with ThreadPoolExecutor(max_workers=len(model_names), thread_name_prefix="translation-prewarm") as executor:
+            futures = {model_name: executor.submit(self._load_model, model_name) for model_name in model_names}
+        for model_name, future in futures.items():
+            # ロードに失敗したモデルは最初のリクエスト時に再試行される
+            if future.exception() is not None:
+                logger.error("Failed to prewarm translation model %s: %s", model_name, future.exception())
+
+    def _get_language_kwargs(self, model_name: str, source_lang: str, target_lang: str) -> Dict[str, str]:
+        """多言語モデルに翻訳方向を伝える引数（_generate に渡す）"""
+        if model_name == NLLB_MODEL_NAME:
+            return {"src_lang": NLLB_LANG_CODES[source_lang], "tgt_lang": NLLB_LANG_CODES[target_lang]}
+        return {}
 
     def _load_model(self, model_name: str):
-        """モデルをロードしてキャッシュ"""
-        if model_name in self.loaded_models:
-            return self.loaded_models[model_name]
+        """モデルをロードしてキャッシュ（最近使用したものとして記録）"""
+        with self._models_lock:
+            loaded = self.loaded_models.get(model_name)
+            if loaded is not None:
+                self.loaded_models.move_to_end(model_name)
+                return loaded
 
         try:
-            logger.info(f"Loading model: {model_name}")
-            model_path = self.cache_dir / model_name.replace("/", "_")
-
-            # モデルが既にエクスポートされているか確認
-            if not model_path.exists():
-                logger.info("Exporting model to OpenVINO format...")
-                # PyTorchモデルをOpenVINO形式にエクスポート
-                model = OVModelForSeq2SeqLM.from_pretrained(model_name, export=True, compile=True)
-                model.save_pretrained(model_path)
-            else:
-                logger.info("Loading cached OpenVINO model...")
-                model = OVModelForSeq2SeqLM.from_pretrained(model_path, compile=True)
+            logger.info("Loading model: %s (%s)", model_name, self.quantization)
+            # 未エクスポートならエクスポート（バックグラウンドでエクスポート中なら完了を待つ）
+            model_path = self._ensure_exported(model_name)
+
+            logger.info("Loading cached OpenVINO model...")
+            model = OVModelForSeq2SeqLM.from_pretrained(model_path, compile=True, ov_config=self._get_ov_config())
 
             tokenizer = AutoTokenizer.from_pretrained(model_name)
 
-            translator = pipeline("translation", model=model, tokenizer=tokenizer, device="cpu")
+            if self.warmup:
+                self._warmup_model(model, tokenizer, model_name)
+
+            with self._models_lock:
+                # 同時にロードした別スレッドがあればそちらを優先して重複を避ける
+                loaded = self.loaded_models.setdefault(model_name, _LoadedModel(model, tokenizer))
+                self.loaded_models.move_to_end(model_name)
+                evicted = self._evict_models_locked()
+            logger.info("Model loaded successfully: %s", model_name)
+
+            if evicted:
+                # OpenVINOのコンパイル済みモデルへの参照を手放してからメモリを回収する
+                del evicted
+                gc.collect()
+            return loaded
+
+        except Exception as e:
+            logger.error("Error loading model %s: %s", model_name, e)
+            raise
+
+    def _ensure_exported(self, model_name: str) -> Path:
+        """
+        モデルがOpenVINO形式でエクスポート済みであることを保証して保存先を返す
+
+        同じモデルのエクスポートが実行中であれば、重複して実行せずに完了を待つ
+        """
+        model_path = self._get_model_path(model_name)
+        with self._export_lock:
+            future = self._export_futures.get(model_name)
+            owner = future is None
+            if owner:
+                if model_path.exists():
+                    return model_path
+                future = Future()
+                self._export_futures[model_name] = future
 
-            self.loaded_models[model_name] = translator
-            logger.info(f"Model loaded successfully: {model_name}")
-            return translator
+        if not owner:
+            future.result()
+            return model_path
 
+        try:
+            logger.info("Exporting model to OpenVINO format: %s", model_name)
+            # PyTorchモデルをOpenVINO形式にエクスポート（量子化済みの重みを保存し、次回以降は再量子化しない）
+            model = OVModelForSeq2SeqLM.from_pretrained(
+                model_name,
+                export=True,
+                compile=False,
+                quantization_config=self._get_quantization_config(),
+            )
+            model.save_pretrained(model_path)
+            future.set_result(model_path)
         except Exception as e:
-            logger.error(f"Error loading model {model_name}: {e}")
+            future.set_exception(e)
             raise
+        finally:
+            # 失敗した場合は次の呼び出しで再試行する
+            with self._export_lock:
+                self._export_futures.pop(model_name, None)
+        return model_path
+
+    def _prefetch_exports(self) -> None:
+        """使用しうる全モデルのうち未エクスポートのものをバックグラウンドでエクスポート"""
+        if self.backend == "nllb":
+            model_names = [NLLB_MODEL_NAME]
+        else:
+            model_names = list(dict.fromkeys(MARIAN_MODELS.values()))
+            if self.multilingual_pivot:
+                model_names.append(NLLB_MODEL_NAME)
+
+        for model_name in model_names:
+            if not self._get_model_path(model_name).exists():
+                future = self._export_executor.submit(self._ensure_exported, model_name)
+                future.add_done_callback(functools.partial(self._log_export_failure, model_name))
+
+    @staticmethod
+    def _log_export_failure(model_name: str, future: Future) -> None:
+        """バックグラウンドのエクスポートが失敗した場合にログを出力（モデルの使用時に再試行される）"""
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Background export failed for %s: %s", model_name, future.exception())
+
+    def _warmup_model(self, model, tokenizer, model_name: str) -> None:
+        """
+        バッチサイズ分の短い文で1回生成し、推論リクエストの確保やカーネルの初期化を済ませる
+
+        失敗してもロード自体は続行する
+        """
+        try:
+            inputs = tokenizer(["Hello, how are you?"] * self.batch_size, return_tensors="pt", padding=True)
+            model.generate(**inputs, max_new_tokens=2)
+            logger.info("Translation model warmed up: %s", model_name)
+        except Exception as e:
+            logger.warning("Warmup failed for %s: %s", model_name, e)
+
+    def _evict_models_locked(self) -> list:
+        """
+        上限を超えた分のモデルを使用順の古いものから登録解除（_models_lock を保持した状態で呼び出すこと）
+
+        Returns:
+            登録解除したモデル（呼び出し側がロックの外で参照を手放す）
+        """
+        evicted = []
+        while len(self.loaded_models) > self.model_capacity:
+            model_name, loaded = self.loaded_models.popitem(last=False)
+            evicted.append(loaded)
+            logger.info("Unloaded least recently used translation model: %s", model_name)
+        return evicted
+
+    def _get_model_path(self, model_name: str) -> Path:
+        """エクスポート済みモデルの保存先を取得（量子化形式ごとに分ける）"""
+        suffix = "" if self.quantization == "fp16" else f"_{self.quantization}"
+        return self.cache_dir / (model_name.replace("/", "_") + suffix)
+
+    def _get_quantization_config(self) -> Optional[OVWeightQuantizationConfig]:
+        """エクスポート時に使用する重み量子化設定を取得"""
+        preset = QUANTIZATION_PRESETS[self.quantization]
+        if preset is None:
+            return None
+        return OVWeightQuantizationConfig(**preset)
+
+    def _get_ov_config(self) -> Dict[str, str]:
+        """OpenVINOランタイムのコンパイル設定を取得"""
+        # コンパイル済みモデルをディスクに保存し、次回以降のプロセスではコンパイルを省く
+        ov_config = {"PERFORMANCE_HINT": self.performance_hint, "CACHE_DIR": str(self.cache_dir / "ov_cache")}
+        if self.num_streams:
+            ov_config["NUM_STREAMS"] = self.num_streams
+        return ov_config
 
     def translate(self, text: str, target_lang: str, source_lang: Optional[str] = None) -> dict:
         """
@@ -89,87 +601,262 @@ class TranslationService:
             翻訳結果を含む辞書
         """
         try:
-            # ソース言語が指定されていない場合は英語と仮定
+            # ソース言語が指定されていない場合は自動検出
             if source_lang is None:
                 source_lang = self._detect_language(text)
 
-            # 同じ言語の場合はそのまま返す
-            if source_lang == target_lang:
-                return {
-                    "translated_text": text,
-                    "source_lang": source_lang,
-                    "target_lang": target_lang,
-                    "original_text": text,
-                }
+            return self._translate_group([text], source_lang, target_lang)[0]
+
+        except Exception as e:
+            logger.error("Translation error: %s", e)
+            return {"error": str(e), "original_text": text}
+
+    def translate_batch(self, texts: List[str], target_lang: str, source_lang: Optional[str] = None) -> List[dict]:
+        """
+        複数のテキストをまとめて翻訳
+
+        Args:
+            texts: 翻訳するテキストのリスト
+            target_lang: ターゲット言語コード
+            source_lang: ソース言語コード (オプション。指定しない場合はテキストごとに自動検出)
+
+        Returns:
+            入力と同じ順序の翻訳結果（各要素は translate と同じ形式の辞書）
+        """
+        # 同じモデルを使う入力を1回のパイプライン呼び出しで処理できるよう、ソース言語ごとにまとめる
+        groups: Dict[str, List[int]] = {}
+        for i, text in enumerate(texts):
+            lang = source_lang if source_lang is not None else self._detect_language(text)
+            groups.setdefault(lang, []).append(i)
+
+        results: List[Optional[dict]] = [None] * len(texts)
+        for lang, indices in groups.items():
+            group_texts = [texts[i] for i in indices]
+            try:
+                group_results = self._translate_group(group_texts, lang, target_lang)
+            except Exception as e:
+                logger.error("Translation error: %s", e)
+                group_results = [{"error": str(e), "original_text": text} for text in group_texts]
+
+            for i, result in zip(indices, group_results):
+                results[i] = result
 
-            model_name = self._get_model_name(source_lang, target_lang)
+        return results
 
-            if model_name is None:
-                # 英語を経由して翻訳
-                if source_lang != "en" and target_lang != "en":
-                    # source -> en -> target
-                    intermediate_model = self._get_model_name(source_lang, "en")
-                    final_model = self._get_model_name("en", target_lang)
+    async def translate_async(self, text: str, target_lang: str, source_lang: Optional[str] = None) -> dict:
+        """
+        イベントループを止めずにテキストを翻訳（結果の形式は translate と同じ）
+
+        batch_requests が有効な場合は、同時に届いた他のリクエストとまとめて推論する
+        """
+        if self._batcher is None:
+            return await asyncio.to_thread(self.translate, text, target_lang, source_lang)
+
+        try:
+            # 言語の自動検出もバッチ処理のスレッドで行う（lingua の判別はイベントループを止めるため）
+            return await asyncio.wrap_future(self._batcher.submit(text, source_lang, target_lang))
+
+        except Exception as e:
+            logger.error("Translation error: %s", e)
+            return {"error": str(e), "original_text": text}
+
+    def close(self) -> None:
+        """バックグラウンドのスレッドとスレッドプールを停止し、永続キャッシュを閉じる"""
+        if self._batcher is not None:
+            self._batcher.close()
+        if self._export_executor is not None:
+            self._export_executor.shutdown(wait=False, cancel_futures=True)
+        if self._persistent_cache is not None:
+            self._persistent_cache.close()
+
+    def _translate_group(self, texts: List[str], source_lang: str, target_lang: str) -> List[dict]:
+        """ソース言語が同じテキストをまとめて翻訳（キャッシュ済みの結果と翻訳不要な入力はモデルに渡さない）"""
+        # 同じ言語の場合は翻訳せずにそのまま返す（キャッシュに入れて実際の翻訳結果を追い出さない）
+        if source_lang == target_lang:
+            return [_passthrough_result(text, source_lang, target_lang) for text in texts]
+
+        results = [
+            (
+                _passthrough_result(text, source_lang, target_lang)
+                if _is_passthrough(text)
+                else self._get_cached_result(source_lang, target_lang, text)
+            )
+            for text in texts
+        ]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+
+        translated = self._translate_uncached([texts[i] for i in missing], source_lang, target_lang)
+        persistent_entries = []
+        for i, result in zip(missing, translated):
+            results[i] = result
+            # エラーは一時的な場合があるためキャッシュしない
+            if "error" not in result:
+                self._cache_result(source_lang, target_lang, texts[i], result)
+                persistent_entries.append((source_lang, target_lang, texts[i], result))
+
+        if self._persistent_cache is not None and persistent_entries:
+            self._persistent_cache.put_many(persistent_entries)
+
+        return results
+
+    def _get_cached_result(self, source_lang: str, target_lang: str, text: str) -> Optional[dict]:
+        """キャッシュ済みの翻訳結果を取得（呼び出し側が変更してもキャッシュに影響しないよう毎回辞書を作る）"""
+        key = (source_lang, target_lang, text)
+        with self._result_cache_lock:
+            cached = self._result_cache.get(key)
+            if cached is not None:
+                self._result_cache.move_to_end(key)
+        if cached is not None:
+            return cached.to_result(text, source_lang, target_lang)
+
+        # メモリになければディスクを参照し、見つかればメモリにも載せる
+        if self._persistent_cache is None:
+            return None
+        result = self._persistent_cache.get(source_lang, target_lang, text)
+        if result is not None:
+            self._cache_result(source_lang, target_lang, text, result)
+        return result
+
+    def _cache_result(self, source_lang: str, target_lang: str, text: str, result: dict) -> None:
+        """翻訳結果をキャッシュ（上限を超えたら最も古いものから削除）"""
+        if self.result_cache_size <= 0:
+            return
+
+        cached = _CachedTranslation(result["translated_text"], result.get("via_english", False))
+        with self._result_cache_lock:
+            self._result_cache[(source_lang, target_lang, text)] = cached
+            while len(self._result_cache) > self.result_cache_size:
+                self._result_cache.popitem(last=False)
 
-                    if intermediate_model and final_model:
-                        translator1 = self._load_model(intermediate_model)
-                        english_text = translator1(text)[0]["translation_text"]
+    def _translate_uncached(self, texts: List[str], source_lang: str, target_lang: str) -> List[dict]:
+        """ソース言語が同じテキストをモデルで翻訳（ソース言語とターゲット言語は異なること）"""
+        model_name = self._get_model_name(source_lang, target_lang)
 
-                        translator2 = self._load_model(final_model)
-                        translated = translator2(english_text)[0]["translation_text"]
+        if model_name is None:
+            # 英語を経由して翻訳
+            if source_lang != "en" and target_lang != "en":
+                # source -> en -> target
+                intermediate_model = self._get_model_name(source_lang, "en")
+                final_model = self._get_model_name("en", target_lang)
 
-                        return {
+                if intermediate_model and final_model:
+                    # 各段階をまとめて処理し、中間の英語文をそのまま次の段階に渡す
+                    english_texts = self._run_translator(intermediate_model, texts)
+                    translated_texts = self._run_translator(final_model, english_texts)
+
+                    return [
+                        {
                             "translated_text": translated,
                             "source_lang": source_lang,
                             "target_lang": target_lang,
                             "original_text": text,
                             "via_english": True,
                         }
+                        for text, translated in zip(texts, translated_texts)
+                    ]
 
-                return {
+            return [
+                {
                     "error": f"Translation from {source_lang} to {target_lang} is not supported",
                     "source_lang": source_lang,
                     "target_lang": target_lang,
                 }
+                for _ in texts
+            ]
 
-            translator = self._load_model(model_name)
-            result = translator(text)
-            translated_text = result[0]["translation_text"]
+        translated_texts = self._run_translator(
+            model_name, texts, **self._get_language_kwargs(model_name, source_lang, target_lang)
+        )
 
-            return {
-                "translated_text": translated_text,
+        return [
+            {
+                "translated_text": translated,
                 "source_lang": source_lang,
                 "target_lang": target_lang,
                 "original_text": text,
             }
+            for text, translated in zip(texts, translated_texts)
+        ]
 
-        except Exception as e:
-            logger.error(f"Translation error: {e}")
-            return {"error": str(e), "original_text": text}
+    def _run_translator(
+        self, model_name: str, texts: List[str], src_lang: Optional[str] = None, tgt_lang: Optional[str] = None
+    ) -> List[str]:
+        """長さの近い入力同士でバッチを組み、まとめて推論"""
+        loaded = self._load_model(model_name)
+
+        # 1バッチに収まる場合は並べ替えても効果がない
+        if len(texts) <= self.batch_size:
+            return self._generate(loaded, self._encode(loaded, texts, src_lang, return_tensors="pt", padding=True), tgt_lang)
+
+        # 全件を1回だけトークナイズし、バッチ内で最も長い入力に合わせてパディングされるため、
+        # トークン数の順に並べてから分割してバッチごとにパディングのみ行う
+        encodings = self._encode(loaded, texts, src_lang)
+        input_ids = encodings["input_ids"]
+        attention_mask = encodings["attention_mask"]
+        order = sorted(range(len(texts)), key=lambda i: len(input_ids[i]))
+
+        translated: List[Optional[str]] = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            chunk = order[start : start + self.batch_size]
+            inputs = loaded.tokenizer.pad(
+                {"input_ids": [input_ids[i] for i in chunk], "attention_mask": [attention_mask[i] for i in chunk]},
+                return_tensors="pt",
+            )
+            for i, text in zip(chunk, self._generate(loaded, inputs, tgt_lang)):
+                translated[i] = text
+
+        return translated
+
+    def _encode(self, loaded: _LoadedModel, texts: List[str], src_lang: Optional[str] = None, **tokenizer_kwargs):
+        """テキストをトークナイズ（多言語モデルではソース言語を設定してから行う）"""
+        tokenizer = loaded.tokenizer
+        if src_lang is None:
+            return tokenizer(texts, truncation=True, **tokenizer_kwargs)
+
+        with loaded.tokenizer_lock:
+            tokenizer.src_lang = src_lang
+            return tokenizer(texts, truncation=True, **tokenizer_kwargs)
+
+    def _generate(self, loaded: _LoadedModel, inputs, tgt_lang: Optional[str] = None) -> List[str]:
+        """
+        1バッチ分のトークナイズ済み入力でモデルの generate を直接呼び出してデコード
+        （pipeline を経由せず、サンプルごとの前後処理と結果辞書の作成を省く）
+        """
+        generate_kwargs = {}
+        if self.num_beams is not None:
+            generate_kwargs["num_beams"] = self.num_beams
+        if tgt_lang is not None:
+            # 出力の先頭をターゲット言語のトークンに固定する
+            generate_kwargs["forced_bos_token_id"] = loaded.tokenizer.convert_tokens_to_ids(tgt_lang)
+
+        output_ids = loaded.model.generate(**inputs, **generate_kwargs)
+        return loaded.tokenizer.batch_decode(output_ids, skip_special_tokens=True)
 
     def _detect_language(self, text: str) -> str:
         """
-        簡易的な言語検出
-        実際のプロダクションでは、より高度な言語検出ライブラリを使用することを推奨
+        言語検出
+        文字種で判別できる言語は正規表現で判定し、ラテン文字の文は lingua があればそれで判別する
         """
-        # 日本語文字を含む場合
-        if any("\u3040" <= char <= "\u309f" or "\u30a0" <= char <= "\u30ff" or "\u4e00" <= char <= "\u9fff" for char in text):
+        # ひらがな・カタカナを含む場合は日本語
+        if _KANA_RE.search(text):
             return "ja"
-        # 中国語文字を含む場合
-        elif any("\u4e00" <= char <= "\u9fff" for char in text):
+        # ハングルを含む場合は韓国語（翻訳は未対応のためエラーとして返る）
+        if _HANGUL_RE.search(text):
+            return "ko"
+        # かなを含まない漢字のみの文は中国語
+        if _CJK_RE.search(text):
             return "zh"
+        # キリル文字はサポート言語のうちロシア語のみ
+        if _CYRILLIC_RE.search(text):
+            return "ru"
+        # ラテン文字の文は英語・フランス語・ドイツ語・スペイン語を判別
+        if LINGUA_AVAILABLE:
+            return _detect_latin_language(text)
         # デフォルトは英語
-        else:
-            return "en"
+        return "en"
 
     def get_supported_languages(self) -> list:
         """サポートされている言語のリストを返す"""
-        return [
-            {"code": "en", "name": "English"},
-            {"code": "ja", "name": "Japanese (日本語)"},
-            {"code": "zh", "name": "Chinese (中文)"},
-            {"code": "fr", "name": "French (Français)"},
-            {"code": "de", "name": "German (Deutsch)"},
-            {"code": "es", "name": "Spanish (Español)"},
-            {"code": "ru", "name": "Russian (Русский)"},
-        ]
+        return list(_SUPPORTED_LANGUAGES)